@@ -0,0 +1,478 @@
+"""
+Benchmarks every route of the trivia API against seeded synthetic catalogs.
+
+    python benchmark.py --sizes 1000,100000 --output before.json
+    python benchmark.py --sizes 1000,100000 --compare before.json
+
+The application is built with create_app() on a local sqlite database per
+catalog size (reused across runs) or on --database-url, and driven through
+the Flask test client, a local threaded server (--mode server) or an
+already running server (--url, e.g. gunicorn or uvicorn on the same
+database). Throughput and p50/p95/p99 latencies are printed per route and
+written as JSON with --output. The environment variables of the server
+(CATALOG_SNAPSHOT, JSON_BACKEND...) apply, so variants can be compared.
+"""
+import argparse
+import json
+import math
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+from itertools import count, islice
+from os import path
+from time import perf_counter
+from typing import (
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple
+)
+import sqlalchemy
+from sqlalchemy import func
+
+from flaskr import create_app
+from flaskr.cache import category_cache
+from flaskr.catalog import CATALOG_SNAPSHOT
+from flaskr.models import (
+    db,
+    Category,
+    Question,
+    notify_question_change
+)
+from flaskr.serialization import JSON_BACKEND
+
+CATEGORY_NAMES: Tuple[str, ...] = (
+    "Science", "Art", "Geography", "History", "Entertainment", "Sports")
+DEFAULT_SIZES: str = "1000,100000"
+SEED_BATCH_SIZE: int = 10000
+VOCABULARY_SIZE: int = 5000
+WORDS_PER_QUESTION: int = 8
+PERCENTILES: Tuple[int, ...] = (50, 95, 99)
+
+# (method, path, json body, raw body, headers)
+Request = Tuple[str, str, Optional[object], Optional[bytes], Optional[dict]]
+
+
+@dataclass
+class Catalog:
+    size: int
+    min_id: int
+    max_id: int
+    categories: List[int]
+    common_word: str
+    rare_word: str
+    # ids the write scenarios are expected to have created, in order
+    created_ids: Iterator[int] = field(default_factory=lambda: count(1))
+
+
+@dataclass
+class Scenario:
+    name: str
+    build: Callable[[random.Random, Catalog], Request]
+    expected: Tuple[int, ...] = (200,)
+    # fraction of --requests issued, for the routes reading whole tables
+    weight: float = 1.0
+
+
+@dataclass
+class Result:
+    catalog: int
+    scenario: str
+    requests: int
+    errors: int
+    seconds: float
+    throughput: float
+    mean_ms: float
+    latency_ms: Dict[str, float] = field(default_factory=dict)
+
+
+def word(rank: int) -> str:
+    return f"w{rank}"
+
+
+def synthetic_questions(size: int, categories: List[int],
+                        rng: random.Random):
+    """
+    synthetic_questions(size, categories, rng)
+        yields question rows whose words follow a Zipf distribution, so that
+        searches for common and rare terms behave as on real text.
+    """
+    ranks = range(1, VOCABULARY_SIZE + 1)
+    weights = [1 / rank for rank in ranks]
+    for _ in range(size):
+        words = rng.choices(ranks, weights, k=WORDS_PER_QUESTION)
+        yield {
+            "question": " ".join(word(r) for r in words[:-2]) + "?",
+            "answer": " ".join(word(r) for r in words[-2:]),
+            "category": rng.choice(categories),
+            "difficulty": rng.randint(1, 5)
+        }
+
+
+def seed_catalog(app, size: int, seed: int, reset: bool) -> Catalog:
+    """
+    seed_catalog(app, size, seed, reset)
+        fills the database with `size` synthetic questions, unless it
+        already holds exactly that many. A database holding another
+        catalog is only emptied with `reset`.
+    """
+    with app.app_context():
+        db.create_all()
+        rows = db.session.query(func.count(Question.id)).scalar()
+        if rows != size:
+            if rows and not reset:
+                sys.exit(f"{app.config['SQLALCHEMY_DATABASE_URI']} holds "
+                         f"{rows} questions, rerun with --reset to replace "
+                         f"them with {size}.")
+            print(f"seeding {size} questions...", file=sys.stderr)
+            db.session.execute(Question.__table__.delete())
+            db.session.execute(Category.__table__.delete())
+            db.session.execute(Category.__table__.insert(),
+                               [{"type": name} for name in CATEGORY_NAMES])
+            categories = [c.id for c in Category.query.all()]
+            questions = synthetic_questions(
+                size, categories, random.Random(seed))
+            while True:
+                batch = list(islice(questions, SEED_BATCH_SIZE))
+                if not batch:
+                    break
+                db.session.execute(Question.__table__.insert(), batch)
+            db.session.commit()
+
+        min_id, max_id = db.session.query(
+            func.min(Question.id), func.max(Question.id)).one()
+        catalog = Catalog(
+            size=size, min_id=min_id or 0, max_id=max_id or 0,
+            categories=[c.id for c in Category.query.order_by(Category.id)],
+            common_word=word(1), rare_word=word(VOCABULARY_SIZE // 2),
+            created_ids=count((max_id or 0) + 1))
+        db.session.remove()
+    # every catalog starts from cold caches
+    notify_question_change("reload", [])
+    category_cache.invalidate()
+    return catalog
+
+
+def random_id(rng: random.Random, catalog: Catalog) -> int:
+    return rng.randint(catalog.min_id, catalog.max_id)
+
+
+def new_question(rng: random.Random, catalog: Catalog) -> dict:
+    return {"question": "benchmark question?", "answer": "benchmark",
+            "category": rng.choice(catalog.categories),
+            "difficulty": rng.randint(1, 5)}
+
+
+SCENARIOS: List[Scenario] = [
+    Scenario("categories", lambda rng, c: (
+        "GET", "/api/v1/categories", None, None, None)),
+    Scenario("category_by_id", lambda rng, c: (
+        "GET", f"/api/v1/categories/{rng.choice(c.categories)}",
+        None, None, None)),
+    Scenario("questions_first_page", lambda rng, c: (
+        "GET", "/api/v1/questions", None, None, None)),
+    Scenario("questions_deep_page", lambda rng, c: (
+        "GET", f"/api/v1/questions?page={max(c.size // 20, 1)}",
+        None, None, None)),
+    Scenario("questions_deep_page_fields", lambda rng, c: (
+        "GET", f"/api/v1/questions?page={max(c.size // 20, 1)}"
+        "&fields=question,category", None, None, None)),
+    Scenario("questions_after_id", lambda rng, c: (
+        "GET", f"/api/v1/questions?after_id={random_id(rng, c)}",
+        None, None, None)),
+    Scenario("question_by_id", lambda rng, c: (
+        "GET", f"/api/v1/questions/{random_id(rng, c)}", None, None, None),
+        expected=(200, 404)),
+    Scenario("questions_by_ids", lambda rng, c: (
+        "GET", "/api/v1/questions?ids=" + ",".join(
+            str(random_id(rng, c)) for _ in range(20)), None, None, None)),
+    Scenario("category_questions", lambda rng, c: (
+        "GET", f"/api/v1/categories/{rng.choice(c.categories)}/questions",
+        None, None, None)),
+    Scenario("search_common_term", lambda rng, c: (
+        "POST", "/api/v1/questions/search-term",
+        {"search_term": c.common_word}, None, None)),
+    Scenario("search_rare_term", lambda rng, c: (
+        "POST", "/api/v1/questions/search-term",
+        {"search_term": c.rare_word}, None, None)),
+    Scenario("quiz_question", lambda rng, c: (
+        "POST", "/api/v1/questions/quizzes",
+        {"quiz_category": {"id": rng.choice([0] + c.categories)},
+         "previous_questions": [random_id(rng, c) for _ in range(5)]},
+        None, None)),
+    Scenario("quiz_session", lambda rng, c: (
+        "POST", "/api/v1/questions/quizzes/sessions",
+        {"quiz_category": {"id": rng.choice(c.categories)}}, None, None),
+        expected=(201,), weight=0.1),
+    Scenario("create_question", lambda rng, c: (
+        "POST", "/api/v1/questions", new_question(rng, c), None, None),
+        expected=(201,)),
+    Scenario("import_questions", lambda rng, c: (
+        "POST", "/api/v1/questions/import", None,
+        b"\n".join(json.dumps(new_question(rng, c)).encode()
+                   for _ in range(100)),
+        {"Content-Type": "application/x-ndjson"}),
+        expected=(201,), weight=0.05),
+    Scenario("export_category", lambda rng, c: (
+        "GET", f"/api/v1/questions/export?category={c.categories[0]}",
+        None, None, {"Accept-Encoding": "gzip"}), weight=0.02),
+    Scenario("delete_question", lambda rng, c: (
+        "DELETE", f"/api/v1/questions/{next(c.created_ids)}",
+        None, None, None), expected=(204,))
+]
+
+
+class ClientDriver:
+    """Drives the application in process through the Flask test client."""
+    concurrency = 1
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def send(self, request: Request) -> int:
+        method, url, body, data, headers = request
+        response = self.client.open(url, method=method, json=body,
+                                    data=data, headers=headers)
+        response.get_data()
+        return response.status_code
+
+    def close(self) -> None:
+        pass
+
+
+class HttpDriver:
+    """Drives a server over HTTP with `concurrency` keep-alive clients."""
+
+    def __init__(self, base_url: str, concurrency: int):
+        import requests
+        self.requests = requests
+        self.base_url = base_url.rstrip("/")
+        self.concurrency = concurrency
+        self.local = threading.local()
+
+    def send(self, request: Request) -> int:
+        method, url, body, data, headers = request
+        session = getattr(self.local, "session", None)
+        if session is None:
+            session = self.local.session = self.requests.Session()
+        response = session.request(method, self.base_url + url, json=body,
+                                   data=data, headers=headers)
+        return response.status_code
+
+    def close(self) -> None:
+        pass
+
+
+class ServerDriver(HttpDriver):
+    """Serves the application with a local threaded werkzeug server."""
+
+    def __init__(self, app, concurrency: int):
+        from werkzeug.serving import make_server
+        self.server = make_server("127.0.0.1", 0, app, threaded=True)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        super().__init__(f"http://127.0.0.1:{self.server.server_port}",
+                         concurrency)
+
+    def close(self) -> None:
+        self.server.shutdown()
+
+
+def percentile(samples: List[float], pct: int) -> float:
+    """nearest-rank percentile of sorted samples"""
+    return samples[max(math.ceil(pct / 100 * len(samples)) - 1, 0)]
+
+
+def run_scenario(driver, scenario: Scenario, catalog: Catalog,
+                 count: int, warmup: int, rng: random.Random) -> Result:
+    requests = [scenario.build(rng, catalog) for _ in range(warmup + count)]
+    for request in requests[:warmup]:
+        driver.send(request)
+
+    def timed(request: Request) -> Tuple[float, int]:
+        start = perf_counter()
+        status = driver.send(request)
+        return perf_counter() - start, status
+
+    start = perf_counter()
+    if driver.concurrency > 1:
+        with ThreadPoolExecutor(driver.concurrency) as pool:
+            samples = list(pool.map(timed, requests[warmup:]))
+    else:
+        samples = [timed(request) for request in requests[warmup:]]
+    seconds = perf_counter() - start
+
+    latencies = sorted(latency * 1000 for latency, _ in samples)
+    return Result(
+        catalog=catalog.size,
+        scenario=scenario.name,
+        requests=count,
+        errors=sum(status not in scenario.expected for _, status in samples),
+        seconds=round(seconds, 3),
+        throughput=round(count / seconds, 1),
+        mean_ms=round(sum(latencies) / count, 3),
+        latency_ms={f"p{pct}": round(percentile(latencies, pct), 3)
+                    for pct in PERCENTILES})
+
+
+def drop_benchmark_writes(app, catalog: Catalog) -> None:
+    """removes the questions created by the write scenarios"""
+    with app.app_context():
+        db.session.execute(Question.__table__.delete().where(
+            Question.id > catalog.max_id))
+        db.session.commit()
+        db.session.remove()
+    notify_question_change("reload", [])
+
+
+def database_url(args, size: int) -> str:
+    if args.database_url:
+        return args.database_url
+    return "sqlite:///" + path.join(args.data_dir, f"trivia-bench-{size}.db")
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+            text=True, check=True, cwd=path.dirname(path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results: List[Result],
+                  baseline: Optional[Dict[Tuple[int, str], dict]]) -> None:
+    header = f"{'catalog':>8} {'scenario':<22} {'req/s':>9} {'mean':>8} " + \
+        " ".join(f"{'p' + str(p):>8}" for p in PERCENTILES) + f" {'errors':>6}"
+    if baseline:
+        header += f" {'req/s vs':>9} {'p50 vs':>8}"
+    print(header)
+    for r in results:
+        line = f"{r.catalog:>8} {r.scenario:<22} {r.throughput:>9.1f} " \
+            f"{r.mean_ms:>8.2f} " + " ".join(
+                f"{r.latency_ms[f'p{p}']:>8.2f}" for p in PERCENTILES) + \
+            f" {r.errors:>6}"
+        before = (baseline or {}).get((r.catalog, r.scenario))
+        if before:
+            line += f" {r.throughput / before['throughput']:>8.2f}x" \
+                f" {r.latency_ms['p50'] / before['latency_ms']['p50']:>7.2f}x"
+        print(line)
+    print("(latencies in milliseconds)")
+
+
+def load_baseline(filename: str) -> Dict[Tuple[int, str], dict]:
+    with open(filename) as f:
+        return {(r["catalog"], r["scenario"]): r
+                for r in json.load(f)["results"]}
+
+
+def parse_args(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", default=DEFAULT_SIZES,
+                        help="comma separated catalog sizes, "
+                             "e.g. 1000,1000000")
+    parser.add_argument("--database-url",
+                        help="database to seed and benchmark (one size only), "
+                             "a sqlite file per size by default")
+    parser.add_argument("--data-dir", default=tempfile.gettempdir(),
+                        help="directory of the default sqlite databases")
+    parser.add_argument("--reset", action="store_true",
+                        help="replace a catalog of another size")
+    parser.add_argument("--mode", choices=("client", "server"),
+                        default="client",
+                        help="Flask test client or local threaded server")
+    parser.add_argument("--url",
+                        help="benchmark a running server using --database-url")
+    parser.add_argument("--concurrency", type=int, default=1,
+                        help="concurrent clients in server and url modes")
+    parser.add_argument("--requests", type=int, default=500,
+                        help="requests per scenario")
+    parser.add_argument("--warmup", type=int, default=20,
+                        help="unmeasured requests per scenario")
+    parser.add_argument("--scenarios",
+                        help="comma separated subset of "
+                             + ", ".join(s.name for s in SCENARIOS))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results as JSON")
+    parser.add_argument("--compare", help="JSON results to compare with")
+    args = parser.parse_args(argv)
+
+    args.sizes = [int(size) for size in args.sizes.split(",")]
+    if (args.database_url or args.url) and len(args.sizes) > 1:
+        parser.error("--database-url and --url take a single size.")
+    if args.url and not args.database_url:
+        parser.error("--url requires the --database-url of the server.")
+    names = {s.name for s in SCENARIOS}
+    if args.scenarios:
+        args.scenarios = args.scenarios.split(",")
+        unknown = set(args.scenarios) - names
+        if unknown:
+            parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    else:
+        args.scenarios = [s.name for s in SCENARIOS]
+    return args
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    baseline = load_baseline(args.compare) if args.compare else None
+    scenarios = [s for s in SCENARIOS if s.name in args.scenarios]
+    results: List[Result] = []
+    dialect = None
+
+    for size in args.sizes:
+        app = create_app({"SQLALCHEMY_DATABASE_URI": database_url(args, size)})
+        catalog = seed_catalog(app, size, args.seed, args.reset)
+        with app.app_context():
+            dialect = db.engine.dialect.name
+        if args.url:
+            driver = HttpDriver(args.url, args.concurrency)
+        elif args.mode == "server":
+            driver = ServerDriver(app, args.concurrency)
+        else:
+            driver = ClientDriver(app)
+
+        rng = random.Random(args.seed)
+        try:
+            for scenario in scenarios:
+                count = max(int(args.requests * scenario.weight), 1)
+                warmup = min(args.warmup, count)
+                results.append(run_scenario(
+                    driver, scenario, catalog, count, warmup, rng))
+                print(f"{size:>8} {scenario.name:<22} done", file=sys.stderr)
+        finally:
+            driver.close()
+            drop_benchmark_writes(app, catalog)
+
+    print_results(results, baseline)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "meta": {
+                    "date": datetime.now(timezone.utc).isoformat(),
+                    "revision": git_revision(),
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "sqlalchemy": sqlalchemy.__version__,
+                    "database": dialect,
+                    "driver": args.url or args.mode,
+                    "concurrency": 1 if args.mode == "client" and not args.url
+                    else args.concurrency,
+                    "json_backend": JSON_BACKEND,
+                    "catalog_snapshot": CATALOG_SNAPSHOT,
+                    "seed": args.seed
+                },
+                "results": [asdict(r) for r in results]
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,83 +1,209 @@
 from re import S
 from flask import (
     Flask,
+    Response,
     request,
     abort,
-    jsonify
+    jsonify,
+    stream_with_context
 )
 from werkzeug.exceptions import (
     BadRequest,
+    Gone,
     MethodNotAllowed,
     NotFound,
+    ServiceUnavailable,
     UnprocessableEntity
 )
 from flask_cors import CORS
 from typing import (
-    Iterable,
     List,
     Optional
 )
-from dataclasses import dataclass
+from io import TextIOWrapper
 import logging
-from .models import setup_db, Question, Category
+from .models import setup_db, db, Question
+from .payloads import (
+    MSG_UNPROCESSABLE,
+    BulkQuestionsPayload,
+    QuestionIdsPayload,
+    QuestionPayload,
+    QuizPayload
+)
+from .pagination import (
+    NEXT_CURSOR_HEADER,
+    Page,
+    PageArgs,
+    get_page_args,
+    page_envelope,
+    paged_response,
+    wants_envelope
+)
+from .search import question_search
+from .migrations import (
+    init_db_command,
+    migrate_question_category_command
+)
+from .serialization import (
+    format_row,
+    init_json,
+    json_response
+)
+from .metrics import (
+    SERVER_TIMING_HEADER,
+    init_metrics
+)
+from .slow_queries import init_slow_query_log
+from .profiling import init_profiling
+from .group_commit import (
+    init_group_commit,
+    insert_question
+)
+from .replicas import (
+    READ_PRIMARY_HEADER,
+    init_replicas,
+    replica_reads
+)
+from .export import export_questions, parse_export_category
+from .compression import (
+    choose_encoding,
+    compress_chunks,
+    init_compression
+)
+from .bulk import (
+    CONTENT_TYPE_FORMATS,
+    bulk_delete_questions,
+    bulk_update_questions,
+    import_questions,
+    import_questions_command,
+    parse_stream
+)
+from .changes import (
+    get_changes,
+    parse_changes_args,
+    prune_question_changes_command
+)
+from .catalog import (
+    CATALOG_SNAPSHOT,
+    Fields,
+    get_question,
+    get_questions_by_ids,
+    get_questions_page,
+    parse_fields,
+    question_catalog
+)
+from .cache import (
+    category_cache,
+    conditional_get
+)
+from .quiz import (
+    ALL_CATEGORIES,
+    quiz_sampler,
+    quiz_sessions
+)
 from flasgger import (
     Swagger,
     swag_from
 )
 
-QUESTIONS_PER_PAGE = 10
 METHOD_NOT_ALLOWED: str = "You cannot use this endpoint to perform a {method} request."
-MSG_UNPROCESSABLE: str = "Make sur that {params} are not null."
 
 
-@dataclass(frozen=True)
-class QuestionPayload:
-    question: Optional[str] = None
-    answer: Optional[str] = None
-    category: Optional[str] = None
-    difficulty: Optional[str] = None
+def questions_response(page: Page, args: PageArgs,
+                       category: Optional[int] = None) -> Response:
+    """
+    questions_response(page, args, category)
+        a page of questions as a JSON list or, with ?envelope=1, wrapped
+        with the total, the pagination, the current category and the
+        categories, sparing the client the requests fetching them.
+    """
+    if not wants_envelope(request.args):
+        return paged_response(page)
+    return paged_response(page, page_envelope(
+        page, args,
+        current_category=category,
+        categories=category_cache.types()))
 
-    def get_null_fields(self) -> List[str]:
-        problematic_keys = filter(
-            lambda k: k[1] is None,
-            self.__dict__.items())
-        return [el[0] for el in problematic_keys]
 
+def questions_page_response(args: PageArgs, category: Optional[int] = None,
+                            fields: Fields = None) -> Response:
+    """
+    questions_page_response(args, category, fields)
+        questions_response() of a page of the catalog, restricted to
+        `fields` when set. With CATALOG_SNAPSHOT, list pages come
+        serialized and precompressed from the snapshot's cache of pages.
+    """
+    envelope = wants_envelope(request.args)
+    if CATALOG_SNAPSHOT and not envelope:
+        return question_catalog.cached_page(
+            args, category, fields).to_response()
+    return questions_response(get_questions_page(
+        args, category=category, with_total=envelope, fields=fields),
+        args, category)
 
-def paginate(results: Iterable, start_at: int) -> List[object]:
-    start = (start_at - 1) * QUESTIONS_PER_PAGE
-    end = start + QUESTIONS_PER_PAGE
-    return results[start:end]
+
+def questions_batch_response(payload: QuestionIdsPayload,
+                             fields: Fields = None) -> Response:
+    """
+    questions_batch_response(payload, fields)
+        the questions of a list of ids, in the requested order, with the
+        ids of no question under `missing`.
+    """
+    errors = payload.get_errors()
+    if errors:
+        raise BadRequest(" ".join(errors))
+    questions, missing = get_questions_by_ids(payload.to_ids(), fields)
+    return json_response({
+        "questions": [format_row(question) for question in questions],
+        "missing": missing
+    })
 
 
 def create_app(test_config=None):
     # create and configure the app
     app = Flask(__name__)
-    setup_db(app)
+    if test_config is None:
+        setup_db(app)
+    else:
+        setup_db(app, test_config["SQLALCHEMY_DATABASE_URI"])
     CORS(app, resources={r"/api/*": {"origins": "*"}})
     swagger = Swagger(app)
+    init_json(app)
+    init_metrics(app)
+    init_slow_query_log()
+    init_profiling(app)
+    init_compression(app)
+    init_replicas(app)
+    init_group_commit(app)
+    app.cli.add_command(init_db_command)
+    app.cli.add_command(import_questions_command)
+    app.cli.add_command(migrate_question_category_command)
+    app.cli.add_command(prune_question_changes_command)
 
     @app.after_request
     def after_request(response):
         response.headers.add(
             "Access-Control-Allow-Headers",
-            "Content-Type,Authorization")
+            f"Content-Type,Authorization,{READ_PRIMARY_HEADER}")
         response.headers.add(
             "Access-Control-Allow-Origins",
             "http://localhost:3000, http://172.25.0.1:3000, http://trivia-frontend:3000")
-        response.headers.add("Access-Control-Allow-Methods", "GET,POST,DELETE")
+        response.headers.add("Access-Control-Allow-Methods",
+                             "GET,POST,PATCH,DELETE")
         response.headers.add("Access-Control-Allow-Credentials", "true")
+        response.headers.add(
+            "Access-Control-Expose-Headers",
+            f"{NEXT_CURSOR_HEADER},ETag,{SERVER_TIMING_HEADER}")
+        response.headers.add("Timing-Allow-Origin", "*")
         return response
 
     @app.route("/api/v1/categories")
     @swag_from("docs/categories.yaml")
+    @replica_reads()
+    @conditional_get(etag=lambda: category_cache.etag(args=get_page_args()))
     def get_categories() -> List[dict]:
         try:
-            categories: List[Category] = paginate(
-                results=Category.query.all(),
-                start_at=request.args.get("page", 1, type=int)
-            )
-            return jsonify([cat.format() for cat in categories])
+            return category_cache.page(get_page_args()).to_response()
         except MethodNotAllowed:
             abort(405, METHOD_NOT_ALLOWED.format(request.method))
         else:
@@ -85,12 +211,14 @@ def create_app(test_config=None):
 
     @app.route("/api/v1/categories/<int:id>")
     @swag_from("docs/categories_by_id.yaml")
+    @replica_reads()
+    @conditional_get(etag=lambda id: category_cache.etag(category_id=id))
     def get_category_by_id(id: int) -> dict:
         try:
-            cat: Category = Category.query.get(id)
+            cat: dict = category_cache.get(id)
             if cat is None:
                 raise NotFound()
-            return cat.format()
+            return cat
         except NotFound:
             abort(404)
         except MethodNotAllowed:
@@ -108,34 +236,26 @@ def create_app(test_config=None):
     @app.route("/api/v1/questions", methods=["GET", "POST"])
     @swag_from("docs/questions_get.yaml", methods=["GET"])
     @swag_from("docs/questions_post.yaml", methods=["POST"])
+    @replica_reads(methods=["GET"])
     def get_post_questions() -> List[dict]:
         try:
+            if request.method == "GET" and "ids" in request.args:
+                return questions_batch_response(
+                    QuestionIdsPayload.from_query(request.args["ids"]),
+                    parse_fields(request.args))
             if request.method == "GET":
-                questions: List[Question] = paginate(
-                    results=Question.query.all(),
-                    start_at=request.args.get("page", 1, type=int)
-                )
-                return jsonify([q.format() for q in questions])
+                return questions_page_response(
+                    get_page_args(), fields=parse_fields(request.args))
 
             if request.method == "POST":
                 req_body = request.get_json()
-                payload = QuestionPayload(req_body.get("question"),
-                                          req_body.get("answer"),
-                                          req_body.get("category"),
-                                          req_body.get("difficulty"))
-
-                undefined_properties = payload.get_null_fields()
-
-                if undefined_properties:
-                    raise UnprocessableEntity(
-                        MSG_UNPROCESSABLE.format(
-                            params=" - ".join(undefined_properties)))
-                question = Question(question=payload.question,
-                                    answer=payload.answer,
-                                    category=payload.category,
-                                    difficulty=payload.difficulty)
-                question.insert()
-                return jsonify(question.format()), 201
+                payload = QuestionPayload.from_json(req_body)
+
+                errors = payload.get_errors()
+
+                if errors:
+                    raise UnprocessableEntity(" ".join(errors))
+                return jsonify(insert_question(payload.to_row())), 201
 
         except MethodNotAllowed as e:
             logging.error(e.args)
@@ -143,27 +263,119 @@ def create_app(test_config=None):
         except UnprocessableEntity as e:
             logging.error(e.args)
             abort(422, e.args[0] if len(e.args) else None)
+        except BadRequest as e:
+            abort(400, e.description)
+        except ServiceUnavailable as e:
+            abort(503, e.description)
         else:
             abort(500)
 
+    @app.route("/api/v1/questions", methods=["DELETE", "PATCH"])
+    @swag_from("docs/questions_bulk_delete.yaml", methods=["DELETE"])
+    @swag_from("docs/questions_bulk_patch.yaml", methods=["PATCH"])
+    def delete_patch_questions():
+        try:
+            payload = BulkQuestionsPayload.from_json(
+                request.get_json(silent=True))
+            errors = payload.get_errors(update=request.method == "PATCH")
+            if errors:
+                raise BadRequest(" ".join(errors))
+
+            if request.method == "DELETE":
+                return jsonify({"deleted": bulk_delete_questions(payload)})
+            return jsonify({"updated": bulk_update_questions(payload)})
+
+        except BadRequest as e:
+            abort(400, e.description)
+        except UnprocessableEntity as e:
+            abort(422, e.description)
+
+    @app.route("/api/v1/questions/batch", methods=["POST"])
+    @swag_from("docs/questions_batch.yaml")
+    @replica_reads()
+    def post_questions_batch():
+        try:
+            return questions_batch_response(
+                QuestionIdsPayload.from_json(request.get_json(silent=True)),
+                parse_fields(request.args))
+        except BadRequest as e:
+            abort(400, e.description)
+
+    @app.route("/api/v1/questions/import", methods=["POST"])
+    @swag_from("docs/questions_import.yaml")
+    def post_questions_import():
+        try:
+            fmt = CONTENT_TYPE_FORMATS.get(request.mimetype)
+            if fmt is None:
+                raise BadRequest(
+                    "Content-Type must be one of "
+                    f"{', '.join(CONTENT_TYPE_FORMATS)}.")
+            stream = TextIOWrapper(request.stream, encoding="utf-8")
+            report = import_questions(parse_stream(stream, fmt))
+            return jsonify(report.format()), 201 if report.inserted else 422
+
+        except ValueError as e:
+            abort(400, str(e))
+        except BadRequest as e:
+            abort(400, e.description)
+
+    @app.route("/api/v1/questions/export")
+    @swag_from("docs/questions_export.yaml")
+    @replica_reads()
+    def get_questions_export():
+        try:
+            category = parse_export_category(request.args)
+        except BadRequest as e:
+            abort(400, e.description)
+        chunks = export_questions(category=category)
+        headers = {
+            "Content-Disposition": "attachment; filename=questions.ndjson",
+            "Vary": "Accept-Encoding"
+        }
+        encoding = choose_encoding(request.headers.get("Accept-Encoding"))
+        if encoding is not None:
+            chunks = compress_chunks(chunks, encoding)
+            headers["Content-Encoding"] = encoding
+        return Response(stream_with_context(chunks),
+                        mimetype="application/x-ndjson",
+                        headers=headers)
+
+    @app.route("/api/v1/questions/changes")
+    @swag_from("docs/questions_changes.yaml")
+    def get_questions_changes():
+        try:
+            args = parse_changes_args(request.args)
+            return json_response(get_changes(args).format())
+
+        except BadRequest as e:
+            abort(400, e.description)
+        except Gone as e:
+            abort(410, e.description)
+
     @app.route("/api/v1/questions/<int:id>", methods=["GET", "DELETE"])
     @swag_from("docs/questions_delete.yaml", methods=["DELETE"])
     @swag_from("docs/questions_id_get.yaml", methods=["GET"])
+    @replica_reads(methods=["GET"])
     def get_delete_question(id: int) -> dict:
 
         try:
-            question = Question.query.get(id)
+            if request.method == "GET":
+                question = get_question(id, parse_fields(request.args))
+            else:
+                question = Question.query.get(id)
 
             if question is None:
                 raise NotFound()
 
             if request.method == "GET":
-                return jsonify(question.format())
+                return json_response(format_row(question))
 
             if request.method == "DELETE":
                 question.delete()
                 return jsonify({}), 204
 
+        except BadRequest as e:
+            abort(400, e.description)
         except NotFound:
             abort(404)
         else:
@@ -171,6 +383,7 @@ def create_app(test_config=None):
 
     @app.route("/api/v1/questions/search-term", methods=["POST"])
     @swag_from("docs/questions_search_term.yaml")
+    @replica_reads()
     def get_questions_using_search_term() -> List[dict]:
         """
             #TODO
@@ -181,32 +394,34 @@ def create_app(test_config=None):
         try:
             payload = request.get_json()
             search_term = payload.get(
-                "search_term") if payload is not None else None
+                "search_term") if isinstance(payload, dict) else None
             logging.debug(f"search_term={search_term}")
-            if search_term is None:
-                raise BadRequest()
+            if not isinstance(search_term, str):
+                raise BadRequest(
+                    MSG_UNPROCESSABLE.format(params="search_term"))
 
-            res: List[Question] = paginate(
-                results=Question.query.filter(
-                    Question.question.ilike(f"%{search_term}%")).all(), start_at=request.args.get(
-                    "page", 1, type=int))
-            return jsonify([q.format() for q in res])
+            args = get_page_args()
+            return questions_response(question_search.search(
+                search_term=search_term,
+                args=args,
+                fields=parse_fields(request.args)
+            ), args)
 
-        except BadRequest:
-            abort(400, MSG_UNPROCESSABLE.format(params="search_term"))
+        except BadRequest as e:
+            abort(400, e.description)
         except MethodNotAllowed:
             abort(405, METHOD_NOT_ALLOWED.format(request.method))
         else:
             abort(500)
 
     @app.route("/api/v1/categories/<int:cat_id>/questions", methods=["GET"])
+    @replica_reads()
     def get_questions_by_category(cat_id: int) -> List[dict]:
         try:
-            questions: List[Question] = paginate(
-                results=Question.query.filter(
-                    Question.category == cat_id).all(), start_at=request.args.get(
-                    "page", 1, type=int))
-            return jsonify([q.format() for q in questions])
+            return questions_page_response(get_page_args(), category=cat_id,
+                                           fields=parse_fields(request.args))
+        except BadRequest as e:
+            abort(400, e.description)
         except NotFound:
             abort(404, f"Could not find a category with id={cat_id}")
         except MethodNotAllowed:
@@ -216,6 +431,7 @@ def create_app(test_config=None):
 
     @app.route("/api/v1/questions/quizzes", methods=["POST"])
     @swag_from("docs/questions_quizzes.yaml")
+    @replica_reads()
     def post_quizzes_questions():
         """
             #TODO: Integration tests
@@ -228,53 +444,102 @@ def create_app(test_config=None):
             one question at a time is displayed, the user is allowed to answer
             and shown whether they were correct or not.
         """
-        from random import randint
         try:
             body = request.get_json()
             if body is None:
                 raise BadRequest(
                     "Cannot process this request as payload is null.")
-            category = body.get("quiz_category")
-            previous_questions = body.get("previous_questions")
+            payload = QuizPayload.from_json(body)
 
-            if category is None or previous_questions is None:
+            if payload.get_null_fields():
                 raise UnprocessableEntity(MSG_UNPROCESSABLE.format(
                     params=" - ".join(["category", "previous_question"])
                 ))
+            errors = payload.get_errors()
+            if errors:
+                raise BadRequest(" ".join(errors))
 
-            if category.get("id", 0) == 0:
-                possible_questions = Question.query.all()
-            else:
-                possible_questions = Question.query.filter(
-                    Question.category == int(category.get("id"))
-                ).all()
+            category_id = payload.to_category_id(ALL_CATEGORIES)
+            if not quiz_sampler.has_questions(category_id, reload=True):
+                raise NotFound(
+                    f"Could find any category with id={category_id}.")
 
-            if not possible_questions:
-                raise NotFound(f"Could find any category with id={category}.")
+            question = quiz_sampler.next_question(
+                category=category_id,
+                excluded=payload.to_excluded())
 
-            random_q_excluding_previous = [
-                el for el in filter(
-                    lambda x: x.id not in [
-                        q for q in previous_questions],
-                    possible_questions)]
-
-            if not len(random_q_excluding_previous):
+            if question is None:
                 return jsonify({})
-
-            idx: int = randint(0, len(random_q_excluding_previous) - 1)
-            return jsonify(random_q_excluding_previous[idx].format())
+            return json_response(format_row(question))
 
         except UnprocessableEntity as e:
             logging.warning(e.args)
             abort(422, e.args[0] if len(e.args) else None)
         except NotFound as e:
-            abort(404, e.args[0] if len(e.args) else None)
+            abort(404, e.description)
         except BadRequest as e:
-            abort(400, e.args[0] if len(e.args) else None)
+            abort(400, e.description)
         except Exception as e:
             logging.error(e.args)
             abort(500)
 
+    @app.route("/api/v1/questions/quizzes/sessions", methods=["POST"])
+    @swag_from("docs/quiz_sessions_post.yaml")
+    @replica_reads()
+    def post_quiz_session():
+        try:
+            payload = QuizPayload.from_json(request.get_json(silent=True))
+            if payload.get_null_fields(with_previous=False):
+                raise UnprocessableEntity(
+                    MSG_UNPROCESSABLE.format(params="quiz_category"))
+            errors = payload.get_errors(with_previous=False)
+            if errors:
+                raise BadRequest(" ".join(errors))
+
+            category_id = payload.to_category_id(ALL_CATEGORIES)
+            if not quiz_sampler.has_questions(category_id, reload=True):
+                raise NotFound(
+                    f"Could find any category with id={category_id}.")
+
+            session = quiz_sessions.create(db.session, category_id)
+            db.session.commit()
+            return jsonify(session.format()), 201
+
+        except UnprocessableEntity as e:
+            logging.warning(e.args)
+            abort(422, e.description)
+        except BadRequest as e:
+            abort(400, e.description)
+        except NotFound as e:
+            abort(404, e.description)
+        except ServiceUnavailable as e:
+            abort(503, e.description)
+
+    @app.route("/api/v1/questions/quizzes/sessions/<token>/next",
+               methods=["POST"])
+    @swag_from("docs/quiz_sessions_next.yaml")
+    @replica_reads()
+    def post_quiz_session_next(token: str):
+        try:
+            session, question = quiz_sessions.next_question(token)
+            if session is None:
+                raise NotFound(f"Could not find a quiz session {token}.")
+            if question is None:
+                return jsonify({})
+            return json_response(format_row(question))
+
+        except NotFound as e:
+            abort(404, e.description)
+
+    @app.route("/api/v1/questions/quizzes/sessions/<token>",
+               methods=["DELETE"])
+    def delete_quiz_session(token: str):
+        found = quiz_sessions.discard(db.session, token)
+        db.session.commit()
+        if not found:
+            abort(404, f"Could not find a quiz session {token}.")
+        return jsonify({}), 204
+
     @app.errorhandler(405)
     def method_not_allowed(error):
         BASIC_MSG = "Method not allowed."
@@ -302,6 +567,14 @@ def create_app(test_config=None):
             "message": error.description if error.description else BASIC_MSG
         }), 404
 
+    @app.errorhandler(410)
+    def gone(error):
+        return jsonify({
+            "status": 410,
+            "success": False,
+            "message": error.description if error.description else "Gone"
+        }), 410
+
     @app.errorhandler(422)
     def unprocessable(error):
         return jsonify({
@@ -318,4 +591,12 @@ def create_app(test_config=None):
             "message": error.description if error.description else "Bad request"
         }), 400
 
+    @app.errorhandler(503)
+    def service_unavailable(error):
+        return jsonify({
+            "status": 503,
+            "success": False,
+            "message": error.description
+        }), 503, {"Retry-After": "1"}
+
     return app
@@ -0,0 +1,713 @@
+"""
+Asynchronous (ASGI) deployment of the trivia API:
+
+    uvicorn flaskr.asgi:app --workers 4
+
+It serves the /api/v1 read, write, change feed, search and quiz routes of
+create_app() with the same payloads, through an async SQLAlchemy engine
+(asyncpg on postgres, aiosqlite on sqlite). The schema, the models, the payload
+validation and the in-process caches are shared with the Flask app; the
+admin routes (bulk import, delete and update) and CATALOG_SNAPSHOT stay on the
+WSGI deployment, whose snapshots see the writes made here through the catalog
+version every write transaction bumps. The caches are loaded through the async
+engine only: no request blocks the event loop on a synchronous query.
+Requires the packages of requirements-async.txt.
+"""
+import asyncio
+import logging
+from dataclasses import replace
+from http import HTTPStatus
+from typing import (
+    AsyncIterator,
+    List,
+    Optional,
+    Set
+)
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import create_async_engine
+from starlette.applications import Starlette
+from starlette.exceptions import HTTPException
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import Response, StreamingResponse
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.routing import Match, Route
+from werkzeug.exceptions import (
+    BadRequest,
+    Gone,
+    ServiceUnavailable,
+    default_exceptions
+)
+from .models import (
+    DB_STATEMENT_TIMEOUT,
+    Category,
+    Question,
+    database_path,
+    engine_options,
+    notify_question_change,
+    on_question_change
+)
+from .payloads import (
+    MSG_UNPROCESSABLE,
+    QuestionIdsPayload,
+    QuestionPayload,
+    QuizPayload
+)
+from .pagination import (
+    NEXT_CURSOR_HEADER,
+    Page,
+    PageArgs,
+    keyset_page,
+    keyset_query,
+    page_envelope,
+    paginate_list,
+    parse_page_args,
+    ranked_page,
+    ranked_query,
+    wants_envelope
+)
+from .catalog import (
+    Fields,
+    count_questions_by_category,
+    order_by_ids,
+    parse_fields,
+    question_counts,
+    select_questions
+)
+from .search import (
+    postgres_search_query,
+    question_search,
+    tokenize
+)
+from .cache import CACHE_MAX_AGE, category_cache
+from .changes import (
+    CHANGES_POLL_INTERVAL,
+    ChangesArgs,
+    ChangesPage,
+    parse_changes_args,
+    read_changes,
+    record_question_change
+)
+from .quiz import (
+    ALL_CATEGORIES,
+    quiz_sampler,
+    quiz_sessions
+)
+from .export import EXPORT_BATCH_SIZE, parse_export_category
+from .compression import (
+    COMPRESSIBLE_TYPES,
+    COMPRESSION_ENABLED,
+    StreamCompressor,
+    choose_encoding,
+    compress,
+    is_compressible,
+    weak_etag
+)
+from .serialization import dumps, format_row
+from .slow_queries import init_slow_query_log
+from .metrics import (
+    METRICS_ENABLED,
+    METRICS_PATH,
+    PROMETHEUS_CONTENT_TYPE,
+    SERVER_TIMING_HEADER,
+    UNMATCHED_ROUTE,
+    end_request,
+    finish_request,
+    request_metrics,
+    start_request
+)
+
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "postgres": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite"
+}
+MSG_NOT_A_SESSION: str = "Could not find a quiz session {token}."
+
+
+def async_database_url(url: str) -> str:
+    """
+    async_database_url(url)
+        swaps the (sync) driver of a database url for its asyncio one.
+    """
+    scheme, sep, rest = url.partition("://")
+    return ASYNC_DRIVERS.get(scheme.split("+")[0], scheme) + sep + rest
+
+
+def async_engine_options(url: str) -> dict:
+    """
+    async_engine_options(url)
+        engine_options() for the async drivers: asyncpg takes the statement
+        timeout as a server setting rather than a libpq option.
+    """
+    options = engine_options(url)
+    if options.pop("connect_args", None) is not None:
+        options["connect_args"] = {"server_settings": {
+            "statement_timeout": str(DB_STATEMENT_TIMEOUT)}}
+    return options
+
+
+init_slow_query_log()
+engine = create_async_engine(async_database_url(database_path),
+                             **async_engine_options(database_path))
+
+
+async def fetch_all(query) -> List[object]:
+    async with engine.connect() as connection:
+        return (await connection.execute(query)).all()
+
+
+async def fetch_question(question_id: int, fields: Fields = None):
+    async with engine.connect() as connection:
+        return (await connection.execute(
+            select_questions(fields)
+            .where(Question.id == question_id))).first()
+
+
+async def fetch_page(query, args: PageArgs) -> Page:
+    return keyset_page(await fetch_all(keyset_query(query, Question.id, args)))
+
+
+async def ensure_category_cache() -> None:
+    if category_cache.is_stale:
+        category_cache.load_rows([row._asdict() for row in await fetch_all(
+            select(Category.id, Category.type).order_by(Category.id))])
+
+
+async def ensure_quiz_sampler() -> None:
+    if quiz_sampler.is_stale:
+        quiz_sampler.load_rows(await fetch_all(
+            select(Question.id, Question.category)))
+
+
+async def read_json(request: Request):
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+
+def json_response(obj: object, status_code: int = 200,
+                  headers: Optional[dict] = None) -> Response:
+    return Response(dumps(obj), status_code=status_code, headers=headers,
+                    media_type="application/json")
+
+
+def paged_response(page: Page, envelope: Optional[dict] = None) -> Response:
+    headers = {} if page.next_cursor is None else \
+        {NEXT_CURSOR_HEADER: page.next_cursor}
+    if envelope is not None:
+        return json_response(envelope, headers=headers)
+    return json_response([format_row(item) for item in page.items],
+                         headers=headers)
+
+
+async def questions_response(request: Request, page: Page, args: PageArgs,
+                             category: Optional[int] = None,
+                             counted: bool = True) -> Response:
+    """
+    questions_response(request, page, args, category, counted)
+        async counterpart of flaskr.questions_response(); the total comes
+        from the maintained counts unless the page is not `counted`
+        (search results know their own total, if any).
+    """
+    if not wants_envelope(request.query_params):
+        return paged_response(page)
+    if counted:
+        if question_counts.is_stale:
+            question_counts.load_rows(
+                await fetch_all(count_questions_by_category()))
+        page = replace(page, total=question_counts.get(category))
+    await ensure_category_cache()
+    return paged_response(page, page_envelope(
+        page, args,
+        current_category=category,
+        categories=category_cache.types()))
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag in ("*", f'"{etag}"'):
+            return True
+    return False
+
+
+def conditional_response(request: Request, body: bytes, etag: str,
+                         headers: Optional[dict] = None) -> Response:
+    """
+    conditional_response(request, body, etag)
+        mirrors cache.conditional_get(): a matching If-None-Match gets an
+        empty 304, otherwise the body is sent with its ETag.
+    """
+    headers = dict(headers or {})
+    headers["ETag"] = f'"{etag}"'
+    headers["Cache-Control"] = f"public, max-age={CACHE_MAX_AGE}"
+    if etag_matches(request.headers.get("if-none-match", ""), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(body, headers=headers, media_type="application/json")
+
+
+async def get_categories(request: Request) -> Response:
+    args = parse_page_args(request.query_params)
+    await ensure_category_cache()
+    cached = category_cache.page(args)
+    body, encoding = cached.encode(request.headers.get("accept-encoding"))
+    headers = {} if cached.next_cursor is None else \
+        {NEXT_CURSOR_HEADER: cached.next_cursor}
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+    return conditional_response(request, body, cached.etag, headers)
+
+
+async def get_category_by_id(request: Request) -> Response:
+    category_id = request.path_params["id"]
+    await ensure_category_cache()
+    category = category_cache.get(category_id)
+    if category is None:
+        raise HTTPException(404)
+    return conditional_response(request, dumps(category),
+                                category_cache.etag(category_id=category_id))
+
+
+async def questions_batch_response(payload: QuestionIdsPayload,
+                                   fields: Fields = None) -> Response:
+    errors = payload.get_errors()
+    if errors:
+        raise BadRequest(" ".join(errors))
+    ids = payload.to_ids()
+    questions, missing = order_by_ids(await fetch_all(
+        select_questions(fields).where(Question.id.in_(ids))), ids)
+    return json_response({
+        "questions": [format_row(question) for question in questions],
+        "missing": missing
+    })
+
+
+async def post_questions_batch(request: Request) -> Response:
+    return await questions_batch_response(
+        QuestionIdsPayload.from_json(await read_json(request)),
+        parse_fields(request.query_params))
+
+
+async def get_post_questions(request: Request) -> Response:
+    if request.method == "GET" and "ids" in request.query_params:
+        return await questions_batch_response(
+            QuestionIdsPayload.from_query(request.query_params["ids"]),
+            parse_fields(request.query_params))
+    if request.method == "GET":
+        args = parse_page_args(request.query_params)
+        fields = parse_fields(request.query_params)
+        return await questions_response(
+            request, await fetch_page(select_questions(fields), args), args)
+
+    payload = QuestionPayload.from_json(await read_json(request) or {})
+    errors = payload.get_errors()
+    if errors:
+        logging.error(errors)
+        raise HTTPException(422)
+    row = payload.to_row()
+    async with engine.begin() as connection:
+        result = await connection.execute(
+            Question.__table__.insert().values(**row))
+        question = {"id": result.inserted_primary_key[0], **row}
+        await connection.run_sync(record_question_change, "insert", question)
+    notify_question_change("insert", [question])
+    return json_response(question, 201)
+
+
+async def get_delete_question(request: Request) -> Response:
+    if request.method == "GET":
+        question = await fetch_question(request.path_params["id"],
+                                        parse_fields(request.query_params))
+        if question is None:
+            raise HTTPException(404)
+        return json_response(format_row(question))
+
+    question = await fetch_question(request.path_params["id"])
+    if question is None:
+        raise HTTPException(404)
+
+    async with engine.begin() as connection:
+        await connection.execute(Question.__table__.delete().where(
+            Question.id == question.id))
+        await connection.run_sync(record_question_change, "delete",
+                                  format_row(question))
+    notify_question_change("delete", [format_row(question)])
+    return Response(status_code=204)
+
+
+# long-polls waiting for a write of this process
+change_waiters: Set[asyncio.Event] = set()
+
+
+@on_question_change
+def wake_up_long_polls(action: str, rows: List[dict]) -> None:
+    for waiter in change_waiters:
+        waiter.set()
+
+
+async def get_changes(args: ChangesArgs) -> ChangesPage:
+    """
+    get_changes(args)
+        async changes.get_changes(): the connection is only held while
+        reading, the long-poll waits on an event set by the writes of this
+        process or CHANGES_POLL_INTERVAL for those of the other ones.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + args.wait
+    while True:
+        waiter = asyncio.Event()
+        change_waiters.add(waiter)
+        try:
+            async with engine.connect() as connection:
+                page = await connection.run_sync(read_changes, args)
+            remaining = deadline - loop.time()
+            if page.changes or remaining <= 0:
+                return page
+            try:
+                await asyncio.wait_for(
+                    waiter.wait(), min(remaining, CHANGES_POLL_INTERVAL))
+            except asyncio.TimeoutError:
+                pass
+        finally:
+            change_waiters.discard(waiter)
+
+
+async def get_questions_changes(request: Request) -> Response:
+    page = await get_changes(parse_changes_args(request.query_params))
+    return json_response(page.format())
+
+
+async def stream_questions(category: Optional[int],
+                           batch_size: int = EXPORT_BATCH_SIZE
+                           ) -> AsyncIterator[bytes]:
+    """
+    stream_questions(category, batch_size)
+        async export_questions(): NDJSON chunks read through a server-side
+        cursor `batch_size` rows at a time.
+    """
+    query = select_questions().order_by(Question.id)
+    if category is not None:
+        query = query.where(Question.category == category)
+    async with engine.connect() as connection:
+        result = await connection.stream(
+            query.execution_options(yield_per=batch_size))
+        async for rows in result.partitions(batch_size):
+            yield b"\n".join(dumps(row._asdict()) for row in rows) + b"\n"
+
+
+async def get_questions_export(request: Request) -> Response:
+    category = parse_export_category(request.query_params)
+    headers = {
+        "Content-Disposition": "attachment; filename=questions.ndjson",
+        "Vary": "Accept-Encoding"
+    }
+    chunks = stream_questions(category)
+    encoding = choose_encoding(request.headers.get("accept-encoding"))
+    if encoding is not None:
+        chunks = acompress_chunks(chunks, encoding)
+        headers["Content-Encoding"] = encoding
+    return StreamingResponse(chunks, headers=headers,
+                             media_type="application/x-ndjson")
+
+
+async def acompress_chunks(chunks: AsyncIterator[bytes],
+                           encoding: str) -> AsyncIterator[bytes]:
+    compressor = StreamCompressor(encoding)
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+async def search_questions(request: Request) -> Response:
+    body = await read_json(request)
+    search_term = body.get("search_term") if isinstance(body, dict) else None
+    if not isinstance(search_term, str):
+        raise BadRequest(MSG_UNPROCESSABLE.format(params="search_term"))
+    args = parse_page_args(request.query_params)
+    fields = parse_fields(request.query_params)
+
+    terms = tokenize(search_term)
+    if not terms:
+        return await questions_response(
+            request, await fetch_page(select_questions(fields), args), args)
+    if engine.dialect.name == "postgresql":
+        return await questions_response(request, ranked_page(
+            await fetch_all(ranked_query(
+                postgres_search_query(terms, fields), args)),
+            args), args, counted=False)
+
+    if not question_search.index.loaded:
+        question_search.index.load(await fetch_all(
+            select(Question.id, Question.question, Question.answer)))
+    page = paginate_list(question_search.index.search(terms), args)
+    if page.items:
+        found = {q.id: q for q in await fetch_all(
+            select_questions(fields).where(Question.id.in_(page.items)))}
+        page = Page(items=[found[i] for i in page.items if i in found],
+                    next_cursor=page.next_cursor, total=page.total)
+    return await questions_response(request, page, args, counted=False)
+
+
+async def get_questions_by_category(request: Request) -> Response:
+    category = request.path_params["cat_id"]
+    args = parse_page_args(request.query_params)
+    fields = parse_fields(request.query_params)
+    return await questions_response(request, await fetch_page(
+        select_questions(fields).where(Question.category == category), args),
+        args, category=category)
+
+
+async def post_quizzes_questions(request: Request) -> Response:
+    body = await read_json(request)
+    if body is None:
+        raise BadRequest("Cannot process this request as payload is null.")
+    payload = QuizPayload.from_json(body)
+    if payload.get_null_fields():
+        raise HTTPException(422)
+    errors = payload.get_errors()
+    if errors:
+        raise BadRequest(" ".join(errors))
+
+    category_id = payload.to_category_id(ALL_CATEGORIES)
+    await ensure_quiz_sampler()
+    if not quiz_sampler.has_questions(category_id):
+        raise HTTPException(
+            404, f"Could find any category with id={category_id}.")
+
+    excluded = payload.to_excluded()
+    while True:
+        question_id = quiz_sampler.sample(category_id, excluded)
+        if question_id is None:
+            return json_response({})
+        question = await fetch_question(question_id)
+        if question is not None:
+            return json_response(format_row(question))
+        quiz_sampler.discard(question_id, excluded)
+
+
+async def post_quiz_session(request: Request) -> Response:
+    payload = QuizPayload.from_json(await read_json(request))
+    if payload.get_null_fields(with_previous=False):
+        raise HTTPException(422)
+    errors = payload.get_errors(with_previous=False)
+    if errors:
+        raise BadRequest(" ".join(errors))
+
+    category_id = payload.to_category_id(ALL_CATEGORIES)
+    await ensure_quiz_sampler()
+    if not quiz_sampler.has_questions(category_id):
+        raise HTTPException(
+            404, f"Could find any category with id={category_id}.")
+    async with engine.begin() as connection:
+        session = await connection.run_sync(quiz_sessions.create, category_id)
+    return json_response(session.format(), 201)
+
+
+async def post_quiz_session_next(request: Request) -> Response:
+    token = request.path_params["token"]
+    while True:
+        async with engine.begin() as connection:
+            session = await connection.run_sync(quiz_sessions.advance, token)
+        if session is None:
+            raise HTTPException(404, MSG_NOT_A_SESSION.format(token=token))
+        if session.question_id is None:
+            return json_response({})
+        question = await fetch_question(session.question_id)
+        if question is not None:
+            return json_response(format_row(question))
+
+
+async def delete_quiz_session(request: Request) -> Response:
+    token = request.path_params["token"]
+    async with engine.begin() as connection:
+        found = await connection.run_sync(quiz_sessions.discard, token)
+    if not found:
+        raise HTTPException(404, MSG_NOT_A_SESSION.format(token=token))
+    return Response(status_code=204)
+
+
+async def get_metrics(request: Request) -> Response:
+    return Response(request_metrics.render(),
+                    media_type=PROMETHEUS_CONTENT_TYPE)
+
+
+class MetricsMiddleware:
+    """
+    MetricsMiddleware(app)
+        ASGI counterpart of metrics.init_metrics(): records every request
+        under its route template and adds the Server-Timing header.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def route_template(self, scope) -> str:
+        for route in routes:
+            match, _ = route.matches(scope)
+            if match != Match.NONE:
+                return route.path
+        return UNMATCHED_ROUTE
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        route = self.route_template(scope)
+        token = start_request(scope["method"], route)
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                server_timing = finish_request(
+                    scope["method"], route, message["status"])
+                if server_timing is not None:
+                    MutableHeaders(scope=message).append(
+                        SERVER_TIMING_HEADER, server_timing)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            end_request(token)
+
+
+class CompressionMiddleware:
+    """
+    CompressionMiddleware(app)
+        ASGI counterpart of compression.init_compression(): compresses the
+        JSON bodies sent in a single message and completes the headers of
+        the responses already encoded (cached pages, the export).
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        encoding = choose_encoding(
+            Headers(scope=scope).get("accept-encoding"))
+        start = None
+
+        async def send_compressed(message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                start = message
+                return
+            if start is None:
+                return await send(message)
+
+            headers = MutableHeaders(scope=start)
+            mimetype = headers.get("content-type", "").split(";")[0]
+            if mimetype.startswith(COMPRESSIBLE_TYPES):
+                headers.add_vary_header("Accept-Encoding")
+                body = message.get("body", b"")
+                if "content-encoding" not in headers and \
+                        start["status"] == 200 and encoding is not None and \
+                        not message.get("more_body", False) and \
+                        is_compressible(mimetype, len(body)):
+                    body = compress(body, encoding)
+                    headers["Content-Encoding"] = encoding
+                    headers["Content-Length"] = str(len(body))
+                    message = {**message, "body": body}
+                if "content-encoding" in headers and "etag" in headers:
+                    headers["ETag"] = weak_etag(headers["etag"])
+            await send(start)
+            start = None
+            await send(message)
+
+        await self.app(scope, receive, send_compressed)
+
+
+def error_response(status: int, message: Optional[str]) -> Response:
+    if status == 422:
+        message = "payload is unprocessable."
+    return json_response({
+        "status": status,
+        "success": False,
+        # the werkzeug descriptions the Flask error handlers fall back to
+        "message": message or default_exceptions[status].description
+    }, status)
+
+
+async def http_exception(request: Request, exc: HTTPException) -> Response:
+    # starlette fills in the reason phrase when no detail is given
+    detail = exc.detail
+    if detail == HTTPStatus(exc.status_code).phrase:
+        detail = None
+    return error_response(exc.status_code, detail)
+
+
+async def bad_request(request: Request, exc: BadRequest) -> Response:
+    return error_response(400, exc.description)
+
+
+async def gone(request: Request, exc: Gone) -> Response:
+    return error_response(410, exc.description)
+
+
+async def service_unavailable(request: Request,
+                              exc: ServiceUnavailable) -> Response:
+    response = error_response(503, exc.description)
+    response.headers["Retry-After"] = "1"
+    return response
+
+
+async def internal_server_error(request: Request, exc: Exception) -> Response:
+    logging.error(exc.args)
+    return error_response(500, None)
+
+
+async def dispose_engine() -> None:
+    await engine.dispose()
+
+
+routes = [
+    Route("/api/v1/categories", get_categories),
+    Route("/api/v1/categories/{id:int}", get_category_by_id),
+    Route("/api/v1/questions", get_post_questions, methods=["GET", "POST"]),
+    Route("/api/v1/questions/batch", post_questions_batch,
+          methods=["POST"]),
+    Route("/api/v1/questions/export", get_questions_export),
+    Route("/api/v1/questions/changes", get_questions_changes),
+    Route("/api/v1/questions/search-term", search_questions,
+          methods=["POST"]),
+    Route("/api/v1/questions/quizzes", post_quizzes_questions,
+          methods=["POST"]),
+    Route("/api/v1/questions/quizzes/sessions", post_quiz_session,
+          methods=["POST"]),
+    Route("/api/v1/questions/quizzes/sessions/{token}/next",
+          post_quiz_session_next, methods=["POST"]),
+    Route("/api/v1/questions/quizzes/sessions/{token}",
+          delete_quiz_session, methods=["DELETE"]),
+    Route("/api/v1/questions/{id:int}", get_delete_question,
+          methods=["GET", "DELETE"]),
+    Route("/api/v1/categories/{cat_id:int}/questions",
+          get_questions_by_category)
+]
+if METRICS_ENABLED:
+    routes.append(Route(METRICS_PATH, get_metrics))
+
+app = Starlette(
+    routes=routes,
+    middleware=[Middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_methods=["GET", "POST", "DELETE"],
+        allow_headers=["Content-Type", "Authorization"],
+        expose_headers=[NEXT_CURSOR_HEADER, "ETag", SERVER_TIMING_HEADER])]
+    + ([Middleware(MetricsMiddleware)] if METRICS_ENABLED else [])
+    + ([Middleware(CompressionMiddleware)] if COMPRESSION_ENABLED else []),
+    exception_handlers={
+        HTTPException: http_exception,
+        BadRequest: bad_request,
+        Gone: gone,
+        ServiceUnavailable: service_unavailable,
+        500: internal_server_error
+    },
+    on_shutdown=[dispose_engine])
@@ -0,0 +1,256 @@
+import csv
+import json
+import logging
+from dataclasses import dataclass, field
+from itertools import islice
+from os import getenv
+from typing import (
+    IO,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union
+)
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import and_
+from sqlalchemy.exc import SQLAlchemyError
+from werkzeug.exceptions import UnprocessableEntity
+from .catalog import QUESTION_COLUMNS, select_questions
+from .changes import record_question_change, record_question_changes
+from .models import db, Question, notify_question_change
+from .payloads import BulkQuestionsPayload, QuestionPayload
+
+BULK_IMPORT_BATCH_SIZE: int = int(getenv("BULK_IMPORT_BATCH_SIZE", 1000))
+IMPORT_FORMATS: Tuple[str, ...] = ("json", "ndjson", "csv")
+CONTENT_TYPE_FORMATS: dict = {
+    "application/json": "json",
+    "application/x-ndjson": "ndjson",
+    "application/jsonl": "ndjson",
+    "text/csv": "csv"
+}
+MSG_NOT_AN_OBJECT: str = "row must be a JSON object."
+MSG_NOT_AN_ARRAY: str = "payload must be a JSON array of questions."
+MSG_BULK_REJECTED: str = "the {action} was rejected by the database."
+
+# (row number, parsed row or parsing error message)
+ParsedRow = Tuple[int, Union[dict, str]]
+
+
+@dataclass
+class ImportReport:
+    inserted: int = 0
+    errors: List[dict] = field(default_factory=list)
+
+    def add_error(self, row: int, message: str) -> None:
+        self.errors.append({"row": row, "message": message})
+
+    def format(self) -> dict:
+        return {
+            "inserted": self.inserted,
+            "failed": len(self.errors),
+            "errors": self.errors
+        }
+
+
+def parse_json(rows: object) -> Iterator[ParsedRow]:
+    if not isinstance(rows, list):
+        raise ValueError(MSG_NOT_AN_ARRAY)
+    for number, row in enumerate(rows, start=1):
+        yield number, row if isinstance(row, dict) else MSG_NOT_AN_OBJECT
+
+
+def parse_ndjson(lines: Iterable[str]) -> Iterator[ParsedRow]:
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield number, f"invalid JSON: {e}"
+            continue
+        yield number, row if isinstance(row, dict) else MSG_NOT_AN_OBJECT
+
+
+def parse_csv(lines: Iterable[str]) -> Iterator[ParsedRow]:
+    # row numbers start at 2 as the first line holds the header
+    for number, row in enumerate(csv.DictReader(lines), start=2):
+        yield number, row
+
+
+def parse_stream(stream: IO[str], fmt: str) -> Iterator[ParsedRow]:
+    if fmt == "json":
+        return parse_json(json.load(stream))
+    if fmt == "ndjson":
+        return parse_ndjson(stream)
+    if fmt == "csv":
+        return parse_csv(stream)
+    raise ValueError(f"format must be one of {', '.join(IMPORT_FORMATS)}.")
+
+
+def import_questions(rows: Iterable[ParsedRow],
+                     batch_size: int = BULK_IMPORT_BATCH_SIZE) -> ImportReport:
+    """
+    import_questions(rows, batch_size)
+        validates every row with QuestionPayload and inserts the valid ones
+        with one executemany INSERT and one commit per batch. Only the rows
+        rejected by the database are reported and skipped.
+        Each batch adds a "reload" entry to the change feed.
+    """
+    report = ImportReport()
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            break
+        valid: List[Tuple[int, dict]] = []
+        for number, row in batch:
+            if isinstance(row, str):
+                report.add_error(number, row)
+                continue
+            payload = QuestionPayload.from_json(row)
+            errors = payload.get_errors()
+            if errors:
+                report.add_error(number, " ".join(errors))
+                continue
+            valid.append((number, payload.to_row()))
+        if valid:
+            insert_batch(valid, report)
+
+    if report.inserted:
+        notify_question_change("reload", [])
+    return report
+
+
+def insert_batch(valid: List[Tuple[int, dict]], report: ImportReport) -> None:
+    """
+    insert_batch(valid, report)
+        inserts numbered rows with one executemany INSERT and one commit.
+        A batch rejected by the database is split in halves and retried,
+        so that only the offending rows are reported.
+    """
+    try:
+        db.session.execute(Question.__table__.insert(),
+                           [row for _, row in valid])
+        record_question_change(db.session.connection(), "reload")
+        db.session.commit()
+        report.inserted += len(valid)
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        if len(valid) > 1:
+            middle = len(valid) // 2
+            insert_batch(valid[:middle], report)
+            insert_batch(valid[middle:], report)
+            return
+        logging.error(e.args)
+        report.add_error(valid[0][0], "rejected by the database.")
+
+
+def question_filter(ids: Optional[List[int]], category: Optional[int]):
+    clauses = []
+    if ids is not None:
+        clauses.append(Question.id.in_(ids))
+    if category is not None:
+        clauses.append(Question.category == category)
+    return and_(*clauses)
+
+
+def delete_questions(ids: Optional[List[int]] = None,
+                     category: Optional[int] = None) -> List[dict]:
+    """
+    delete_questions(ids, category)
+        deletes the questions of `ids` and/or `category` with a single
+        DELETE and records them in the change feed, in the session's
+        transaction. Returns the deleted rows, read with RETURNING on
+        postgres, beforehand elsewhere.
+    """
+    table = Question.__table__
+    predicate = question_filter(ids, category)
+    if db.engine.dialect.name == "postgresql":
+        rows = db.session.execute(table.delete().where(predicate)
+                                  .returning(*QUESTION_COLUMNS)).all()
+    else:
+        rows = db.session.execute(select_questions().where(predicate)).all()
+        db.session.execute(table.delete().where(predicate))
+    rows = [row._asdict() for row in rows]
+    record_question_changes(db.session.connection(), "delete", rows)
+    return rows
+
+
+def update_questions(values: dict, ids: Optional[List[int]] = None,
+                     category: Optional[int] = None) -> List[dict]:
+    """
+    update_questions(values, ids, category)
+        sets `values` on the questions of `ids` and/or `category` with a
+        single UPDATE and records them in the change feed, in the
+        session's transaction. Returns the updated rows.
+    """
+    table = Question.__table__
+    predicate = question_filter(ids, category)
+    if db.engine.dialect.name == "postgresql":
+        rows = [row._asdict() for row in db.session.execute(
+            table.update().where(predicate).values(**values)
+            .returning(*QUESTION_COLUMNS))]
+    else:
+        rows = [{**row._asdict(), **values} for row in db.session.execute(
+            select_questions().where(predicate))]
+        db.session.execute(table.update().where(predicate).values(**values))
+    record_question_changes(db.session.connection(), "update", rows)
+    return rows
+
+
+def bulk_delete_questions(payload: BulkQuestionsPayload) -> int:
+    """
+    bulk_delete_questions(payload)
+        delete_questions() of a validated payload in one transaction,
+        returning the number of questions deleted.
+    """
+    return _run_bulk("delete", delete_questions,
+                     ids=payload.to_ids(), category=payload.to_category())
+
+
+def bulk_update_questions(payload: BulkQuestionsPayload) -> int:
+    """
+    bulk_update_questions(payload)
+        update_questions() of a validated payload in one transaction,
+        returning the number of questions updated.
+    """
+    return _run_bulk("update", update_questions, payload.to_values(),
+                     ids=payload.to_ids(), category=payload.to_category())
+
+
+def _run_bulk(action: str, statement, *args, **kwargs) -> int:
+    try:
+        rows = statement(*args, **kwargs)
+        db.session.commit()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logging.error(e.args)
+        raise UnprocessableEntity(MSG_BULK_REJECTED.format(action=action))
+    if rows:
+        notify_question_change(action, rows)
+    return len(rows)
+
+
+@click.command("import-questions")
+@click.argument("source", type=click.File("r", encoding="utf-8"))
+@click.option("--format", "fmt", type=click.Choice(IMPORT_FORMATS),
+              help="Input format, guessed from the file extension if omitted.")
+@click.option("--batch-size", default=BULK_IMPORT_BATCH_SIZE,
+              show_default=True)
+@with_appcontext
+def import_questions_command(source: IO[str], fmt: str, batch_size: int):
+    """Imports questions from a JSON, NDJSON or CSV file (- for stdin)."""
+    if fmt is None:
+        extension = source.name.rsplit(".", 1)[-1].lower()
+        fmt = "ndjson" if extension == "jsonl" else extension
+    try:
+        report = import_questions(parse_stream(source, fmt), batch_size)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+    for error in report.errors:
+        click.echo(f"row {error['row']}: {error['message']}", err=True)
+    click.echo(f"{report.inserted} questions imported, "
+               f"{len(report.errors)} rejected.")
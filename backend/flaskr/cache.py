@@ -0,0 +1,225 @@
+from dataclasses import dataclass, field
+from functools import wraps
+from hashlib import sha1
+from os import getenv
+from threading import RLock
+from time import monotonic
+from typing import (
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple
+)
+from flask import (
+    Response,
+    current_app,
+    make_response,
+    request
+)
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+from .models import Category
+from .compression import (
+    COMPRESSION_ENABLED,
+    choose_encoding,
+    compress,
+    is_compressible
+)
+from .serialization import dumps
+from .pagination import (
+    NEXT_CURSOR_HEADER,
+    PageArgs,
+    paginate_sorted
+)
+
+CATEGORY_CACHE_TTL: float = float(getenv("CATEGORY_CACHE_TTL", 300))
+CATEGORY_CACHE_MAX_PAGES: int = 256
+CACHE_MAX_AGE: int = int(getenv("CACHE_MAX_AGE", 0))
+CATEGORIES_CHANGED: str = "categories_changed"
+
+
+@dataclass(frozen=True)
+class CachedResponse:
+    """
+    CachedResponse(body, etag, next_cursor)
+        a serialized response kept by a cache, along with its compressed
+        variants, each built once on first request.
+    """
+    body: bytes
+    etag: str
+    next_cursor: Optional[str] = None
+    _encoded: Dict[str, bytes] = field(
+        default_factory=dict, init=False, repr=False, compare=False)
+
+    def encode(self, accept_encoding: Optional[str]
+               ) -> Tuple[bytes, Optional[str]]:
+        """
+        encode(accept_encoding)
+            the body in the best coding the client accepts, and that coding
+            (None when it is sent as it is).
+        """
+        encoding = choose_encoding(accept_encoding) \
+            if COMPRESSION_ENABLED else None
+        if encoding is None or \
+                not is_compressible("application/json", len(self.body)):
+            return self.body, None
+        body = self._encoded.get(encoding)
+        if body is None:
+            body = compress(self.body, encoding, cached=True)
+            self._encoded[encoding] = body
+        return body, encoding
+
+    def to_response(self) -> Response:
+        body, encoding = self.encode(request.headers.get("Accept-Encoding"))
+        response = current_app.response_class(
+            body, mimetype="application/json")
+        if encoding is not None:
+            response.headers["Content-Encoding"] = encoding
+        if self.next_cursor is not None:
+            response.headers[NEXT_CURSOR_HEADER] = self.next_cursor
+        response.set_etag(self.etag)
+        return response
+
+
+def conditional_get(etag: Optional[Callable[..., Optional[str]]] = None,
+                    max_age: int = CACHE_MAX_AGE):
+    """
+    conditional_get(etag, max_age)
+        decorates a GET view so that its 200 responses carry a strong ETag
+        and requests whose If-None-Match matches get an empty 304.
+        `etag` receives the view arguments and returns the ETag of the
+        representation without building it, letting 304s skip the view;
+        without it the ETag is a hash of the response body.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method not in ("GET", "HEAD"):
+                return view(*args, **kwargs)
+
+            tag = etag(*args, **kwargs) if etag is not None else None
+            if tag is not None and request.if_none_match.contains_weak(tag):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            if tag is not None:
+                response.set_etag(tag)
+            elif not response.get_etag()[0]:
+                response.add_etag()
+            response.cache_control.public = True
+            response.cache_control.max_age = max_age
+            return response.make_conditional(request)
+        return wrapper
+    return decorator
+
+
+class CategoryCache:
+    """
+    CategoryCache(ttl)
+        read-through cache of the categories table and of its serialized
+        pages. Any committed category write bumps `version`, which drops
+        the cache; the `ttl` bounds staleness for writes made elsewhere.
+        ETags derive from a digest of the cached rows, so every worker
+        serving the same rows hands out the same ETags.
+    """
+
+    def __init__(self, ttl: float = CATEGORY_CACHE_TTL):
+        self._lock = RLock()
+        self.ttl = ttl
+        self.version: int = 0
+        self._loaded_at: Optional[float] = None
+        self._categories: List[dict] = []
+        self._ids: List[int] = []
+        self._by_id: Dict[int, dict] = {}
+        self._types: Dict[int, str] = {}
+        self._digest: str = ""
+        self._pages: Dict[Tuple, CachedResponse] = {}
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self.version += 1
+            self._loaded_at = None
+            self._pages.clear()
+
+    @property
+    def is_stale(self) -> bool:
+        return self._loaded_at is None or \
+            monotonic() - self._loaded_at > self.ttl
+
+    def _ensure_loaded(self) -> None:
+        if not self.is_stale:
+            return
+        with self._lock:
+            if not self.is_stale:
+                return
+            self.load_rows([c.format() for c in
+                            Category.query.order_by(Category.id).all()])
+
+    def load_rows(self, categories: List[dict]) -> None:
+        with self._lock:
+            self._categories = categories
+            self._ids = [c["id"] for c in categories]
+            self._by_id = {c["id"]: c for c in categories}
+            self._types = {c["id"]: c["type"] for c in categories}
+            self._digest = sha1(repr(categories).encode()).hexdigest()
+            self._pages.clear()
+            self._loaded_at = monotonic()
+
+    def get(self, category_id: int) -> Optional[dict]:
+        self._ensure_loaded()
+        return self._by_id.get(category_id)
+
+    def types(self) -> Dict[int, str]:
+        self._ensure_loaded()
+        return self._types
+
+    def etag(self, category_id: Optional[int] = None,
+             args: Optional[PageArgs] = None) -> str:
+        self._ensure_loaded()
+        if category_id is not None:
+            return f"{self._digest}-{category_id}"
+        return f"{self._digest}-{args.page}-{args.seek_id}"
+
+    def page(self, args: PageArgs) -> CachedResponse:
+        self._ensure_loaded()
+        key = (args.page, args.seek_id)
+        cached = self._pages.get(key)
+        if cached is not None:
+            return cached
+
+        with self._lock:
+            page = paginate_sorted(self._categories, self._ids, args)
+            cached = CachedResponse(body=dumps(page.items),
+                                    etag=self.etag(args=args),
+                                    next_cursor=page.next_cursor)
+            if len(self._pages) >= CATEGORY_CACHE_MAX_PAGES:
+                self._pages.clear()
+            self._pages[key] = cached
+        return cached
+
+
+category_cache = CategoryCache()
+
+
+def mark_categories_changed(mapper, connection, target) -> None:
+    session = object_session(target)
+    if session is not None:
+        session.info[CATEGORIES_CHANGED] = True
+
+
+for _event in ("after_insert", "after_update", "after_delete"):
+    event.listen(Category, _event, mark_categories_changed)
+
+
+@event.listens_for(Session, "after_commit")
+def invalidate_category_cache(session: Session) -> None:
+    if session.info.pop(CATEGORIES_CHANGED, False):
+        category_cache.invalidate()
+
+
+@event.listens_for(Session, "after_rollback")
+def forget_category_changes(session: Session) -> None:
+    session.info.pop(CATEGORIES_CHANGED, None)
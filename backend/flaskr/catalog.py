@@ -0,0 +1,412 @@
+from bisect import bisect_left, insort
+from dataclasses import replace
+from os import getenv
+from threading import RLock
+from time import monotonic
+from typing import (
+    Dict,
+    List,
+    Mapping,
+    Optional,
+    Tuple
+)
+from flask import has_app_context
+from sqlalchemy import func, select
+from werkzeug.exceptions import BadRequest
+from .models import (
+    db,
+    CatalogVersion,
+    Question,
+    category_key,
+    on_question_change
+)
+from .cache import CachedResponse
+from .serialization import dumps, format_row
+from .pagination import (
+    Page,
+    PageArgs,
+    paginate,
+    paginate_sorted
+)
+
+CATALOG_SNAPSHOT: bool = getenv("CATALOG_SNAPSHOT", "").lower() in \
+    ("1", "true", "yes")
+CATALOG_VERSION_CHECK_INTERVAL: float = float(
+    getenv("CATALOG_VERSION_CHECK_INTERVAL", 2))
+QUESTION_COUNTS_TTL: float = float(getenv("QUESTION_COUNTS_TTL", 60))
+CATALOG_CACHE_MAX_PAGES: int = int(getenv("CATALOG_CACHE_MAX_PAGES", 256))
+QUESTION_COLUMNS = tuple(Question.__table__.columns)
+QUESTION_FIELDS: Tuple[str, ...] = tuple(c.name for c in QUESTION_COLUMNS)
+FIELDS_PARAM: str = "fields"
+MSG_BAD_FIELDS: str = "fields must be a comma separated list of {fields}."
+
+Fields = Optional[Tuple[str, ...]]
+
+
+def parse_fields(params: Mapping[str, str]) -> Fields:
+    """
+    parse_fields(params)
+        the question fields requested with ?fields=question,category, in
+        the order of format() and always including the id, or None for
+        all of them.
+    """
+    if FIELDS_PARAM not in params:
+        return None
+    requested = {name.strip() for name in params[FIELDS_PARAM].split(",")
+                 if name.strip()}
+    if not requested or not requested <= set(QUESTION_FIELDS):
+        raise BadRequest(
+            MSG_BAD_FIELDS.format(fields=", ".join(QUESTION_FIELDS)))
+    requested.add("id")
+    return tuple(name for name in QUESTION_FIELDS if name in requested)
+
+
+def select_questions(fields: Fields = None):
+    """
+    select_questions(fields)
+        Core select of the question columns, in the order of format(), or
+        of the requested `fields` only.
+    """
+    if fields is None:
+        return select(*QUESTION_COLUMNS)
+    return select(*(Question.__table__.c[name] for name in fields))
+
+
+def project(record, fields: Fields):
+    """
+    project(record, fields)
+        the formatted `fields` of an in-memory record, the record itself
+        when all of them are wanted.
+    """
+    if fields is None:
+        return record
+    row = record.format()
+    return {name: row[name] for name in fields}
+
+
+class QuestionRecord:
+    __slots__ = ("id", "question", "answer", "category", "difficulty")
+
+    def __init__(self, id, question, answer, category, difficulty):
+        self.id = id
+        self.question = question
+        self.answer = answer
+        self.category = category
+        self.difficulty = difficulty
+
+    @classmethod
+    def from_row(cls, row: dict) -> "QuestionRecord":
+        return cls(row["id"], row["question"], row["answer"],
+                   row["category"], row["difficulty"])
+
+    def format(self) -> dict:
+        return {
+            'id': self.id,
+            'question': self.question,
+            'answer': self.answer,
+            'category': self.category,
+            'difficulty': self.difficulty
+        }
+
+
+class QuestionCatalog:
+    """
+    QuestionCatalog(check_interval)
+        in-memory snapshot of the questions table: records by id plus
+        sorted id lists for the whole catalog and for every category.
+        Local writes are applied incrementally; every write transaction
+        bumps the shared `catalog_version` row, so other workers and
+        processes notice the new version (at most every `check_interval`
+        seconds) and reload the snapshot. The most
+        requested pages are also kept serialized (and compressed) until the
+        next change.
+    """
+
+    def __init__(self, check_interval: float = CATALOG_VERSION_CHECK_INTERVAL):
+        self._lock = RLock()
+        self.check_interval = check_interval
+        self.version: Optional[int] = None
+        self._checked_at: float = 0
+        self._records: Dict[int, QuestionRecord] = {}
+        self._ids: List[int] = []
+        self._category_ids: Dict[int, List[int]] = {}
+        self._pages: Dict[Tuple, CachedResponse] = {}
+
+    @property
+    def loaded(self) -> bool:
+        return self.version is not None
+
+    def reset(self) -> None:
+        with self._lock:
+            self.version = None
+            self._records, self._ids, self._category_ids = {}, [], {}
+            self._pages.clear()
+
+    def load(self) -> None:
+        records: Dict[int, QuestionRecord] = {}
+        category_ids: Dict[int, List[int]] = {}
+        # from the primary, as the version: a snapshot read from a lagging
+        # replica would be kept until the next write
+        with db.engine.connect() as connection:
+            version = CatalogVersion.current(connection)
+            for row in connection.execute(select(
+                    Question.id, Question.question, Question.answer,
+                    Question.category, Question.difficulty
+            ).order_by(Question.id)):
+                records[row.id] = QuestionRecord(*row)
+                category_ids.setdefault(
+                    category_key(row.category), []).append(row.id)
+        with self._lock:
+            self._records = records
+            self._ids = list(records)
+            self._category_ids = category_ids
+            self._pages.clear()
+            self.version = version
+            self._checked_at = monotonic()
+
+    def ensure_current(self) -> None:
+        if not self.loaded:
+            return self.load()
+        if monotonic() - self._checked_at < self.check_interval:
+            return
+        if CatalogVersion.current() != self.version:
+            return self.load()
+        self._checked_at = monotonic()
+
+    def get(self, question_id: int) -> Optional[QuestionRecord]:
+        self.ensure_current()
+        return self._records.get(question_id)
+
+    def get_many(self, ids: List[int]) -> List[QuestionRecord]:
+        self.ensure_current()
+        records = self._records
+        return [records[i] for i in ids if i in records]
+
+    def count(self, category: Optional[int] = None) -> int:
+        self.ensure_current()
+        if category is None:
+            return len(self._ids)
+        return len(self._category_ids.get(category, []))
+
+    def page(self, args: PageArgs, category: Optional[int] = None) -> Page:
+        self.ensure_current()
+        with self._lock:
+            ids = self._ids if category is None else \
+                self._category_ids.get(category, [])
+            page = paginate_sorted(ids, ids, args)
+            return Page(items=[self._records[i] for i in page.items],
+                        next_cursor=page.next_cursor)
+
+    def cached_page(self, args: PageArgs, category: Optional[int] = None,
+                    fields: Fields = None) -> CachedResponse:
+        """
+        cached_page(args, category, fields)
+            page() serialized, from the cache of pages when it was already
+            requested since the last change.
+        """
+        self.ensure_current()
+        key = (category, args.page, args.seek_id, fields)
+        cached = self._pages.get(key)
+        if cached is not None:
+            return cached
+
+        with self._lock:
+            page = self.page(args, category)
+            tag = f"{self.version}-{category}-{args.page}-{args.seek_id}"
+            if fields is not None:
+                tag += "-" + ".".join(fields)
+            cached = CachedResponse(
+                body=dumps([format_row(project(record, fields))
+                            for record in page.items]),
+                etag=tag,
+                next_cursor=page.next_cursor)
+            if len(self._pages) >= CATALOG_CACHE_MAX_PAGES:
+                self._pages.clear()
+            self._pages[key] = cached
+        return cached
+
+    def apply(self, action: str, rows: List[dict]) -> None:
+        """
+        apply(action, rows)
+            applies a committed local write to the loaded snapshot. The
+            write bumped the catalog version in its transaction: any other
+            bump since the snapshot version means another worker wrote too.
+        """
+        if not self.loaded:
+            return
+        version = CatalogVersion.current()
+        with self._lock:
+            self._pages.clear()
+            if action == "reload":
+                self._checked_at = 0
+                return
+            for row in rows:
+                self._remove(row["id"])
+                if action != "delete":
+                    self._add(QuestionRecord.from_row(row))
+            if version == self.version + 1:
+                self.version = version
+            else:
+                # another worker wrote in between: reload on next read
+                self._checked_at = 0
+
+    def _add(self, record: QuestionRecord) -> None:
+        self._records[record.id] = record
+        insort(self._ids, record.id)
+        insort(self._category_ids.setdefault(
+            category_key(record.category), []), record.id)
+
+    def _remove(self, question_id: int) -> None:
+        record = self._records.pop(question_id, None)
+        if record is None:
+            return
+        for ids in (self._ids,
+                    self._category_ids.get(category_key(record.category), [])):
+            position = bisect_left(ids, question_id)
+            if position < len(ids) and ids[position] == question_id:
+                del ids[position]
+
+
+class QuestionCounts:
+    """
+    QuestionCounts(ttl)
+        number of questions per category, loaded with one grouped COUNT
+        and then maintained by the local inserts and deletes. The `ttl`
+        bounds staleness for writes made by other processes.
+    """
+
+    def __init__(self, ttl: float = QUESTION_COUNTS_TTL):
+        self._lock = RLock()
+        self.ttl = ttl
+        self._counts: Dict[Optional[int], int] = {}
+        self._total: int = 0
+        self._loaded_at: Optional[float] = None
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counts, self._total = {}, 0
+            self._loaded_at = None
+
+    @property
+    def is_stale(self) -> bool:
+        return self._loaded_at is None or \
+            monotonic() - self._loaded_at > self.ttl
+
+    def load(self) -> None:
+        self.load_rows(db.session.execute(count_questions_by_category()))
+
+    def load_rows(self, rows) -> None:
+        counts: Dict[Optional[int], int] = {}
+        for category, count in rows:
+            key = category_key(category)
+            counts[key] = counts.get(key, 0) + count
+        with self._lock:
+            self._counts = counts
+            self._total = sum(counts.values())
+            self._loaded_at = monotonic()
+
+    def get(self, category: Optional[int] = None) -> int:
+        if self.is_stale:
+            self.load()
+        if category is None:
+            return self._total
+        return self._counts.get(category, 0)
+
+    def apply(self, action: str, rows: List[dict]) -> None:
+        if action not in ("insert", "delete"):
+            # updates may move questions between categories
+            return self.reset()
+        step = 1 if action == "insert" else -1
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            for row in rows:
+                key = category_key(row.get("category"))
+                self._counts[key] = self._counts.get(key, 0) + step
+                self._total += step
+
+
+def count_questions_by_category():
+    return select(Question.category, func.count(Question.id)) \
+        .group_by(Question.category)
+
+
+question_catalog = QuestionCatalog()
+question_counts = QuestionCounts()
+
+
+@on_question_change
+def update_question_catalog(action: str, rows: List[dict]) -> None:
+    # the snapshot is only loaded in an app context, the asynchronous
+    # server has none to read the catalog version with
+    if CATALOG_SNAPSHOT and has_app_context():
+        question_catalog.apply(action, rows)
+
+
+@on_question_change
+def update_question_counts(action: str, rows: List[dict]) -> None:
+    question_counts.apply(action, rows)
+
+
+def get_question(question_id: int, fields: Fields = None):
+    if CATALOG_SNAPSHOT:
+        record = question_catalog.get(question_id)
+        return project(record, fields) if record is not None else None
+    return db.session.execute(
+        select_questions(fields).where(Question.id == question_id)).first()
+
+
+def order_by_ids(rows: list, ids: List[int]) -> Tuple[list, List[int]]:
+    """
+    order_by_ids(rows, ids)
+        the rows in the order of `ids`, and the ids matching no row.
+    """
+    by_id = {row.id: row for row in rows}
+    return [by_id[i] for i in ids if i in by_id], \
+        [i for i in ids if i not in by_id]
+
+
+def get_questions_by_ids(ids: List[int],
+                         fields: Fields = None) -> Tuple[list, List[int]]:
+    """
+    get_questions_by_ids(ids, fields)
+        the questions of `ids` in the requested order, read with a single
+        IN query (or from the snapshot), and the ids of no question.
+    """
+    if CATALOG_SNAPSHOT:
+        questions, missing = order_by_ids(question_catalog.get_many(ids), ids)
+        return [project(record, fields) for record in questions], missing
+    return order_by_ids(db.session.execute(
+        select_questions(fields).where(Question.id.in_(ids))).all(), ids)
+
+
+def count_questions(category: Optional[int] = None) -> int:
+    if CATALOG_SNAPSHOT:
+        return question_catalog.count(category)
+    return question_counts.get(category)
+
+
+def get_questions_page(args: PageArgs, category: Optional[int] = None,
+                       with_total: bool = False,
+                       fields: Fields = None) -> Page:
+    """
+    get_questions_page(args, category, with_total, fields)
+        a page of questions, optionally restricted to one category, served
+        from the catalog snapshot when CATALOG_SNAPSHOT is enabled.
+        `with_total` adds the number of questions from the maintained
+        counts, never from a COUNT over the table. `fields` restricts the
+        columns selected.
+    """
+    if CATALOG_SNAPSHOT:
+        page = question_catalog.page(args, category)
+        if fields is not None:
+            page = replace(page, items=[project(record, fields)
+                                        for record in page.items])
+    else:
+        query = select_questions(fields)
+        if category is not None:
+            query = query.where(Question.category == category)
+        page = paginate(query=query, key=Question.id, args=args)
+    if with_total:
+        page = replace(page, total=count_questions(category))
+    return page
@@ -0,0 +1,264 @@
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from os import getenv
+from threading import Condition
+from time import monotonic
+from typing import (
+    List,
+    Mapping,
+    Optional
+)
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import event, select
+from werkzeug.exceptions import BadRequest, Gone
+from .models import (
+    db,
+    CatalogVersion,
+    Question,
+    QuestionChange,
+    QuestionChangeSeq,
+    on_question_change
+)
+
+CHANGES_PAGE_SIZE: int = int(getenv("CHANGES_PAGE_SIZE", 100))
+CHANGES_MAX_PAGE_SIZE: int = 1000
+# seconds a long-poll may wait for a change
+CHANGES_MAX_WAIT: float = float(getenv("CHANGES_MAX_WAIT", 30))
+# seconds between two reads of a long-poll, to see other processes' writes
+CHANGES_POLL_INTERVAL: float = float(getenv("CHANGES_POLL_INTERVAL", 1))
+MSG_CHANGES_GONE: str = ("the changes following {since} are no longer "
+                         "available, reload the questions and resume from "
+                         "{last_seq}.")
+MSG_BAD_CHANGES_PARAM: str = ("{name} must be a number between {low} and "
+                              "{high}.")
+
+
+@dataclass(frozen=True)
+class ChangesArgs:
+    since: int = 0
+    limit: int = CHANGES_PAGE_SIZE
+    wait: float = 0
+
+
+@dataclass(frozen=True)
+class ChangesPage:
+    changes: List[dict]
+    next_since: int
+    last_seq: int
+    has_more: bool
+
+    def format(self) -> dict:
+        return {
+            "changes": self.changes,
+            "next_since": self.next_since,
+            "last_seq": self.last_seq,
+            "has_more": self.has_more
+        }
+
+
+def _number_param(params: Mapping[str, str], name: str, cast, default,
+                  low, high):
+    if name not in params:
+        return default
+    try:
+        value = cast(params[name])
+    except ValueError:
+        value = None
+    if value is None or not low <= value <= high:
+        raise BadRequest(MSG_BAD_CHANGES_PARAM.format(
+            name=name, low=low, high=high))
+    return value
+
+
+def parse_changes_args(params: Mapping[str, str]) -> ChangesArgs:
+    return ChangesArgs(
+        since=_number_param(params, "since", int, 0, 0, 2 ** 63 - 1),
+        limit=_number_param(params, "limit", int, CHANGES_PAGE_SIZE,
+                            1, CHANGES_MAX_PAGE_SIZE),
+        wait=_number_param(params, "wait", float, 0, 0, CHANGES_MAX_WAIT))
+
+
+def next_seq(connection, count: int = 1) -> int:
+    """
+    next_seq(connection, count)
+        increments the change sequence by `count` within the caller's
+        transaction and returns its new value, the last of the `count`
+        numbers allocated. The UPDATE locks the row until the transaction
+        ends, so changes commit in `seq` order.
+    """
+    table = QuestionChangeSeq.__table__
+    result = connection.execute(table.update().where(table.c.id == 1)
+                                .values(seq=table.c.seq + count))
+    if result.rowcount == 0:
+        connection.execute(table.insert().values(id=1, seq=count))
+        return count
+    return connection.execute(
+        select(table.c.seq).where(table.c.id == 1)).scalar()
+
+
+def change_values(seq: int, action: str, row: Optional[dict],
+                  changed_at: datetime) -> dict:
+    values = {"seq": seq, "action": action, "changed_at": changed_at}
+    if row is not None:
+        values["question_id"] = row["id"]
+        if action != "delete":
+            values.update(question=row["question"], answer=row["answer"],
+                          category=row["category"],
+                          difficulty=row["difficulty"])
+    return values
+
+
+def record_question_change(connection, action: str,
+                           row: Optional[dict] = None) -> int:
+    """
+    record_question_change(connection, action, row)
+        appends a change ("insert", "update", "delete" or "reload") of a
+        formatted question to the feed and bumps the catalog version, in
+        the caller's transaction.
+    """
+    values = change_values(next_seq(connection), action, row,
+                           datetime.utcnow())
+    connection.execute(QuestionChange.__table__.insert().values(**values))
+    CatalogVersion.bump(connection)
+    return values["seq"]
+
+
+def record_question_changes(connection, action: str,
+                            rows: List[dict]) -> None:
+    """
+    record_question_changes(connection, action, rows)
+        record_question_change() of many formatted questions, with one
+        sequence increment and one executemany INSERT.
+    """
+    if not rows:
+        return
+    first_seq = next_seq(connection, len(rows)) - len(rows) + 1
+    changed_at = datetime.utcnow()
+    connection.execute(QuestionChange.__table__.insert(), [
+        change_values(first_seq + i, action, row, changed_at)
+        for i, row in enumerate(rows)])
+    CatalogVersion.bump(connection)
+
+
+@event.listens_for(Question, "after_insert")
+def record_question_insert(mapper, connection, target) -> None:
+    record_question_change(connection, "insert", target.format())
+
+
+@event.listens_for(Question, "after_update")
+def record_question_update(mapper, connection, target) -> None:
+    record_question_change(connection, "update", target.format())
+
+
+@event.listens_for(Question, "after_delete")
+def record_question_delete(mapper, connection, target) -> None:
+    record_question_change(connection, "delete", target.format())
+
+
+def format_change(row) -> dict:
+    tombstone = row.action in ("delete", "reload")
+    return {
+        "seq": row.seq,
+        "action": row.action,
+        "id": row.question_id,
+        "question": None if tombstone else {
+            "id": row.question_id,
+            "question": row.question,
+            "answer": row.answer,
+            "category": row.category,
+            "difficulty": row.difficulty
+        },
+        "changed_at": row.changed_at.isoformat() + "Z"
+    }
+
+
+def read_changes(connection, args: ChangesArgs) -> ChangesPage:
+    """
+    read_changes(connection, args)
+        the changes following `args.since`, oldest first. Raises Gone when
+        some of them were pruned (or `since` is ahead of the feed): the
+        client must reload the questions and resume from `last_seq`,
+        read before the reload.
+    """
+    table = QuestionChange.__table__
+    # read first: every change up to last_seq is committed by then
+    last_seq = connection.execute(select(QuestionChangeSeq.seq).where(
+        QuestionChangeSeq.id == 1)).scalar() or 0
+    rows = connection.execute(
+        select(table).where(table.c.seq > args.since)
+        .order_by(table.c.seq).limit(args.limit + 1)).all()
+    first_seq = rows[0].seq if rows else last_seq + 1
+    if first_seq != args.since + 1:
+        raise Gone(MSG_CHANGES_GONE.format(since=args.since,
+                                           last_seq=last_seq))
+
+    has_more = len(rows) > args.limit
+    rows = rows[:args.limit]
+    return ChangesPage(changes=[format_change(row) for row in rows],
+                       next_since=rows[-1].seq if rows else args.since,
+                       last_seq=last_seq,
+                       has_more=has_more)
+
+
+class ChangeSignal:
+    """wakes up the long-polls of this process on local question writes"""
+
+    def __init__(self):
+        self._condition = Condition()
+        self.generation: int = 0
+
+    def notify(self) -> None:
+        with self._condition:
+            self.generation += 1
+            self._condition.notify_all()
+
+    def wait(self, generation: int, timeout: float) -> None:
+        with self._condition:
+            if self.generation == generation:
+                self._condition.wait(timeout)
+
+
+change_signal = ChangeSignal()
+
+
+@on_question_change
+def wake_up_long_polls(action: str, rows: List[dict]) -> None:
+    change_signal.notify()
+
+
+def get_changes(args: ChangesArgs) -> ChangesPage:
+    """
+    get_changes(args)
+        read_changes() which, when there is none yet and `args.wait` is
+        set, waits for one up to `args.wait` seconds. Local writes wake it
+        up at once, those of other processes within CHANGES_POLL_INTERVAL.
+        The database connection is handed back to the pool while waiting.
+    """
+    deadline = monotonic() + args.wait
+    while True:
+        generation = change_signal.generation
+        page = read_changes(db.session.connection(), args)
+        remaining = deadline - monotonic()
+        if page.changes or remaining <= 0:
+            return page
+        db.session.close()
+        change_signal.wait(generation, min(remaining, CHANGES_POLL_INTERVAL))
+
+
+def prune_question_changes(older_than: timedelta) -> int:
+    table = QuestionChange.__table__
+    result = db.session.execute(table.delete().where(
+        table.c.changed_at < datetime.utcnow() - older_than))
+    db.session.commit()
+    return result.rowcount
+
+
+@click.command("prune-question-changes")
+@click.option("--days", default=30, show_default=True,
+              help="Age of the oldest change kept.")
+@with_appcontext
+def prune_question_changes_command(days: int):
+    """Deletes the old entries of the question change feed."""
+    pruned = prune_question_changes(timedelta(days=days))
+    click.echo(f"{pruned} changes pruned.")
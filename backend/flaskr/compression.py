@@ -0,0 +1,134 @@
+import zlib
+from os import getenv
+from typing import (
+    Iterable,
+    Iterator,
+    List,
+    Optional
+)
+from flask import Flask, Response, request
+from werkzeug.datastructures import Accept
+from werkzeug.http import parse_accept_header
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+COMPRESSION_ENABLED: bool = getenv("COMPRESSION_ENABLED", "1").lower() in \
+    ("1", "true", "yes")
+# bodies smaller than this many bytes are sent as they are
+COMPRESSION_MIN_SIZE: int = int(getenv("COMPRESSION_MIN_SIZE", 1024))
+GZIP_LEVEL: int = int(getenv("GZIP_LEVEL", 6))
+BROTLI_QUALITY: int = int(getenv("BROTLI_QUALITY", 5))
+# cached bodies are compressed once, so at the highest settings
+CACHED_GZIP_LEVEL: int = 9
+CACHED_BROTLI_QUALITY: int = 11
+# wbits=16+MAX_WBITS makes zlib write a gzip header and trailer
+GZIP_WBITS: int = 16 + zlib.MAX_WBITS
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/")
+# in order of preference when the client accepts several equally
+ENCODINGS: List[str] = ["br", "gzip"] if brotli is not None else ["gzip"]
+
+
+def choose_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """
+    choose_encoding(accept_encoding)
+        the content coding to answer an Accept-Encoding header with, None
+        when the client accepts none of ENCODINGS.
+    """
+    if not accept_encoding:
+        return None
+    return parse_accept_header(accept_encoding, Accept).best_match(ENCODINGS)
+
+
+def is_compressible(mimetype: Optional[str], size: int,
+                    min_size: int = COMPRESSION_MIN_SIZE) -> bool:
+    return mimetype is not None and size >= min_size and \
+        mimetype.startswith(COMPRESSIBLE_TYPES)
+
+
+def compress(body: bytes, encoding: str, cached: bool = False) -> bytes:
+    if encoding == "br":
+        return brotli.compress(
+            body, quality=CACHED_BROTLI_QUALITY if cached else BROTLI_QUALITY)
+    compressor = zlib.compressobj(
+        CACHED_GZIP_LEVEL if cached else GZIP_LEVEL, zlib.DEFLATED,
+        GZIP_WBITS)
+    return compressor.compress(body) + compressor.flush()
+
+
+class StreamCompressor:
+    """
+    StreamCompressor(encoding)
+        incremental gzip or brotli compression of a streamed body.
+    """
+
+    def __init__(self, encoding: str):
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+            self._compress = self._compressor.process
+            self._flush = self._compressor.finish
+        else:
+            self._compressor = zlib.compressobj(
+                GZIP_LEVEL, zlib.DEFLATED, GZIP_WBITS)
+            self._compress = self._compressor.compress
+            self._flush = self._compressor.flush
+
+    def compress(self, chunk: bytes) -> bytes:
+        return self._compress(chunk)
+
+    def flush(self) -> bytes:
+        return self._flush()
+
+
+def compress_chunks(chunks: Iterable[bytes],
+                    encoding: str) -> Iterator[bytes]:
+    compressor = StreamCompressor(encoding)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def weak_etag(etag: str) -> str:
+    """
+    weak_etag(etag)
+        the ETag of a compressed representation: weak, since its bytes
+        differ from the identity one, yet still matched by If-None-Match.
+    """
+    return etag if etag.startswith("W/") else "W/" + etag
+
+
+def init_compression(app: Flask, enabled: bool = COMPRESSION_ENABLED) -> None:
+    """
+    init_compression(app, enabled)
+        compresses the JSON and text responses of at least
+        COMPRESSION_MIN_SIZE bytes with the best coding the client accepts,
+        brotli (when installed) or gzip. Responses already encoded, such as
+        the precompressed cached ones, only get their headers completed.
+    """
+    if not enabled:
+        return
+
+    @app.after_request
+    def compress_response(response: Response) -> Response:
+        if response.mimetype is None or \
+                not response.mimetype.startswith(COMPRESSIBLE_TYPES):
+            return response
+        response.vary.add("Accept-Encoding")
+        if "Content-Encoding" not in response.headers:
+            if response.status_code != 200 or response.direct_passthrough \
+                    or response.is_streamed:
+                return response
+            body = response.get_data()
+            encoding = choose_encoding(request.headers.get("Accept-Encoding"))
+            if encoding is None or \
+                    not is_compressible(response.mimetype, len(body)):
+                return response
+            response.set_data(compress(body, encoding))
+            response.headers["Content-Encoding"] = encoding
+        if "ETag" in response.headers:
+            response.headers["ETag"] = weak_etag(response.headers["ETag"])
+        return response
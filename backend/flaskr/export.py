@@ -0,0 +1,57 @@
+from os import getenv
+from typing import (
+    Iterator,
+    Mapping,
+    Optional
+)
+from werkzeug.exceptions import BadRequest
+from .models import db, Question
+from .pagination import MAX_BIGINT
+from .payloads import MSG_NOT_AN_INTEGER
+from .serialization import dumps
+
+EXPORT_BATCH_SIZE: int = int(getenv("EXPORT_BATCH_SIZE", 1000))
+
+
+def parse_export_category(params: Mapping[str, str]) -> Optional[int]:
+    """
+    parse_export_category(params)
+        the category to export from a query string mapping, None for the
+        whole catalog. Raises BadRequest when it is not an integer.
+    """
+    if "category" not in params:
+        return None
+    try:
+        category = int(params["category"])
+    except ValueError:
+        raise BadRequest(MSG_NOT_AN_INTEGER.format(field="category"))
+    if abs(category) > MAX_BIGINT:
+        raise BadRequest(MSG_NOT_AN_INTEGER.format(field="category"))
+    return category
+
+
+def export_questions(category: Optional[int] = None,
+                     batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[bytes]:
+    """
+    export_questions(category, batch_size)
+        yields the questions as NDJSON, one chunk per batch of rows.
+        Rows are read through a server-side cursor `batch_size` at a time,
+        so memory stays constant whatever the size of the table.
+    """
+    query = db.session.query(
+        Question.id, Question.question, Question.answer,
+        Question.category, Question.difficulty
+    ).order_by(Question.id)
+    if category is not None:
+        query = query.filter(Question.category == category)
+    query = query.execution_options(stream_results=True) \
+        .yield_per(batch_size)
+
+    lines = []
+    for row in query:
+        lines.append(dumps(row._asdict()))
+        if len(lines) >= batch_size:
+            yield b"\n".join(lines) + b"\n"
+            lines = []
+    if lines:
+        yield b"\n".join(lines) + b"\n"
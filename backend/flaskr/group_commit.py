@@ -0,0 +1,232 @@
+import logging
+from os import getenv, getpid
+from queue import Empty, Full, Queue
+from threading import Event, Lock, Thread
+from time import monotonic
+from typing import (
+    List,
+    Optional
+)
+from flask import Flask, current_app
+from sqlalchemy.exc import SQLAlchemyError
+from werkzeug.exceptions import ServiceUnavailable, UnprocessableEntity
+from .changes import record_question_changes
+from .models import db, Question, notify_question_change
+from .replicas import note_write
+
+GROUP_COMMIT_ENABLED: bool = getenv("GROUP_COMMIT_ENABLED", "0").lower() in \
+    ("1", "true", "yes")
+# most inserts committed by one transaction
+GROUP_COMMIT_MAX_BATCH: int = int(getenv("GROUP_COMMIT_MAX_BATCH", 64))
+# milliseconds the first insert of a batch waits for others to join it
+GROUP_COMMIT_WINDOW_MS: float = float(getenv("GROUP_COMMIT_WINDOW_MS", 2))
+# inserts waiting for the writer before new ones are turned away
+GROUP_COMMIT_MAX_QUEUE: int = int(getenv("GROUP_COMMIT_MAX_QUEUE", 1024))
+# seconds an insert waits for room in a full queue before a 503
+GROUP_COMMIT_QUEUE_TIMEOUT: float = float(
+    getenv("GROUP_COMMIT_QUEUE_TIMEOUT", 1))
+# seconds an insert waits for its commit before a 503
+GROUP_COMMIT_WAIT_TIMEOUT: float = float(
+    getenv("GROUP_COMMIT_WAIT_TIMEOUT", 10))
+GROUP_COMMIT_EXTENSION: str = "trivia_group_commit"
+MSG_WRITE_QUEUE_FULL: str = "too many questions are being written, " \
+    "retry in a moment."
+MSG_INSERT_REJECTED: str = "the question was rejected by the database."
+MSG_INSERT_TIMEOUT: str = "the question was not written in time, " \
+    "retry in a moment."
+MSG_COMMIT_TIMEOUT: str = "the question was not committed in time and may " \
+    "still be stored, check before retrying."
+
+
+class PendingInsert:
+    """
+    PendingInsert(row)
+        a question row waiting for the writer, then its formatted question
+        or the error to raise in the request that submitted it.
+    """
+
+    def __init__(self, row: dict):
+        self.row = row
+        self.question: Optional[dict] = None
+        self.error: Optional[Exception] = None
+        self._done = Event()
+        self._lock = Lock()
+        self._started = False
+        self._cancelled = False
+
+    def start(self) -> bool:
+        """
+        start()
+            called by the writer before committing the row, returns False
+            when the request gave up waiting and the row must be skipped.
+        """
+        with self._lock:
+            self._started = not self._cancelled
+            return self._started
+
+    def succeed(self, question: dict) -> None:
+        self.question = question
+        self._done.set()
+
+    def fail(self, error: Exception) -> None:
+        self.error = error
+        self._done.set()
+
+    def wait(self, timeout: Optional[float] = None) -> dict:
+        """
+        wait(timeout)
+            the formatted question once committed. Raises a 503 after
+            `timeout` seconds: the row is withdrawn when the writer has not
+            started on it yet, otherwise it may still be committed.
+        """
+        if not self._done.wait(timeout):
+            with self._lock:
+                self._cancelled = not self._started
+                if self._cancelled:
+                    raise ServiceUnavailable(MSG_INSERT_TIMEOUT)
+            raise ServiceUnavailable(MSG_COMMIT_TIMEOUT)
+        if self.error is not None:
+            raise self.error
+        return self.question
+
+
+class GroupCommitter:
+    """
+    GroupCommitter(app, max_batch, window, max_queue, queue_timeout,
+                   wait_timeout)
+        coalesces the question inserts of concurrent requests: a writer
+        thread takes the first waiting insert, lets others join it for
+        `window` seconds or until `max_batch` are waiting, and commits them
+        in one transaction. Each request still gets its own id or error: a
+        batch rejected by the database is retried insert by insert.
+        At most `max_queue` inserts wait for the writer, the next ones
+        wait up to `queue_timeout` seconds for room, then fail with a 503,
+        as do the inserts not committed within `wait_timeout` seconds.
+    """
+
+    def __init__(self, app: Flask,
+                 max_batch: int = GROUP_COMMIT_MAX_BATCH,
+                 window: float = GROUP_COMMIT_WINDOW_MS / 1000,
+                 max_queue: int = GROUP_COMMIT_MAX_QUEUE,
+                 queue_timeout: float = GROUP_COMMIT_QUEUE_TIMEOUT,
+                 wait_timeout: float = GROUP_COMMIT_WAIT_TIMEOUT):
+        self.app = app
+        self.max_batch = max_batch
+        self.window = window
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.wait_timeout = wait_timeout
+        self._lock = Lock()
+        self._queue: Optional[Queue] = None
+        self._writer: Optional[Thread] = None
+        self._pid: Optional[int] = None
+
+    def insert(self, row: dict) -> dict:
+        pending = PendingInsert(row)
+        try:
+            self._ensure_writer().put(pending, timeout=self.queue_timeout)
+        except Full:
+            raise ServiceUnavailable(MSG_WRITE_QUEUE_FULL)
+        return pending.wait(self.wait_timeout)
+
+    def _ensure_writer(self) -> Queue:
+        # the writer is started by the first insert of each worker process,
+        # a thread started before gunicorn forks would not survive the fork
+        if self._pid != getpid() or not self._writer.is_alive():
+            with self._lock:
+                if self._pid != getpid() or not self._writer.is_alive():
+                    self._queue = Queue(maxsize=self.max_queue)
+                    self._writer = Thread(
+                        target=self._run, args=(self._queue,),
+                        name="group-commit", daemon=True)
+                    self._writer.start()
+                    self._pid = getpid()
+        return self._queue
+
+    def _run(self, queue: Queue) -> None:
+        while True:
+            batch = self._next_batch(queue)
+            if not batch:
+                continue
+            try:
+                with self.app.app_context():
+                    self._commit(batch)
+            except Exception as e:
+                logging.error(f"group commit of {len(batch)} questions "
+                              f"failed: {e.args}")
+                for pending in batch:
+                    if pending.error is None and pending.question is None:
+                        pending.fail(e)
+
+    def _next_batch(self, queue: Queue) -> List[PendingInsert]:
+        batch = [queue.get()]
+        deadline = monotonic() + self.window
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(queue.get(timeout=max(deadline - monotonic(), 0)))
+            except Empty:
+                break
+        return [pending for pending in batch if pending.start()]
+
+    def _commit(self, batch: List[PendingInsert]) -> None:
+        try:
+            questions = insert_questions([pending.row for pending in batch])
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            if len(batch) > 1:
+                for pending in batch:
+                    self._commit([pending])
+                return
+            logging.error(e.args)
+            batch[0].fail(UnprocessableEntity(MSG_INSERT_REJECTED))
+            return
+        notify_question_change("insert", questions)
+        for pending, question in zip(batch, questions):
+            pending.succeed(question)
+
+
+def insert_questions(rows: List[dict]) -> List[dict]:
+    """
+    insert_questions(rows)
+        inserts question rows, one statement each to get their ids, and
+        records them in the change feed, with a single commit. Returns the
+        formatted questions.
+    """
+    table = Question.__table__
+    questions = []
+    for row in rows:
+        result = db.session.execute(table.insert().values(**row))
+        questions.append({"id": result.inserted_primary_key[0], **row})
+    record_question_changes(db.session.connection(), "insert", questions)
+    db.session.commit()
+    return questions
+
+
+def init_group_commit(app: Flask,
+                      enabled: bool = GROUP_COMMIT_ENABLED,
+                      **options) -> None:
+    """
+    init_group_commit(app, enabled, **options)
+        makes insert_question() go through a GroupCommitter, built with
+        `options`, so that bursts of submissions share their transactions
+        and fsyncs.
+    """
+    if enabled:
+        app.extensions[GROUP_COMMIT_EXTENSION] = GroupCommitter(app, **options)
+
+
+def insert_question(row: dict) -> dict:
+    """
+    insert_question(row)
+        inserts a validated question row and returns the formatted
+        question, committed on its own or with the concurrent inserts when
+        init_group_commit() is enabled.
+    """
+    committer = current_app.extensions.get(GROUP_COMMIT_EXTENSION)
+    if committer is None:
+        question = Question(**row)
+        question.insert()
+        return question.format()
+    question = committer.insert(row)
+    note_write()
+    return question
@@ -0,0 +1,282 @@
+from contextvars import ContextVar
+from contextlib import contextmanager
+from os import getenv
+from threading import Lock
+from time import perf_counter
+from typing import (
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple
+)
+from flask import (
+    Flask,
+    Response,
+    g,
+    request
+)
+from flasgger import swag_from
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+METRICS_ENABLED: bool = getenv("METRICS_ENABLED", "1").lower() in \
+    ("1", "true", "yes")
+METRICS_PATH: str = "/metrics"
+PROMETHEUS_CONTENT_TYPE: str = "text/plain; version=0.0.4; charset=utf-8"
+SERVER_TIMING_HEADER: str = "Server-Timing"
+UNMATCHED_ROUTE: str = "<unmatched>"
+LATENCY_BUCKETS: Tuple[float, ...] = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+STATEMENT_BUCKETS: Tuple[float, ...] = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+QUERY_STARTS: str = "metrics_query_starts"
+
+Labels = Tuple[str, ...]
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._lock = Lock()
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, labels: Labels, value: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}",
+                 f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(
+                    f"{self.name}{format_labels(self.labels, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    """
+    Histogram(name, help, labels, buckets)
+        cumulative histogram in the Prometheus text format: one counter per
+        upper bound, plus +Inf, the sum and the count of the observations.
+    """
+
+    def __init__(self, name: str, help: str, labels: Labels,
+                 buckets: Tuple[float, ...]):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._lock = Lock()
+        # labels -> (count per bucket, +Inf count, sum)
+        self._values: Dict[Labels, list] = {}
+
+    def observe(self, labels: Labels, value: float) -> None:
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                series = [[0] * len(self.buckets), 0, 0.0]
+                self._values[labels] = series
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += 1
+            series[2] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}",
+                 f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, (counts, total, value_sum) in \
+                    sorted(self._values.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f"{self.name}_bucket" + format_labels(
+                        self.labels + ("le",), labels + (str(bound),))
+                        + f" {bucket_count}")
+                lines.append(f"{self.name}_bucket" + format_labels(
+                    self.labels + ("le",), labels + ("+Inf",)) + f" {total}")
+                label_set = format_labels(self.labels, labels)
+                lines.append(f"{self.name}_sum{label_set} {value_sum}")
+                lines.append(f"{self.name}_count{label_set} {total}")
+        return lines
+
+
+def format_labels(names: Labels, values: Labels) -> str:
+    if not names:
+        return ""
+    pairs = (f'{name}="{escape_label(value)}"'
+             for name, value in zip(names, values))
+    return "{" + ",".join(pairs) + "}"
+
+
+def escape_label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n") \
+        .replace('"', '\\"')
+
+
+class RequestTimings:
+    """time spent by the current request in the database and in JSON"""
+    __slots__ = ("method", "route", "started", "sql_count", "sql_seconds",
+                 "json_seconds")
+
+    def __init__(self, method: Optional[str] = None,
+                 route: Optional[str] = None):
+        self.method = method
+        self.route = route
+        self.started = perf_counter()
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.json_seconds = 0.0
+
+    def server_timing(self, total: float) -> str:
+        app = max(total - self.sql_seconds - self.json_seconds, 0)
+        return (f'db;dur={self.sql_seconds * 1000:.3f};'
+                f'desc="{self.sql_count} queries", '
+                f"json;dur={self.json_seconds * 1000:.3f}, "
+                f"app;dur={app * 1000:.3f}, "
+                f"total;dur={total * 1000:.3f}")
+
+
+class RequestMetrics:
+    """
+    RequestMetrics()
+        per-route request counts and latency, SQL statement and JSON
+        encoding histograms of the process. Every worker process keeps
+        its own, as does any Prometheus client library without a shared
+        store.
+    """
+
+    def __init__(self):
+        self.requests = Counter(
+            "trivia_http_requests_total",
+            "HTTP requests served.", ("method", "route", "status"))
+        self.latency = Histogram(
+            "trivia_http_request_duration_seconds",
+            "Time to build the response.", ("method", "route"),
+            LATENCY_BUCKETS)
+        self.sql_statements = Histogram(
+            "trivia_sql_statements_per_request",
+            "SQL statements executed per request.", ("method", "route"),
+            STATEMENT_BUCKETS)
+        self.sql_duration = Histogram(
+            "trivia_sql_duration_seconds",
+            "Time spent in SQL statements per request.", ("method", "route"),
+            LATENCY_BUCKETS)
+        self.json_duration = Histogram(
+            "trivia_json_duration_seconds",
+            "Time spent encoding JSON per request.", ("method", "route"),
+            LATENCY_BUCKETS)
+
+    def observe(self, method: str, route: str, status: int,
+                timings: RequestTimings, total: float) -> None:
+        labels = (method, route)
+        self.requests.inc((method, route, str(status)))
+        self.latency.observe(labels, total)
+        self.sql_statements.observe(labels, timings.sql_count)
+        self.sql_duration.observe(labels, timings.sql_seconds)
+        self.json_duration.observe(labels, timings.json_seconds)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in (self.requests, self.latency, self.sql_statements,
+                       self.sql_duration, self.json_duration):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+request_metrics = RequestMetrics()
+# contextvars follow both threads (WSGI) and asyncio tasks (ASGI)
+current_timings: ContextVar[Optional[RequestTimings]] = ContextVar(
+    "current_timings", default=None)
+
+
+def start_request(method: Optional[str] = None, route: Optional[str] = None):
+    return current_timings.set(RequestTimings(method, route))
+
+
+def finish_request(method: str, route: str, status: int) -> Optional[str]:
+    """
+    finish_request(method, route, status)
+        records the request started with start_request() and returns its
+        Server-Timing header value.
+    """
+    timings = current_timings.get()
+    if timings is None:
+        return None
+    total = perf_counter() - timings.started
+    request_metrics.observe(method, route, status, timings, total)
+    return timings.server_timing(total)
+
+
+def end_request(token) -> None:
+    current_timings.reset(token)
+
+
+@contextmanager
+def json_timer() -> Iterator[None]:
+    timings = current_timings.get()
+    if timings is None:
+        yield
+        return
+    started = perf_counter()
+    try:
+        yield
+    finally:
+        timings.json_seconds += perf_counter() - started
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def start_query(conn, cursor, statement, parameters, context, executemany):
+    if current_timings.get() is not None:
+        conn.info.setdefault(QUERY_STARTS, []).append(perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def end_query(conn, cursor, statement, parameters, context, executemany):
+    timings = current_timings.get()
+    starts = conn.info.get(QUERY_STARTS)
+    if timings is None or not starts:
+        return
+    timings.sql_count += 1
+    timings.sql_seconds += perf_counter() - starts.pop()
+
+
+def request_route() -> str:
+    rule = request.url_rule
+    return rule.rule if rule is not None else UNMATCHED_ROUTE
+
+
+def init_metrics(app: Flask, enabled: bool = METRICS_ENABLED) -> None:
+    """
+    init_metrics(app, enabled)
+        instruments every request of the application and serves the
+        collected metrics in the Prometheus text format at /metrics.
+        Responses carry a Server-Timing header splitting their duration
+        between the database, JSON encoding and the rest of the view.
+    """
+    if not enabled:
+        return
+
+    @app.before_request
+    def start_request_metrics():
+        g.metrics_token = start_request(request.method, request_route())
+
+    @app.after_request
+    def finish_request_metrics(response: Response) -> Response:
+        token = g.pop("metrics_token", None)
+        if token is None:
+            return response
+        server_timing = finish_request(
+            request.method, request_route(), response.status_code)
+        end_request(token)
+        if server_timing is not None:
+            response.headers[SERVER_TIMING_HEADER] = server_timing
+        return response
+
+    @app.route(METRICS_PATH)
+    @swag_from("docs/metrics.yaml")
+    def get_metrics() -> Response:
+        return Response(request_metrics.render(),
+                        content_type=PROMETHEUS_CONTENT_TYPE)
@@ -0,0 +1,107 @@
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import Integer, inspect, text
+from .changes import record_question_change
+from .models import db, notify_question_change
+
+QUESTION_INDEXES = {
+    "ix_questions_category": "category",
+    "ix_questions_difficulty": "difficulty"
+}
+CATEGORY_FK_NAME: str = "category"
+
+
+def count_orphan_questions(connection) -> int:
+    return connection.execute(text(
+        "SELECT count(*) FROM questions WHERE category IS NOT NULL "
+        "AND CAST(category AS INTEGER) NOT IN (SELECT id FROM categories)"
+    )).scalar()
+
+
+def migrate_question_category(connection) -> list:
+    """
+    migrate_question_category(connection)
+        converts questions.category to an integer foreign key to
+        categories.id and indexes questions.category and
+        questions.difficulty. Every step is skipped when already applied.
+        Returns the list of the steps performed.
+    """
+    steps = []
+    inspector = inspect(connection)
+    columns = {c["name"]: c for c in inspector.get_columns("questions")}
+    is_postgres = connection.dialect.name == "postgresql"
+
+    is_integer = isinstance(columns["category"]["type"], Integer)
+    has_fk = any(fk["constrained_columns"] == ["category"]
+                 for fk in inspector.get_foreign_keys("questions"))
+
+    if is_postgres:
+        if not is_integer:
+            connection.execute(text(
+                "ALTER TABLE questions ALTER COLUMN category TYPE integer "
+                "USING category::integer"))
+            steps.append("converted questions.category to integer")
+        if not has_fk:
+            connection.execute(text(
+                f"ALTER TABLE questions ADD CONSTRAINT {CATEGORY_FK_NAME} "
+                "FOREIGN KEY (category) REFERENCES categories (id) "
+                "ON UPDATE CASCADE ON DELETE SET NULL"))
+            steps.append("added the questions.category foreign key")
+    elif not is_integer or not has_fk:
+        # sqlite can neither alter a column type nor add a constraint:
+        # the table is rebuilt and its rows copied over.
+        connection.execute(text(
+            "CREATE TABLE questions_migrated ("
+            "id INTEGER NOT NULL PRIMARY KEY, "
+            "question VARCHAR, "
+            "answer VARCHAR, "
+            "category INTEGER REFERENCES categories (id) "
+            "ON UPDATE CASCADE ON DELETE SET NULL, "
+            "difficulty INTEGER)"))
+        connection.execute(text(
+            "INSERT INTO questions_migrated "
+            "(id, question, answer, category, difficulty) "
+            "SELECT id, question, answer, CAST(category AS INTEGER), "
+            "difficulty FROM questions"))
+        connection.execute(text("DROP TABLE questions"))
+        connection.execute(text(
+            "ALTER TABLE questions_migrated RENAME TO questions"))
+        steps.append("rebuilt questions with an integer category foreign key")
+        inspector = inspect(connection)
+
+    existing = {ix["name"] for ix in inspector.get_indexes("questions")}
+    for name, column in QUESTION_INDEXES.items():
+        if name not in existing:
+            connection.execute(text(
+                f"CREATE INDEX IF NOT EXISTS {name} ON questions ({column})"))
+            steps.append(f"created index {name}")
+    return steps
+
+
+@click.command("init-db")
+@with_appcontext
+def init_db_command():
+    """Creates the missing tables and indexes."""
+    db.create_all()
+    click.echo("Database schema is up to date.")
+
+
+@click.command("migrate-question-category")
+@with_appcontext
+def migrate_question_category_command():
+    """Converts questions.category to an indexed integer foreign key."""
+    with db.engine.begin() as connection:
+        orphans = count_orphan_questions(connection)
+        if orphans:
+            raise click.ClickException(
+                f"{orphans} questions reference a category that does not "
+                "exist, fix them before migrating.")
+        steps = migrate_question_category(connection)
+        if steps:
+            record_question_change(connection, "reload")
+    for step in steps:
+        click.echo(step)
+    if steps:
+        notify_question_change("reload", [])
+    else:
+        click.echo("Nothing to migrate.")
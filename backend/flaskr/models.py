@@ -1,29 +1,144 @@
 from os import getenv
-from sqlalchemy import Column, String, Integer, create_engine
-from flask_sqlalchemy import SQLAlchemy
+from datetime import datetime
+from sqlalchemy import (
+    DDL,
+    Column,
+    DateTime,
+    ForeignKey,
+    LargeBinary,
+    String,
+    Integer,
+    create_engine,
+    event,
+    orm,
+    select,
+    update
+)
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from typing import (
+    Callable,
+    List,
+    Optional
+)
 import json
+import logging
 
 db_server_name: str = "psql_db:5432" if getenv("FLASK_LOCAL") is None \
     else "localhost:5432"
 database_name = "trivia_test"
-database_path = "postgresql://{}:{}@{}/{}".format("jorgepl",
-                                                  "admin",
-                                                  db_server_name,
-                                                  database_name)
+database_path = getenv("DATABASE_URL") or \
+    "postgresql://{}:{}@{}/{}".format("jorgepl",
+                                      "admin",
+                                      db_server_name,
+                                      database_name)
 
-db = SQLAlchemy()
+DB_POOL_SIZE: int = int(getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW: int = int(getenv("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT: float = float(getenv("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE: int = int(getenv("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING: bool = getenv("DB_POOL_PRE_PING", "1").lower() in \
+    ("1", "true", "yes")
+# milliseconds, 0 disables the timeout
+DB_STATEMENT_TIMEOUT: int = int(getenv("DB_STATEMENT_TIMEOUT", 0))
+# comma separated database URLs of the read replicas
+DATABASE_REPLICA_URLS: List[str] = [
+    url.strip() for url in getenv("DATABASE_REPLICA_URLS", "").split(",")
+    if url.strip()]
+REPLICA_BIND_PREFIX: str = "replica_"
+DB_ROUTER_EXTENSION: str = "trivia_db_router"
 
 
-def setup_db(app, database_path=database_path):
+class RoutingSession(SignallingSession):
     """
-    setup_db(app)
-        binds a flask application and a SQLAlchemy service
+    RoutingSession
+        SignallingSession asking the router registered on the application,
+        if any (see replicas.init_replicas()), for the engine of each
+        statement; the primary is used when it has no opinion.
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        router = self.app.extensions.get(DB_ROUTER_EXTENSION)
+        bind = router.get_bind(self, clause) if router is not None else None
+        return bind if bind is not None else \
+            super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+db = RoutingSQLAlchemy()
+
+
+def engine_options(database_path: str) -> dict:
+    """
+    engine_options(database_path)
+        SQLAlchemy engine options built from the DB_* environment variables.
+        Pool sizing and the statement timeout only apply to server databases,
+        sqlite keeps the pool SQLAlchemy picks for it.
+    """
+    options = {"pool_pre_ping": DB_POOL_PRE_PING}
+    if database_path.startswith("sqlite"):
+        return options
+    options.update(pool_size=DB_POOL_SIZE,
+                   max_overflow=DB_MAX_OVERFLOW,
+                   pool_timeout=DB_POOL_TIMEOUT,
+                   pool_recycle=DB_POOL_RECYCLE)
+    if DB_STATEMENT_TIMEOUT and database_path.startswith("postgres"):
+        options["connect_args"] = {
+            "options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT}"}
+    return options
+
+
+def category_key(category) -> Optional[int]:
+    try:
+        return int(category)
+    except (TypeError, ValueError):
+        return None
+
+
+QuestionListener = Callable[[str, List[dict]], None]
+_question_listeners: List[QuestionListener] = []
+
+
+def on_question_change(listener: QuestionListener) -> QuestionListener:
+    """
+    on_question_change(listener)
+        registers a callable invoked with an action ("insert", "update" or
+        "delete") and the formatted rows, once the change is committed.
+        The "reload" action, with no rows, reports changes too large to be
+        described row by row: listeners must drop what they derived.
+    """
+    _question_listeners.append(listener)
+    return listener
+
+
+def notify_question_change(action: str, rows: List[dict]) -> None:
+    for listener in _question_listeners:
+        try:
+            listener(action, rows)
+        except Exception as e:
+            logging.error(f"{listener.__name__} failed on {action}: {e.args}")
+
+
+def setup_db(app, database_path=database_path,
+             replica_urls: List[str] = DATABASE_REPLICA_URLS):
+    """
+    setup_db(app, database_path, replica_urls)
+        binds a flask application and a SQLAlchemy service, along with
+        the read replicas (see replicas.init_replicas()).
+        No DDL is issued here: the schema is created once with
+        `flask init-db`.
     """
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
+    # no model is bound to the replicas, `flask init-db` leaves them alone
+    app.config["SQLALCHEMY_BINDS"] = {
+        f"{REPLICA_BIND_PREFIX}{i}": url for i, url in enumerate(replica_urls)}
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(database_path)
     db.app = app
     db.init_app(app)
-    db.create_all()
 
 
 class Question(db.Model):
@@ -32,8 +147,11 @@ class Question(db.Model):
     id = Column(Integer, primary_key=True)
     question = Column(String)
     answer = Column(String)
-    category = Column(String)
-    difficulty = Column(Integer)
+    category = Column(Integer,
+                      ForeignKey('categories.id',
+                                 onupdate='CASCADE', ondelete='SET NULL'),
+                      index=True)
+    difficulty = Column(Integer, index=True)
 
     def __init__(self, question, answer, category, difficulty):
         self.question = question
@@ -44,13 +162,17 @@ class Question(db.Model):
     def insert(self):
         db.session.add(self)
         db.session.commit()
+        notify_question_change("insert", [self.format()])
 
     def update(self):
         db.session.commit()
+        notify_question_change("update", [self.format()])
 
     def delete(self):
+        row = self.format()
         db.session.delete(self)
         db.session.commit()
+        notify_question_change("delete", [row])
 
     def format(self):
         return {
@@ -76,3 +198,102 @@ class Category(db.Model):
             'id': self.id,
             'type': self.type
         }
+
+
+class CatalogVersion(db.Model):
+    __tablename__ = 'catalog_version'
+
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+    @classmethod
+    def current(cls, connection=None) -> int:
+        """
+        CatalogVersion.current(connection)
+            reads the catalog version through `connection`, by default a
+            connection to the primary: a lagging replica would hide the
+            writes of other workers. The row is created with the table.
+        """
+        if connection is None:
+            with db.engine.connect() as connection:
+                return cls.current(connection)
+        return connection.execute(
+            select(cls.version).where(cls.id == 1)).scalar() or 0
+
+    @classmethod
+    def bump(cls, connection=None) -> int:
+        """
+        CatalogVersion.bump(connection)
+            increments the catalog version and returns the new value, in
+            the transaction of `connection`, committed by the caller, or
+            in a transaction of the session committed at once.
+            The UPDATE locks the row, so concurrent bumps are serialized.
+        """
+        if connection is None:
+            version = cls.bump(db.session)
+            db.session.commit()
+            return version
+        connection.execute(update(cls.__table__).where(cls.id == 1)
+                           .values(version=cls.version + 1))
+        return connection.execute(
+            select(cls.version).where(cls.id == 1)).scalar()
+
+
+event.listen(
+    CatalogVersion.__table__,
+    "after_create",
+    DDL("INSERT INTO catalog_version (id, version) VALUES (1, 0)"))
+
+
+class QuestionChange(db.Model):
+    """
+    QuestionChange
+        one entry of the question change feed. `seq` is allocated from the
+        question_change_seq row inside the writing transaction, so entries
+        become visible in `seq` order without gaps. Deletions are kept as
+        tombstones (no question data) and "reload" entries (no question id)
+        report changes the feed cannot describe row by row.
+    """
+    __tablename__ = 'question_changes'
+
+    seq = Column(Integer, primary_key=True, autoincrement=False)
+    action = Column(String(8), nullable=False)
+    question_id = Column(Integer)
+    question = Column(String)
+    answer = Column(String)
+    category = Column(Integer)
+    difficulty = Column(Integer)
+    changed_at = Column(DateTime, nullable=False, default=datetime.utcnow,
+                        index=True)
+
+
+class QuestionChangeSeq(db.Model):
+    __tablename__ = 'question_change_seq'
+
+    id = Column(Integer, primary_key=True)
+    seq = Column(Integer, nullable=False, default=0)
+
+
+# the row exists from the start so that concurrent first writes all
+# increment it instead of racing to insert it
+event.listen(
+    QuestionChangeSeq.__table__,
+    "after_create",
+    DDL("INSERT INTO question_change_seq (id, seq) VALUES (1, 0)"))
+
+
+class QuizSessionState(db.Model):
+    """
+    QuizSessionState
+        a quiz session shared by every worker: the shuffled question ids
+        packed as 64-bit little-endian integers, the number of them asked
+        so far and the time the session expires, pushed back on each use.
+    """
+    __tablename__ = 'quiz_sessions'
+
+    token = Column(String(32), primary_key=True)
+    category = Column(Integer, nullable=False)
+    question_ids = Column(LargeBinary, nullable=False)
+    total = Column(Integer, nullable=False)
+    cursor = Column(Integer, nullable=False, default=0)
+    expires_at = Column(DateTime, nullable=False, index=True)
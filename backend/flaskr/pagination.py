@@ -0,0 +1,229 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as B64DecodeError
+from bisect import bisect_right
+from dataclasses import dataclass
+from typing import (
+    List,
+    Mapping,
+    Optional
+)
+from flask import (
+    Response,
+    request
+)
+from sqlalchemy.sql import Select
+from werkzeug.exceptions import BadRequest
+from .models import db
+from .serialization import format_row, json_response
+
+QUESTIONS_PER_PAGE = 10
+# largest integer sqlite and postgres accept as a bound parameter
+MAX_BIGINT: int = 2 ** 63 - 1
+MAX_PAGE: int = MAX_BIGINT // QUESTIONS_PER_PAGE
+NEXT_CURSOR_HEADER: str = "X-Next-Cursor"
+MSG_BAD_PAGE: str = "page must be a positive integer."
+MSG_BAD_CURSOR: str = "cursor is not valid."
+MSG_BAD_AFTER_ID: str = "after_id must be an integer."
+ENVELOPE_PARAM: str = "envelope"
+
+
+@dataclass(frozen=True)
+class PageArgs:
+    page: int = 1
+    after_id: Optional[int] = None
+    cursor: Optional[int] = None
+
+    @property
+    def seek_id(self) -> Optional[int]:
+        return self.cursor if self.cursor is not None else self.after_id
+
+    def offset(self, per_page: int = QUESTIONS_PER_PAGE) -> int:
+        if self.cursor is not None:
+            return self.cursor
+        return (self.page - 1) * per_page
+
+
+@dataclass(frozen=True)
+class Page:
+    items: List[object]
+    next_cursor: Optional[str] = None
+    # number of items of all the pages, when known without counting
+    total: Optional[int] = None
+
+
+def encode_cursor(position: int) -> str:
+    return urlsafe_b64encode(str(position).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> int:
+    try:
+        padding = "=" * (-len(cursor) % 4)
+        position = int(urlsafe_b64decode(cursor + padding).decode())
+    except (B64DecodeError, UnicodeDecodeError, ValueError):
+        raise BadRequest(MSG_BAD_CURSOR)
+    if not 0 <= position <= MAX_BIGINT:
+        raise BadRequest(MSG_BAD_CURSOR)
+    return position
+
+
+def _int_param(params: Mapping[str, str], name: str, message: str,
+               default: Optional[int] = None) -> Optional[int]:
+    if name not in params:
+        return default
+    try:
+        return int(params[name])
+    except ValueError:
+        raise BadRequest(message)
+
+
+def parse_page_args(params: Mapping[str, str]) -> PageArgs:
+    """
+    parse_page_args(params)
+        reads the pagination parameters of a query string mapping.
+        `cursor` (opaque) and `after_id` switch to keyset pagination,
+        otherwise the page number is used.
+    """
+    page = _int_param(params, "page", MSG_BAD_PAGE, 1)
+    # the offset of larger pages would overflow the database integers
+    if not 1 <= page <= MAX_PAGE:
+        raise BadRequest(MSG_BAD_PAGE)
+    after_id = _int_param(params, "after_id", MSG_BAD_AFTER_ID)
+    if after_id is not None and abs(after_id) > MAX_BIGINT:
+        raise BadRequest(MSG_BAD_AFTER_ID)
+    cursor = params.get("cursor")
+    return PageArgs(page=page,
+                    after_id=after_id,
+                    cursor=decode_cursor(cursor) if cursor else None)
+
+
+def get_page_args() -> PageArgs:
+    return parse_page_args(request.args)
+
+
+def wants_envelope(params: Mapping[str, str]) -> bool:
+    return params.get(ENVELOPE_PARAM, "").lower() in ("1", "true", "yes")
+
+
+def fetch_all(query) -> List[object]:
+    """
+    fetch_all(query)
+        runs either an ORM query or a Core select; the latter returns plain
+        rows, skipping object hydration and the identity map.
+    """
+    if isinstance(query, Select):
+        return db.session.execute(query).all()
+    return query.all()
+
+
+def paginate(query, key, args: PageArgs,
+             per_page: int = QUESTIONS_PER_PAGE) -> Page:
+    """
+    paginate(query, key, args)
+        bounds a query to a single page ordered by `key`.
+        Keyset mode (`args.after_id`) seeks past the last seen key instead
+        of skipping rows, so deep pages cost the same as the first one.
+        One extra row is fetched to know whether a next page exists.
+    """
+    return keyset_page(
+        fetch_all(keyset_query(query, key, args, per_page)), per_page)
+
+
+def keyset_query(query, key, args: PageArgs,
+                 per_page: int = QUESTIONS_PER_PAGE):
+    if args.seek_id is not None:
+        query = query.filter(key > args.seek_id).order_by(key)
+    else:
+        query = query.order_by(key).offset((args.page - 1) * per_page)
+    return query.limit(per_page + 1)
+
+
+def keyset_page(rows: List[object],
+                per_page: int = QUESTIONS_PER_PAGE) -> Page:
+    if len(rows) <= per_page:
+        return Page(items=rows)
+    rows = rows[:per_page]
+    return Page(items=rows, next_cursor=encode_cursor(rows[-1].id))
+
+
+def paginate_ranked(query, args: PageArgs,
+                    per_page: int = QUESTIONS_PER_PAGE) -> Page:
+    """
+    paginate_ranked(query, args)
+        bounds an already ordered query (e.g. by relevance) to a single page.
+        Ranked results cannot be seeked by id, so their cursor carries the
+        offset of the next page and `after_id` is not supported.
+    """
+    return ranked_page(
+        fetch_all(ranked_query(query, args, per_page)), args, per_page)
+
+
+def ranked_query(query, args: PageArgs, per_page: int = QUESTIONS_PER_PAGE):
+    return query.offset(args.offset(per_page)).limit(per_page + 1)
+
+
+def ranked_page(rows: List[object], args: PageArgs,
+                per_page: int = QUESTIONS_PER_PAGE) -> Page:
+    return _ranked_page(rows, args.offset(per_page), per_page)
+
+
+def paginate_list(items: List[object], args: PageArgs,
+                  per_page: int = QUESTIONS_PER_PAGE) -> Page:
+    offset = args.offset(per_page)
+    page = _ranked_page(items[offset:offset + per_page + 1], offset, per_page)
+    return Page(items=page.items, next_cursor=page.next_cursor,
+                total=len(items))
+
+
+def paginate_sorted(items: List[object], keys: List[int], args: PageArgs,
+                    per_page: int = QUESTIONS_PER_PAGE) -> Page:
+    """
+    paginate_sorted(items, keys, args)
+        same contract as paginate() for in-memory items sorted by `keys`;
+        keyset seeks are a binary search over the keys.
+    """
+    if args.seek_id is not None:
+        start = bisect_right(keys, args.seek_id)
+    else:
+        start = (args.page - 1) * per_page
+    if len(items) - start <= per_page:
+        return Page(items=items[start:])
+    end = start + per_page
+    return Page(items=items[start:end],
+                next_cursor=encode_cursor(keys[end - 1]))
+
+
+def _ranked_page(rows: List[object], offset: int, per_page: int) -> Page:
+    if len(rows) <= per_page:
+        return Page(items=rows)
+    return Page(items=rows[:per_page],
+                next_cursor=encode_cursor(offset + per_page))
+
+
+def page_envelope(page: Page, args: PageArgs, **meta) -> dict:
+    """
+    page_envelope(page, args, **meta)
+        the items of a page wrapped with the pagination metadata: `total`,
+        `page` (null in keyset mode) and `next_cursor`, plus `meta`.
+    """
+    return {
+        "questions": [format_row(item) for item in page.items],
+        "total": page.total,
+        "page": args.page if args.seek_id is None else None,
+        "next_cursor": page.next_cursor,
+        **meta
+    }
+
+
+def paged_response(page: Page, envelope: Optional[dict] = None) -> Response:
+    """
+    paged_response(page, envelope)
+        the items of a page as a JSON list, or `envelope` when given (see
+        page_envelope()). The next page cursor is sent as a header.
+    """
+    if envelope is None:
+        response = json_response([format_row(item) for item in page.items])
+    else:
+        response = json_response(envelope)
+    if page.next_cursor is not None:
+        response.headers[NEXT_CURSOR_HEADER] = page.next_cursor
+    return response
@@ -0,0 +1,212 @@
+from dataclasses import dataclass
+from os import getenv
+from typing import (
+    List,
+    Optional,
+    Set
+)
+
+QUESTIONS_BATCH_MAX_IDS: int = int(getenv("QUESTIONS_BATCH_MAX_IDS", 100))
+QUESTIONS_BULK_MAX_IDS: int = int(getenv("QUESTIONS_BULK_MAX_IDS", 10000))
+# the fields a bulk update may set on many questions at once
+BULK_UPDATE_FIELDS = ("category", "difficulty")
+MSG_UNPROCESSABLE: str = "Make sur that {params} are not null."
+MSG_NOT_AN_INTEGER: str = "{field} must be an integer."
+MSG_BAD_IDS: str = "ids must be a list of 1 to {max_ids} question ids."
+MSG_NO_FILTER: str = "ids, category or both must be given."
+MSG_BAD_SET: str = "set must be an object of {fields}."
+MSG_BAD_QUIZ_CATEGORY: str = "quiz_category must be an object with an " \
+    "integer id."
+MSG_BAD_PREVIOUS_QUESTIONS: str = "previous_questions must be a list of " \
+    "question ids."
+
+
+@dataclass(frozen=True)
+class QuestionPayload:
+    question: Optional[str] = None
+    answer: Optional[str] = None
+    category: Optional[int] = None
+    difficulty: Optional[int] = None
+
+    @classmethod
+    def from_json(cls, body: dict) -> "QuestionPayload":
+        return cls(body.get("question"),
+                   body.get("answer"),
+                   body.get("category"),
+                   body.get("difficulty"))
+
+    def get_null_fields(self) -> List[str]:
+        problematic_keys = filter(
+            lambda k: k[1] is None,
+            self.__dict__.items())
+        return [el[0] for el in problematic_keys]
+
+    def get_errors(self) -> List[str]:
+        """
+        get_errors()
+            validation messages of the payload, empty when it can be stored.
+        """
+        undefined_properties = self.get_null_fields()
+        if undefined_properties:
+            return [MSG_UNPROCESSABLE.format(
+                params=" - ".join(undefined_properties))]
+        return [MSG_NOT_AN_INTEGER.format(field=field)
+                for field in ("category", "difficulty")
+                if not _is_integer(getattr(self, field))]
+
+    def to_row(self) -> dict:
+        return {
+            "question": self.question,
+            "answer": self.answer,
+            "category": int(self.category),
+            "difficulty": int(self.difficulty)
+        }
+
+
+@dataclass(frozen=True)
+class QuestionIdsPayload:
+    ids: Optional[list] = None
+
+    @classmethod
+    def from_query(cls, value: str) -> "QuestionIdsPayload":
+        return cls([part.strip() for part in value.split(",")
+                    if part.strip()])
+
+    @classmethod
+    def from_json(cls, body: object) -> "QuestionIdsPayload":
+        return cls(body.get("ids") if isinstance(body, dict) else None)
+
+    def get_errors(self, max_ids: int = QUESTIONS_BATCH_MAX_IDS) -> List[str]:
+        """
+        get_errors(max_ids)
+            validation messages of the id list, empty when it holds 1 to
+            `max_ids` ids, given as integers or digit strings.
+        """
+        if not isinstance(self.ids, list) or \
+                not 0 < len(self.ids) <= max_ids or \
+                not all(_is_id(value) for value in self.ids):
+            return [MSG_BAD_IDS.format(max_ids=max_ids)]
+        return []
+
+    def to_ids(self) -> List[int]:
+        """
+        to_ids()
+            the ids as integers, in the requested order, without duplicates.
+        """
+        return list(dict.fromkeys(int(value) for value in self.ids))
+
+
+@dataclass(frozen=True)
+class BulkQuestionsPayload:
+    """
+    BulkQuestionsPayload
+        the questions of a bulk delete or update, selected by `ids`,
+        `category` or both, and for an update the `values` to set.
+    """
+    ids: Optional[list] = None
+    category: Optional[object] = None
+    values: Optional[dict] = None
+
+    @classmethod
+    def from_json(cls, body: object) -> "BulkQuestionsPayload":
+        if not isinstance(body, dict):
+            return cls()
+        return cls(body.get("ids"), body.get("category"), body.get("set"))
+
+    def get_errors(self, update: bool = False,
+                   max_ids: int = QUESTIONS_BULK_MAX_IDS) -> List[str]:
+        """
+        get_errors(update, max_ids)
+            validation messages of the selection and, for an `update`, of
+            the values, empty when the statement can be run.
+        """
+        if self.ids is None and self.category is None:
+            return [MSG_NO_FILTER]
+        errors = []
+        if self.ids is not None and \
+                QuestionIdsPayload(self.ids).get_errors(max_ids):
+            errors.append(MSG_BAD_IDS.format(max_ids=max_ids))
+        if self.category is not None and not _is_integer(self.category):
+            errors.append(MSG_NOT_AN_INTEGER.format(field="category"))
+        if update and (not isinstance(self.values, dict) or
+                       not self.values or
+                       not set(self.values) <= set(BULK_UPDATE_FIELDS) or
+                       not all(map(_is_integer, self.values.values()))):
+            errors.append(MSG_BAD_SET.format(
+                fields=" and/or ".join(BULK_UPDATE_FIELDS)))
+        return errors
+
+    def to_ids(self) -> Optional[List[int]]:
+        if self.ids is None:
+            return None
+        return QuestionIdsPayload(self.ids).to_ids()
+
+    def to_category(self) -> Optional[int]:
+        return None if self.category is None else int(self.category)
+
+    def to_values(self) -> dict:
+        return {field: int(value) for field, value in self.values.items()}
+
+
+@dataclass(frozen=True)
+class QuizPayload:
+    """
+    QuizPayload
+        the category of a quiz, whose `id` defaults to all the categories,
+        and the questions already asked.
+    """
+    quiz_category: Optional[object] = None
+    previous_questions: Optional[object] = None
+
+    @classmethod
+    def from_json(cls, body: object) -> "QuizPayload":
+        if not isinstance(body, dict):
+            return cls()
+        return cls(body.get("quiz_category"), body.get("previous_questions"))
+
+    def get_null_fields(self, with_previous: bool = True) -> List[str]:
+        fields = ["quiz_category"] + \
+            (["previous_questions"] if with_previous else [])
+        return [field for field in fields if getattr(self, field) is None]
+
+    def get_errors(self, with_previous: bool = True) -> List[str]:
+        """
+        get_errors(with_previous)
+            validation messages of the types of the fields, present as
+            checked by get_null_fields(). `previous_questions` may be a
+            single id.
+        """
+        errors = []
+        if self.quiz_category is not None and (
+                not isinstance(self.quiz_category, dict) or
+                not _is_integer(self.quiz_category.get("id", 0))):
+            errors.append(MSG_BAD_QUIZ_CATEGORY)
+        if with_previous and self.previous_questions is not None and \
+                not all(map(_is_id, self._previous_list())):
+            errors.append(MSG_BAD_PREVIOUS_QUESTIONS)
+        return errors
+
+    def to_category_id(self, default: int) -> int:
+        return int(self.quiz_category.get("id", default))
+
+    def to_excluded(self) -> Set[int]:
+        return {int(value) for value in self._previous_list()}
+
+    def _previous_list(self) -> list:
+        if isinstance(self.previous_questions, list):
+            return self.previous_questions
+        return [self.previous_questions]
+
+
+def _is_integer(value: object) -> bool:
+    try:
+        int(value)
+    except (TypeError, ValueError):
+        return False
+    return not isinstance(value, (bool, float))
+
+
+def _is_id(value: object) -> bool:
+    if isinstance(value, str):
+        return value.strip().isdigit()
+    return isinstance(value, int) and not isinstance(value, bool)
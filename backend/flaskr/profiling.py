@@ -0,0 +1,198 @@
+import cProfile
+import hmac
+import logging
+import pstats
+import re
+from collections import defaultdict
+from datetime import datetime, timezone
+from os import getenv, getpid, makedirs, path, remove, scandir
+from random import random
+from threading import Lock
+from typing import (
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple
+)
+from flask import Flask
+from werkzeug.exceptions import HTTPException
+
+# fraction of the requests profiled, 0 disables sampling
+PROFILE_SAMPLE_RATE: float = float(getenv("PROFILE_SAMPLE_RATE", 0))
+# requests carrying this token in PROFILE_HEADER are always profiled
+PROFILE_TOKEN: Optional[str] = getenv("PROFILE_TOKEN") or None
+PROFILE_HEADER: str = getenv("PROFILE_HEADER", "X-Profile")
+PROFILE_DIR: str = getenv("PROFILE_DIR", "profiles")
+PROFILE_MAX_FILES: int = int(getenv("PROFILE_MAX_FILES", 100))
+PROFILE_FILE_HEADER: str = "X-Profile-File"
+# folded stacks deeper than this, or cheaper than this many microseconds,
+# are cut to keep the files small
+FOLDED_MAX_DEPTH: int = 64
+FOLDED_MIN_MICROSECONDS: int = 1
+UNSAFE_CHARACTERS = re.compile(r"[^A-Za-z0-9]+")
+
+# pstats keys functions by (filename, line number, function name)
+Function = Tuple[str, int, str]
+
+
+def function_label(function: Function) -> str:
+    filename, line, name = function
+    if filename == "~":  # built-in
+        return name
+    return f"{name} ({path.basename(filename)}:{line})"
+
+
+def folded_stacks(stats: pstats.Stats) -> Dict[str, int]:
+    """
+    folded_stacks(stats)
+        rebuilds call stacks from the caller/callee edges of a profile, in
+        the collapsed format of flamegraph.pl and speedscope: one
+        `root;caller;function` key per stack with its own time in
+        microseconds. cProfile only records edges, so the time of a
+        function called from several places is split in proportion to the
+        time spent under each caller, as gprof2dot does.
+    """
+    callees: Dict[Function, Dict[Function, float]] = defaultdict(dict)
+    roots = []
+    for function, (_, _, _, _, callers) in stats.stats.items():
+        if not callers:
+            roots.append(function)
+        for caller, (_, _, _, cumulative) in callers.items():
+            callees[caller][function] = cumulative
+
+    stacks: Dict[str, int] = defaultdict(int)
+
+    def walk(function: Function, labels: List[str], seen: set,
+             share: float) -> None:
+        own = stats.stats[function][2]
+        microseconds = int(own * share * 1e6)
+        if microseconds >= FOLDED_MIN_MICROSECONDS:
+            stacks[";".join(labels)] += microseconds
+        if len(labels) >= FOLDED_MAX_DEPTH:
+            return
+        for callee, edge in callees[function].items():
+            callee_cumulative = stats.stats[callee][3]
+            if callee in seen or not callee_cumulative:
+                continue
+            callee_share = share * edge / callee_cumulative
+            if edge * share * 1e6 < FOLDED_MIN_MICROSECONDS:
+                continue
+            walk(callee, labels + [function_label(callee)],
+                 seen | {callee}, callee_share)
+
+    for root in roots:
+        walk(root, [function_label(root)], {root}, 1.0)
+    return stacks
+
+
+class ProfilerMiddleware:
+    """
+    ProfilerMiddleware(app, wsgi_app, sample_rate, token, ...)
+        runs a sample of the requests, and those carrying the trusted
+        token, under cProfile. Each profile is written to `directory` both
+        as a pstats `.prof` file (snakeviz, `python -m pstats`) and as
+        `.folded` stacks (flamegraph.pl, speedscope), named after the time,
+        the method and the route; only the newest `max_files` are kept.
+        Profiles stop when the view returns: streamed bodies are not
+        included.
+    """
+
+    def __init__(self, app: Flask, wsgi_app: Callable,
+                 sample_rate: float = PROFILE_SAMPLE_RATE,
+                 token: Optional[str] = PROFILE_TOKEN,
+                 header: str = PROFILE_HEADER,
+                 directory: str = PROFILE_DIR,
+                 max_files: int = PROFILE_MAX_FILES):
+        self.app = app
+        self.wsgi_app = wsgi_app
+        self.sample_rate = sample_rate
+        self.token = token
+        self.environ_key = "HTTP_" + header.upper().replace("-", "_")
+        self.directory = directory
+        self.max_files = max_files
+        self._lock = Lock()
+
+    def is_trusted(self, environ: dict) -> bool:
+        value = environ.get(self.environ_key)
+        return self.token is not None and value is not None and \
+            hmac.compare_digest(value.encode(), self.token.encode())
+
+    def __call__(self, environ: dict, start_response: Callable):
+        trusted = self.is_trusted(environ)
+        if not trusted and random() >= self.sample_rate:
+            return self.wsgi_app(environ, start_response)
+
+        filename = self.filename(environ)
+        if trusted:
+            start_response = self.with_profile_header(
+                start_response, filename)
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:  # another profiler is active
+            return self.wsgi_app(environ, start_response)
+        try:
+            return self.wsgi_app(environ, start_response)
+        finally:
+            profiler.disable()
+            self.save(profiler, filename)
+
+    @staticmethod
+    def with_profile_header(start_response: Callable,
+                            filename: str) -> Callable:
+        def start_response_with_file(status, headers, exc_info=None):
+            headers.append((PROFILE_FILE_HEADER, filename))
+            return start_response(status, headers, exc_info)
+        return start_response_with_file
+
+    def route(self, environ: dict) -> str:
+        try:
+            rule, _ = self.app.url_map.bind_to_environ(environ) \
+                .match(return_rule=True)
+            return rule.rule
+        except HTTPException:
+            return environ.get("PATH_INFO", "")
+
+    def filename(self, environ: dict) -> str:
+        timestamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+        route = UNSAFE_CHARACTERS.sub("_", self.route(environ)).strip("_")
+        return f"{timestamp}-{environ['REQUEST_METHOD']}-{route}-{getpid()}"
+
+    def save(self, profiler: cProfile.Profile, filename: str) -> None:
+        try:
+            makedirs(self.directory, exist_ok=True)
+            stats = pstats.Stats(profiler)
+            base = path.join(self.directory, filename)
+            stats.dump_stats(base + ".prof")
+            with open(base + ".folded", "w") as f:
+                for stack, microseconds in folded_stacks(stats).items():
+                    f.write(f"{stack} {microseconds}\n")
+            self.prune()
+        except OSError as e:
+            logging.error(f"could not save the profile {filename}: {e}")
+
+    def prune(self) -> None:
+        with self._lock:
+            profiles = sorted(entry.path for entry in scandir(self.directory)
+                              if entry.name.endswith(".prof"))
+            for stale in profiles[:max(len(profiles) - self.max_files, 0)]:
+                for extension in (".prof", ".folded"):
+                    try:
+                        remove(stale[:-len(".prof")] + extension)
+                    except FileNotFoundError:
+                        pass
+
+
+def init_profiling(app: Flask, sample_rate: float = PROFILE_SAMPLE_RATE,
+                   token: Optional[str] = PROFILE_TOKEN) -> None:
+    """
+    init_profiling(app, sample_rate, token)
+        profiles a `sample_rate` fraction of the requests of the
+        application and every request whose PROFILE_HEADER holds `token`.
+        Does nothing when neither is set.
+    """
+    if sample_rate <= 0 and token is None:
+        return
+    app.wsgi_app = ProfilerMiddleware(app, app.wsgi_app,
+                                      sample_rate=sample_rate, token=token)
@@ -0,0 +1,329 @@
+from array import array
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from os import getenv
+from random import choice, shuffle
+from secrets import token_urlsafe
+from sys import byteorder
+from threading import RLock
+from time import monotonic
+from typing import (
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Set,
+    Tuple
+)
+from sqlalchemy import LargeBinary, and_, func, select
+from werkzeug.exceptions import ServiceUnavailable
+from .catalog import get_question
+from .models import (
+    db,
+    Question,
+    QuizSessionState,
+    category_key,
+    on_question_change
+)
+
+ALL_CATEGORIES: int = 0
+QUIZ_SAMPLER_TTL: float = float(getenv("QUIZ_SAMPLER_TTL", 60))
+QUIZ_SESSION_TTL: float = float(getenv("QUIZ_SESSION_TTL", 1800))
+QUIZ_MAX_SESSIONS: int = int(getenv("QUIZ_MAX_SESSIONS", 10000))
+MSG_TOO_MANY_SESSIONS: str = "too many quiz sessions are open, " \
+    "retry in a moment."
+# bytes of a question id packed in QuizSessionState.question_ids
+ID_SIZE: int = 8
+# Rejection sampling is abandoned for a linear scan once fewer than
+# 1/SPARSE_RATIO of the candidates remain eligible.
+SPARSE_RATIO: int = 8
+
+
+class IdPool:
+    """
+    IdPool()
+        array of ids with a position map, giving O(1) membership,
+        insertion, removal (swap with the last element) and random picks.
+    """
+
+    def __init__(self):
+        self.ids: List[int] = []
+        self.positions: Dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, question_id: int) -> bool:
+        return question_id in self.positions
+
+    def add(self, question_id: int) -> None:
+        if question_id not in self.positions:
+            self.positions[question_id] = len(self.ids)
+            self.ids.append(question_id)
+
+    def remove(self, question_id: int) -> None:
+        position = self.positions.pop(question_id, None)
+        if position is None:
+            return
+        last = self.ids.pop()
+        if last != question_id:
+            self.ids[position] = last
+            self.positions[last] = position
+
+    def sample(self, excluded: Set[int]) -> Optional[int]:
+        """
+        sample(excluded)
+            returns a random id not in `excluded`, or None when every id has
+            been excluded. Costs O(len(excluded)) plus an expected constant
+            number of random picks while eligible ids are not too sparse.
+        """
+        remaining = len(self.ids) - sum(1 for i in excluded if i in self)
+        if remaining <= 0:
+            return None
+        if remaining * SPARSE_RATIO >= len(self.ids):
+            while True:
+                question_id = choice(self.ids)
+                if question_id not in excluded:
+                    return question_id
+        return choice([i for i in self.ids if i not in excluded])
+
+
+class QuizSampler:
+    """
+    QuizSampler()
+        keeps the question ids of every category in memory so that picking
+        a quiz question never loads more than the chosen row.
+        The pools follow local writes through question change notifications
+        and are reloaded every QUIZ_SAMPLER_TTL seconds, on the next call
+        with `reload`, to catch up with writes made by other processes.
+    """
+
+    def __init__(self, ttl: float = QUIZ_SAMPLER_TTL):
+        self._lock = RLock()
+        self._pools: Dict[int, IdPool] = {}
+        self._loaded_at: Optional[float] = None
+        self.ttl = ttl
+
+    def reset(self) -> None:
+        with self._lock:
+            self._pools = {}
+            self._loaded_at = None
+
+    def load(self) -> None:
+        self.load_rows(db.session.query(Question.id, Question.category))
+
+    def load_rows(self, rows: Iterable[Tuple[int, int]]) -> None:
+        pools: Dict[int, IdPool] = {ALL_CATEGORIES: IdPool()}
+        for question_id, category in rows:
+            self._add(pools, question_id, category)
+        with self._lock:
+            self._pools = pools
+            self._loaded_at = monotonic()
+
+    @property
+    def is_stale(self) -> bool:
+        return self._loaded_at is None or \
+            monotonic() - self._loaded_at > self.ttl
+
+    def pool(self, category: int, reload: bool = False) -> IdPool:
+        """
+        pool(category, reload)
+            the ids of `category`, reloaded first when stale if `reload`.
+            Loading blocks on the database in the application context, the
+            asynchronous server loads the pools with load_rows() instead.
+        """
+        if reload and self.is_stale:
+            self.load()
+        return self._pools.get(category) or IdPool()
+
+    def has_questions(self, category: int, reload: bool = False) -> bool:
+        return len(self.pool(category, reload)) > 0
+
+    def next_question(self, category: int, excluded: Set[int]):
+        """
+        next_question(category, excluded)
+            picks a random question of `category` (ALL_CATEGORIES for any)
+            whose id is not in `excluded`, fetching only that row.
+        """
+        excluded = set(excluded)
+        while True:
+            question_id = self.sample(category, excluded)
+            if question_id is None:
+                return None
+            question = get_question(question_id)
+            if question is not None:
+                return question
+            self.discard(question_id, excluded)
+
+    def sample(self, category: int, excluded: Set[int]) -> Optional[int]:
+        with self._lock:
+            return self.pool(category).sample(excluded)
+
+    def discard(self, question_id: int, excluded: Set[int]) -> None:
+        """
+        discard(question_id, excluded)
+            forgets a sampled question found deleted (by another process
+            since the pools were loaded) and excludes it from the next picks.
+        """
+        self.apply("delete", [{"id": question_id}])
+        excluded.add(question_id)
+
+    def apply(self, action: str, rows: List[dict]) -> None:
+        if action == "reload":
+            return self.reset()
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            for row in rows:
+                for pool in self._pools.values():
+                    pool.remove(row["id"])
+                if action != "delete":
+                    self._add(self._pools, row["id"], row["category"])
+
+    @staticmethod
+    def _add(pools: Dict[int, IdPool], question_id: int, category) -> None:
+        pools[ALL_CATEGORIES].add(question_id)
+        key = category_key(category)
+        if key is not None and key != ALL_CATEGORIES:
+            pools.setdefault(key, IdPool()).add(question_id)
+
+
+@dataclass(frozen=True)
+class QuizSession:
+    """
+    QuizSession(token, category, total, cursor, question_id)
+        a quiz session as stored in the quiz_sessions table: `cursor` of
+        its `total` questions have been asked, `question_id` is the one
+        taken by the last step, None when the session was exhausted.
+    """
+    token: str
+    category: int
+    total: int
+    cursor: int = 0
+    question_id: Optional[int] = None
+
+    @property
+    def remaining(self) -> int:
+        return self.total - self.cursor
+
+    def format(self) -> dict:
+        return {
+            "session": self.token,
+            "quiz_category": self.category,
+            "total": self.total,
+            "remaining": self.remaining
+        }
+
+
+def pack_ids(ids: Iterable[int]) -> bytes:
+    order = array("q", ids)
+    if byteorder == "big":
+        order.byteswap()
+    return order.tobytes()
+
+
+def unpack_id(data: bytes) -> int:
+    return int.from_bytes(data, "little", signed=True)
+
+
+class QuizSessionStore:
+    """
+    QuizSessionStore(ttl, max_sessions)
+        quiz sessions kept in the quiz_sessions table, so that any worker
+        can serve the next question of a session created by another one.
+        Sessions expire after `ttl` seconds without a question asked; the
+        expired ones are deleted as new sessions are created, which fail
+        with a 503 while `max_sessions` are alive.
+        Methods take a connection or session, committed by the caller.
+    """
+
+    def __init__(self, ttl: float = QUIZ_SESSION_TTL,
+                 max_sessions: int = QUIZ_MAX_SESSIONS):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+
+    def create(self, connection, category: int) -> QuizSession:
+        now = datetime.utcnow()
+        table = QuizSessionState.__table__
+        connection.execute(table.delete().where(table.c.expires_at < now))
+        if connection.execute(select(func.count()).select_from(table)) \
+                .scalar() >= self.max_sessions:
+            raise ServiceUnavailable(MSG_TOO_MANY_SESSIONS)
+
+        order = array("q", quiz_sampler.pool(category).ids)
+        shuffle(order)
+        session = QuizSession(token=token_urlsafe(16),
+                              category=category,
+                              total=len(order))
+        connection.execute(table.insert().values(
+            token=session.token,
+            category=category,
+            question_ids=pack_ids(order),
+            total=session.total,
+            cursor=0,
+            expires_at=now + timedelta(seconds=self.ttl)))
+        return session
+
+    def advance(self, connection, token: str) -> Optional[QuizSession]:
+        """
+        advance(connection, token)
+            moves the cursor of a live session forward and returns the
+            session with the question id it passed, or None when there is
+            no such session. The row stays locked until the caller commits,
+            so concurrent steps of a session never get the same question.
+        """
+        now = datetime.utcnow()
+        table = QuizSessionState.__table__
+        live = and_(table.c.token == token, table.c.expires_at >= now)
+        advanced = connection.execute(
+            table.update()
+            .where(and_(live, table.c.cursor < table.c.total))
+            .values(cursor=table.c.cursor + 1,
+                    expires_at=now + timedelta(seconds=self.ttl))
+        ).rowcount
+        columns = [table.c.category, table.c.total, table.c.cursor]
+        if advanced:
+            columns.append(func.substr(
+                table.c.question_ids, table.c.cursor * ID_SIZE - ID_SIZE + 1,
+                ID_SIZE, type_=LargeBinary))
+        row = connection.execute(select(*columns).where(
+            table.c.token == token if advanced else live)).first()
+        if row is None:
+            return None
+        return QuizSession(token=token,
+                           category=row[0],
+                           total=row[1],
+                           cursor=row[2],
+                           question_id=unpack_id(row[3]) if advanced else None)
+
+    def discard(self, connection, token: str) -> bool:
+        table = QuizSessionState.__table__
+        return connection.execute(table.delete().where(and_(
+            table.c.token == token,
+            table.c.expires_at >= datetime.utcnow()))).rowcount > 0
+
+    def next_question(self, token: str):
+        """
+        next_question(token)
+            moves the session cursor forward and fetches that question by
+            primary key, skipping the questions deleted in the meantime.
+            Returns the session, None when not found, and the question,
+            None when the session is exhausted.
+        """
+        while True:
+            session = self.advance(db.session, token)
+            db.session.commit()
+            if session is None or session.question_id is None:
+                return session, None
+            question = get_question(session.question_id)
+            if question is not None:
+                return session, question
+
+
+quiz_sampler = QuizSampler()
+quiz_sessions = QuizSessionStore()
+
+
+@on_question_change
+def update_quiz_sampler(action: str, rows: List[dict]) -> None:
+    quiz_sampler.apply(action, rows)
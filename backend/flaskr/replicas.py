@@ -0,0 +1,190 @@
+import logging
+from functools import wraps
+from itertools import count
+from os import getenv
+from threading import Lock
+from time import monotonic
+from typing import (
+    Dict,
+    Iterable,
+    List,
+    Optional
+)
+from flask import (
+    Flask,
+    Response,
+    g,
+    has_request_context,
+    request
+)
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from .models import DB_ROUTER_EXTENSION, REPLICA_BIND_PREFIX
+
+# seconds a failing replica is skipped before being checked again
+DB_REPLICA_RETRY_INTERVAL: float = float(
+    getenv("DB_REPLICA_RETRY_INTERVAL", 30))
+# seconds between two health checks of a replica in use
+DB_REPLICA_CHECK_INTERVAL: float = float(
+    getenv("DB_REPLICA_CHECK_INTERVAL", 10))
+# seconds a client reads from the primary after one of its writes
+DB_REPLICA_PIN_SECONDS: int = int(getenv("DB_REPLICA_PIN_SECONDS", 5))
+# set on the responses of writes, for as long as the replicas may lag
+READ_PRIMARY_COOKIE: str = "trivia_read_primary"
+# lets clients without cookies ask for a read from the primary
+READ_PRIMARY_HEADER: str = "X-Read-Primary"
+HEALTH_CHECK = text("SELECT 1 FROM categories LIMIT 1")
+SESSION_REPLICA: str = "replica_engine"
+SESSION_WROTE: str = "wrote"
+
+
+class ReplicaSet:
+    """
+    ReplicaSet(app, bind_keys, retry_interval, check_interval)
+        round robin over the replica engines of an application. A replica
+        failing its health check, or losing its connection, is skipped for
+        `retry_interval` seconds; when none is up, reads go to the primary.
+    """
+
+    def __init__(self, app: Flask, bind_keys: List[str],
+                 retry_interval: float = DB_REPLICA_RETRY_INTERVAL,
+                 check_interval: float = DB_REPLICA_CHECK_INTERVAL):
+        self.app = app
+        self.bind_keys = bind_keys
+        self.retry_interval = retry_interval
+        self.check_interval = check_interval
+        self._lock = Lock()
+        self._turns = count()
+        self._engines: Dict[str, Engine] = {}
+        self._down_until: Dict[str, float] = {}
+        self._checked_at: Dict[str, float] = {}
+
+    def engine(self, bind_key: str) -> Engine:
+        engine = self._engines.get(bind_key)
+        if engine is None:
+            with self._lock:
+                engine = self._engines.get(bind_key)
+                if engine is None:
+                    engine = self.app.extensions["sqlalchemy"].db \
+                        .get_engine(self.app, bind=bind_key)
+                    event.listen(engine, "handle_error", self.on_error)
+                    self._engines[bind_key] = engine
+        return engine
+
+    def choose(self) -> Optional[Engine]:
+        for _ in range(len(self.bind_keys)):
+            bind_key = self.bind_keys[next(self._turns) % len(self.bind_keys)]
+            if self._down_until.get(bind_key, 0) > monotonic():
+                continue
+            if self.is_healthy(bind_key):
+                return self.engine(bind_key)
+        return None
+
+    def is_healthy(self, bind_key: str) -> bool:
+        if monotonic() - self._checked_at.get(bind_key, 0) < \
+                self.check_interval:
+            return True
+        try:
+            with self.engine(bind_key).connect() as connection:
+                connection.execute(HEALTH_CHECK)
+        except Exception as e:
+            self.mark_down(bind_key, e)
+            return False
+        self._checked_at[bind_key] = monotonic()
+        return True
+
+    def mark_down(self, bind_key: str, error: Exception) -> None:
+        logging.error(f"replica {bind_key} skipped for "
+                      f"{self.retry_interval}s: {error}")
+        self._down_until[bind_key] = monotonic() + self.retry_interval
+        self._checked_at.pop(bind_key, None)
+
+    def on_error(self, context) -> None:
+        if not context.is_disconnect:
+            return
+        for bind_key, engine in self._engines.items():
+            if engine is context.engine:
+                self.mark_down(bind_key, context.original_exception)
+
+
+def is_pinned_to_primary() -> bool:
+    return READ_PRIMARY_COOKIE in request.cookies or \
+        request.headers.get(READ_PRIMARY_HEADER, "").lower() in \
+        ("1", "true", "yes")
+
+
+def note_write() -> None:
+    """
+    note_write()
+        pins the client of the current request, if any, to the primary
+        for DB_REPLICA_PIN_SECONDS, as it wrote.
+    """
+    if has_request_context():
+        g.db_wrote = True
+
+
+def replica_reads(methods: Optional[Iterable[str]] = None):
+    """
+    replica_reads(methods)
+        decorates a view whose requests (of `methods`, all by default) may
+        read from a replica, unless the client wrote recently.
+    """
+    methods = None if methods is None else set(methods) | {"HEAD"}
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if methods is None or request.method in methods:
+                g.replica_reads = not is_pinned_to_primary()
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class ReplicaRouter:
+    """
+    ReplicaRouter(replicas)
+        sends the statements of the views marked with replica_reads() to a
+        replica, the same one for the whole session. Flushes and
+        INSERT/UPDATE/DELETE statements go to the primary, as does
+        everything a session runs after writing.
+    """
+
+    def __init__(self, replicas: ReplicaSet):
+        self.replicas = replicas
+
+    def get_bind(self, session: Session, clause=None) -> Optional[Engine]:
+        if session._flushing or getattr(clause, "is_dml", False):
+            session.info[SESSION_WROTE] = True
+            note_write()
+            return None
+        if session.info.get(SESSION_WROTE) or not has_request_context() \
+                or not g.get("replica_reads"):
+            return None
+        if SESSION_REPLICA not in session.info:
+            session.info[SESSION_REPLICA] = self.replicas.choose()
+        return session.info[SESSION_REPLICA]
+
+
+def init_replicas(app: Flask) -> None:
+    """
+    init_replicas(app)
+        routes the reads of the replica_reads() views to the replicas bound
+        by setup_db(), and pins the clients that just wrote to the primary
+        for DB_REPLICA_PIN_SECONDS. Does nothing without replicas.
+    """
+    bind_keys = sorted(key for key in app.config.get("SQLALCHEMY_BINDS") or {}
+                       if key.startswith(REPLICA_BIND_PREFIX))
+    if not bind_keys:
+        return
+    app.extensions[DB_ROUTER_EXTENSION] = ReplicaRouter(
+        ReplicaSet(app, bind_keys))
+
+    @app.after_request
+    def pin_writers_to_primary(response: Response) -> Response:
+        if g.get("db_wrote"):
+            response.set_cookie(READ_PRIMARY_COOKIE, "1",
+                                max_age=DB_REPLICA_PIN_SECONDS,
+                                httponly=True, samesite="Lax")
+        return response
@@ -0,0 +1,202 @@
+import re
+from bisect import bisect_left, insort
+from collections import Counter
+from threading import RLock
+from typing import (
+    Dict,
+    Iterable,
+    List,
+    Tuple
+)
+from sqlalchemy import (
+    DDL,
+    event,
+    func,
+    literal_column
+)
+from .catalog import Fields, get_questions_page, select_questions
+from .models import db, Question, on_question_change
+from .pagination import (
+    Page,
+    PageArgs,
+    paginate_list,
+    paginate_ranked
+)
+
+TS_CONFIG: str = "english"
+SEARCH_INDEX_NAME: str = "ix_questions_search"
+TOKEN_PATTERN = re.compile(r"\w+")
+
+# The GIN index and the search query must use the very same expression,
+# otherwise postgres falls back to a sequential scan.
+SEARCH_DOCUMENT_SQL: str = (
+    f"to_tsvector('{TS_CONFIG}'::regconfig, "
+    "coalesce(question, '') || ' ' || coalesce(answer, ''))")
+
+event.listen(
+    db.Model.metadata,
+    "after_create",
+    DDL(f"CREATE INDEX IF NOT EXISTS {SEARCH_INDEX_NAME} "
+        f"ON questions USING GIN ({SEARCH_DOCUMENT_SQL})"
+        ).execute_if(dialect="postgresql"))
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall((text or "").lower())
+
+
+def postgres_search_query(terms: List[str], fields: Fields = None):
+    """
+    postgres_search_query(terms, fields)
+        select of the questions (or of their `fields`) matching every term
+        as a prefix, most relevant first, answered by the GIN index.
+    """
+    document = literal_column(SEARCH_DOCUMENT_SQL)
+    query = func.to_tsquery(
+        literal_column(f"'{TS_CONFIG}'::regconfig"),
+        " & ".join(f"{term}:*" for term in terms))
+    return select_questions(fields) \
+        .where(document.op("@@")(query)) \
+        .order_by(func.ts_rank(document, query).desc(), Question.id)
+
+
+class InvertedIndex:
+    """
+    InvertedIndex()
+        in-process token -> {question id: term frequency} index.
+        The vocabulary is kept sorted so that prefix lookups are a binary
+        search followed by a scan over the matching tokens only.
+    """
+
+    def __init__(self):
+        self._lock = RLock()
+        self._postings: Dict[str, Dict[int, int]] = {}
+        self._vocabulary: List[str] = []
+        self._documents: Dict[int, Tuple[str, ...]] = {}
+        self.loaded: bool = False
+
+    def load(self, rows: Iterable[Tuple[int, str, str]]) -> None:
+        with self._lock:
+            self.clear()
+            for doc_id, question, answer in rows:
+                self.add(doc_id, question, answer)
+            self.loaded = True
+
+    def clear(self) -> None:
+        with self._lock:
+            self._postings.clear()
+            self._vocabulary.clear()
+            self._documents.clear()
+            self.loaded = False
+
+    def add(self, doc_id: int, *texts: str) -> None:
+        with self._lock:
+            self.remove(doc_id)
+            frequencies = Counter(
+                token for text in texts for token in tokenize(text))
+            for token, frequency in frequencies.items():
+                if token not in self._postings:
+                    self._postings[token] = {}
+                    insort(self._vocabulary, token)
+                self._postings[token][doc_id] = frequency
+            self._documents[doc_id] = tuple(frequencies)
+
+    def remove(self, doc_id: int) -> None:
+        with self._lock:
+            for token in self._documents.pop(doc_id, ()):
+                postings = self._postings[token]
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self._postings[token]
+                    del self._vocabulary[
+                        bisect_left(self._vocabulary, token)]
+
+    def search(self, terms: List[str]) -> List[int]:
+        """
+        search(terms)
+            returns the ids of the documents matching every term as a prefix,
+            ordered by decreasing relevance (sum of term frequencies).
+        """
+        with self._lock:
+            scores: Dict[int, int] = {}
+            for position, term in enumerate(terms):
+                matches: Counter = Counter()
+                start = bisect_left(self._vocabulary, term)
+                for token in self._vocabulary[start:]:
+                    if not token.startswith(term):
+                        break
+                    matches.update(self._postings[token])
+                if position == 0:
+                    scores = dict(matches)
+                else:
+                    scores = {doc_id: score + matches[doc_id]
+                              for doc_id, score in scores.items()
+                              if doc_id in matches}
+                if not scores:
+                    break
+        return sorted(scores, key=lambda doc_id: (-scores[doc_id], doc_id))
+
+
+class QuestionSearch:
+    """
+    QuestionSearch()
+        ranked, prefix-matching full-text search over questions and answers.
+        On postgres it relies on a GIN-indexed tsvector, elsewhere (sqlite)
+        on an in-process inverted index kept in sync with question writes.
+    """
+
+    def __init__(self):
+        self.index = InvertedIndex()
+
+    def search(self, search_term: str, args: PageArgs,
+               fields: Fields = None) -> Page:
+        terms = tokenize(search_term)
+        if not terms:
+            return get_questions_page(args, with_total=True, fields=fields)
+        if db.engine.dialect.name == "postgresql":
+            return self._search_postgres(terms, args, fields)
+        return self._search_in_process(terms, args, fields)
+
+    def warm_up(self) -> None:
+        if db.engine.dialect.name != "postgresql":
+            self._load_index()
+
+    def apply(self, action: str, rows: List[dict]) -> None:
+        if action == "reload":
+            return self.index.clear()
+        if not self.index.loaded:
+            return
+        for row in rows:
+            if action == "delete":
+                self.index.remove(row["id"])
+            else:
+                self.index.add(row["id"], row["question"], row["answer"])
+
+    def _search_postgres(self, terms: List[str], args: PageArgs,
+                         fields: Fields = None) -> Page:
+        return paginate_ranked(query=postgres_search_query(terms, fields),
+                               args=args)
+
+    def _search_in_process(self, terms: List[str], args: PageArgs,
+                           fields: Fields = None) -> Page:
+        if not self.index.loaded:
+            self._load_index()
+        page = paginate_list(self.index.search(terms), args)
+        if not page.items:
+            return page
+        found = {q.id: q for q in db.session.execute(
+            select_questions(fields).where(Question.id.in_(page.items)))}
+        return Page(items=[found[i] for i in page.items if i in found],
+                    next_cursor=page.next_cursor, total=page.total)
+
+    def _load_index(self) -> None:
+        self.index.load(db.session.query(
+            Question.id, Question.question, Question.answer))
+
+
+question_search = QuestionSearch()
+
+
+@on_question_change
+def update_search_index(action: str, rows: List[dict]) -> None:
+    question_search.apply(action, rows)
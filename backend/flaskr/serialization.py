@@ -0,0 +1,75 @@
+import json
+from os import getenv
+from typing import (
+    Callable,
+    Dict
+)
+from flask import (
+    Flask,
+    Response,
+    current_app,
+    has_app_context
+)
+from .metrics import json_timer
+
+try:
+    import orjson
+except ImportError:  # optional dependency
+    orjson = None
+
+JSON_EXTENSION: str = "trivia_json_dumps"
+
+
+def orjson_dumps(obj: object) -> bytes:
+    return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+
+
+def stdlib_dumps(obj: object) -> bytes:
+    return json.dumps(obj, separators=(",", ":")).encode()
+
+
+JSON_BACKENDS: Dict[str, Callable[[object], bytes]] = {"json": stdlib_dumps}
+if orjson is not None:
+    JSON_BACKENDS["orjson"] = orjson_dumps
+JSON_BACKEND: str = getenv(
+    "JSON_BACKEND", "orjson" if orjson is not None else "json")
+
+
+def init_json(app: Flask, backend: str = JSON_BACKEND) -> None:
+    """
+    init_json(app, backend)
+        registers the encoder used by json_response() on the application.
+        orjson is used when installed, the standard library otherwise.
+    """
+    if backend not in JSON_BACKENDS:
+        raise ValueError(f"JSON_BACKEND must be one of "
+                         f"{', '.join(JSON_BACKENDS)}, got {backend}.")
+    app.extensions[JSON_EXTENSION] = JSON_BACKENDS[backend]
+
+
+def dumps(obj: object) -> bytes:
+    if has_app_context():
+        encode = current_app.extensions.get(JSON_EXTENSION, stdlib_dumps)
+    else:
+        encode = JSON_BACKENDS[JSON_BACKEND]
+    with json_timer():
+        return encode(obj)
+
+
+def json_response(obj: object, status: int = 200) -> Response:
+    return current_app.response_class(
+        dumps(obj), status=status, mimetype="application/json")
+
+
+def format_row(row) -> dict:
+    """
+    format_row(row)
+        serializes either a model (or record) exposing format(), a plain
+        result row selected through SQLAlchemy Core or an already
+        formatted dict.
+    """
+    if isinstance(row, dict):
+        return row
+    if hasattr(row, "format"):
+        return row.format()
+    return row._asdict()
@@ -0,0 +1,176 @@
+import json
+import logging
+from datetime import datetime, timezone
+from logging.handlers import RotatingFileHandler
+from os import getenv
+from time import perf_counter
+from typing import (
+    List,
+    Optional
+)
+from flask import has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from .metrics import current_timings, request_route
+
+# milliseconds, 0 (the default) disables the slow-query log
+SLOW_QUERY_MS: float = float(getenv("SLOW_QUERY_MS", 0))
+SLOW_QUERY_LOG: str = getenv("SLOW_QUERY_LOG", "slow_queries.log")
+SLOW_QUERY_LOG_MAX_BYTES: int = int(
+    getenv("SLOW_QUERY_LOG_MAX_BYTES", 10 * 1024 * 1024))
+SLOW_QUERY_LOG_BACKUPS: int = int(getenv("SLOW_QUERY_LOG_BACKUPS", 5))
+SLOW_QUERY_EXPLAIN: bool = getenv("SLOW_QUERY_EXPLAIN", "1").lower() in \
+    ("1", "true", "yes")
+SLOW_QUERY_EXPLAIN_ANALYZE: bool = getenv(
+    "SLOW_QUERY_EXPLAIN_ANALYZE", "").lower() in ("1", "true", "yes")
+QUERY_STARTS: str = "slow_query_starts"
+EXPLAIN_SAVEPOINT: str = "slow_query_explain"
+REDACTED: str = "<redacted {} chars>"
+
+logger = logging.getLogger("flaskr.slow_queries")
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """formats the `slow_query` dict of a record as one JSON line"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(
+                record.created, timezone.utc).isoformat(),
+            "pid": record.process
+        }
+        entry.update(getattr(record, "slow_query", {"message": record.msg}))
+        return json.dumps(entry, default=str)
+
+
+def redact(parameters):
+    """
+    redact(parameters)
+        keeps the numbers, booleans and nulls of the bound parameters,
+        which are ids, limits and offsets here, and hides any text.
+    """
+    if isinstance(parameters, dict):
+        return {key: redact(value) for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [redact(value) for value in parameters]
+    if parameters is None or isinstance(parameters, (bool, int, float)):
+        return parameters
+    return REDACTED.format(len(str(parameters)))
+
+
+def current_route() -> Optional[str]:
+    timings = current_timings.get()
+    if timings is not None and timings.route is not None:
+        return f"{timings.method} {timings.route}"
+    if has_request_context():
+        return f"{request.method} {request_route()}"
+    return None
+
+
+def explain(conn, statement: str, parameters,
+            analyze: bool = SLOW_QUERY_EXPLAIN_ANALYZE) -> Optional[List[str]]:
+    """
+    explain(conn, statement, parameters, analyze)
+        plan of a SELECT statement, run on the DBAPI connection of `conn`
+        so that the EXPLAIN does not go through the engine events again.
+        Writes are never explained, an ANALYZE would execute them twice.
+    """
+    if not statement.lstrip().upper().startswith(("SELECT", "WITH")):
+        return None
+    dialect = conn.dialect.name
+    if dialect == "postgresql":
+        prefix = "EXPLAIN (ANALYZE, BUFFERS) " if analyze else "EXPLAIN "
+    elif dialect == "sqlite":
+        prefix = "EXPLAIN QUERY PLAN "
+    else:
+        return None
+
+    cursor = conn.connection.cursor()
+    try:
+        if dialect == "postgresql":
+            # a failed EXPLAIN must not abort the request's transaction
+            cursor.execute(f"SAVEPOINT {EXPLAIN_SAVEPOINT}")
+        try:
+            cursor.execute(prefix + statement, parameters)
+            rows = cursor.fetchall()
+        except Exception as e:
+            if dialect == "postgresql":
+                cursor.execute(f"ROLLBACK TO SAVEPOINT {EXPLAIN_SAVEPOINT}")
+            return [f"EXPLAIN failed: {e}"]
+        if dialect == "postgresql":
+            cursor.execute(f"RELEASE SAVEPOINT {EXPLAIN_SAVEPOINT}")
+            return [row[0] for row in rows]
+        # (id, parent, notused, detail)
+        return [row[-1] for row in rows]
+    finally:
+        cursor.close()
+
+
+class SlowQueryLog:
+    """
+    SlowQueryLog(threshold_ms, explain_plans)
+        engine event listeners logging every SQL statement slower than
+        `threshold_ms`, with the route that ran it, its redacted parameters
+        and, with `explain_plans`, its plan.
+    """
+
+    def __init__(self, threshold_ms: float = SLOW_QUERY_MS,
+                 explain_plans: bool = SLOW_QUERY_EXPLAIN):
+        self.threshold_ms = threshold_ms
+        self.explain_plans = explain_plans
+
+    def install(self) -> None:
+        event.listen(Engine, "before_cursor_execute", self.start_query)
+        event.listen(Engine, "after_cursor_execute", self.end_query)
+
+    def start_query(self, conn, cursor, statement, parameters, context,
+                    executemany) -> None:
+        conn.info.setdefault(QUERY_STARTS, []).append(perf_counter())
+
+    def end_query(self, conn, cursor, statement, parameters, context,
+                  executemany) -> None:
+        starts = conn.info.get(QUERY_STARTS)
+        if not starts:
+            return
+        duration_ms = (perf_counter() - starts.pop()) * 1000
+        if duration_ms < self.threshold_ms:
+            return
+
+        entry = {
+            "duration_ms": round(duration_ms, 3),
+            "route": current_route(),
+            "statement": statement,
+            "parameters": redact(
+                parameters[:1] if executemany else parameters)
+        }
+        if executemany:
+            entry["executemany"] = len(parameters)
+        elif self.explain_plans:
+            entry["plan"] = explain(conn, statement, parameters)
+        logger.warning("slow query", extra={"slow_query": entry})
+
+
+slow_query_log: Optional[SlowQueryLog] = None
+
+
+def init_slow_query_log(threshold_ms: float = SLOW_QUERY_MS,
+                        filename: str = SLOW_QUERY_LOG) -> None:
+    """
+    init_slow_query_log(threshold_ms, filename)
+        writes the slow queries as JSON lines to a rotating `filename`.
+        Does nothing when the threshold is 0 or the log already runs.
+    """
+    global slow_query_log
+    if threshold_ms <= 0 or slow_query_log is not None:
+        return
+
+    handler = RotatingFileHandler(filename,
+                                  maxBytes=SLOW_QUERY_LOG_MAX_BYTES,
+                                  backupCount=SLOW_QUERY_LOG_BACKUPS,
+                                  delay=True)
+    handler.setFormatter(JsonLinesFormatter())
+    logger.addHandler(handler)
+    logger.setLevel(logging.WARNING)
+    logger.propagate = False
+    slow_query_log = SlowQueryLog(threshold_ms)
+    slow_query_log.install()
@@ -1,17 +1,37 @@
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import TemporaryDirectory
+from time import monotonic, sleep
 from unittest import (
     TestCase,
-    main
+    main,
+    skipIf
 )
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import text
 from requests import (
     get,
     post,
     delete,
+    patch,
     put
 )
 from flaskr import create_app
+from flaskr.bulk import import_questions_command
+from flaskr.catalog import QuestionCatalog
+from flaskr.group_commit import (
+    GROUP_COMMIT_EXTENSION,
+    MSG_COMMIT_TIMEOUT,
+    MSG_INSERT_TIMEOUT,
+    init_group_commit
+)
+from flaskr.models import db, Category, Question, QuizSessionState
+from flaskr.payloads import MSG_UNPROCESSABLE
+from flaskr.quiz import quiz_sessions
 from models import setup_db
 from typing import List
+from json import loads
+import json
+import sqlite3
 
 QUESTION_KEYS = ["id", "question", "answer", "difficulty", "category"]
 BASE_URL = "http://flask_api:5000"
@@ -21,6 +41,13 @@ BODY = {
     "answer": "Yes, since Maradona managed to win the World Cup once, whereas Messi hasn't yet.",
     "difficulty": 7}
 
+try:
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from starlette.testclient import TestClient
+    from flaskr import asgi
+except ImportError:
+    asgi = None
+
 
 class TriviaTestCase(TestCase):
     """This class represents the trivia test case"""
@@ -334,6 +361,854 @@ class TriviaTestCase(TestCase):
         self.assertIsInstance(res.json(), dict)
         self.assertEqual(res.json().get("status"), 404)
 
+    def test_get_questions_cursor_pagination(self):
+        """
+            Given a psql instance and a flask app both up and running,
+            When I hit the /api/v1/questions endpoint with the GET method
+            And I follow the cursor returned in the X-Next-Cursor header,
+            Then I get the next page, whose ids follow the first page's ids.
+        """
+        first = get(f"{BASE_URL}/api/v1/questions")
+        self.assertEqual(first.status_code, 200)
+        cursor = first.headers.get("X-Next-Cursor")
+        self.assertIsNotNone(cursor)
+
+        second = get(f"{BASE_URL}/api/v1/questions", params={"cursor": cursor})
+        self.assertEqual(second.status_code, 200)
+        self.assertIsInstance(second.json(), list)
+        last_id = first.json()[-1].get("id")
+        for el in second.json():
+            self.assertGreater(el.get("id"), last_id)
+
+    def test_get_questions_invalid_cursor(self):
+        """
+            Given a psql instance and a flask app both up and running,
+            When I hit the /api/v1/questions endpoint with the GET method,
+            But an ill-constructed cursor is used,
+            Then I get a 400 response in json format.
+        """
+        res = get(f"{BASE_URL}/api/v1/questions", params={"cursor": "@@"})
+        self.assertEqual(res.ok, False)
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(res.json().get("status"), 400)
+
+    def test_get_questions_invalid_page_params(self):
+        """
+            Given a psql instance and a flask app both up and running,
+            When I hit the /api/v1/questions endpoint with the GET method,
+            But a page or an after_id which is not a number,
+            Then I get a 400 response in json format.
+        """
+        for params in ({"page": "abc"}, {"after_id": "x"}):
+            res = get(f"{BASE_URL}/api/v1/questions", params=params)
+            self.assertEqual(res.status_code, 400)
+            self.assertEqual(res.json().get("success"), False)
+
+    def test_get_questions_page_out_of_range(self):
+        """
+            Given a psql instance and a flask app both up and running,
+            When I hit the /api/v1/questions endpoint with the GET method,
+            But a page or an after_id too large for a database integer,
+            Then I get a 400 response in json format.
+        """
+        for params in ({"page": "99999999999999999999"},
+                       {"after_id": "99999999999999999999"},
+                       {"page": "99999999999999999999", "envelope": "1"}):
+            res = get(f"{BASE_URL}/api/v1/questions", params=params)
+            self.assertEqual(res.status_code, 400)
+            self.assertEqual(res.json().get("success"), False)
+
+    def test_get_q_using_search_term_prefix(self):
+        """
+            Given a psql instance and a flask app both up and running,
+            When I hit the /api/v1/questions/search-term endpoint
+            with the POST method
+            And only the beginning of a word is used as search term,
+            Then the questions containing a word with that prefix are returned.
+        """
+        post(f"{BASE_URL}/api/v1/questions", json=BODY)
+        res = post(
+            f"{BASE_URL}/api/v1/questions/search-term",
+            json={"search_term": "marad"})
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(len(res.json()) > 0)
+        for el in res.json():
+            self.assertIn(
+                "maradona",
+                f"{el.get('question')} {el.get('answer')}".lower())
+
+    def test_get_q_using_search_term_not_a_string(self):
+        """
+            Given a psql instance and a flask app both up and running,
+            When I hit the /api/v1/questions/search-term endpoint
+            with the POST method
+            And the search term is not a string,
+            Then I get a 400 response in json format.
+        """
+        for search_term in (5, ["a"], {"term": "a"}):
+            res = post(f"{BASE_URL}/api/v1/questions/search-term",
+                       json={"search_term": search_term})
+            self.assertEqual(res.status_code, 400)
+            self.assertEqual(res.json().get("message"),
+                             MSG_UNPROCESSABLE.format(params="search_term"))
+
+    def test_quizzes_exhausted_category(self):
+        """
+            Given a psql instance and a flask app both up and running,
+            When I hit the /api/v1/questions/quizzes endpoint
+            with the POST method
+            And every question of the category is listed as a previous
+            question,
+            Then I get a 200 response with an empty json object.
+        """
+        previous_questions: List[int] = list()
+        for _ in range(1000):
+            res = post(f"{BASE_URL}/api/v1/questions/quizzes", json={
+                "previous_questions": previous_questions,
+                "quiz_category": {"id": 2}})
+            self.assertEqual(res.status_code, 200)
+            if not res.json():
+                break
+            self.assertNotIn(res.json().get("id"), previous_questions)
+            previous_questions.append(res.json().get("id"))
+        self.assertEqual(res.json(), {})
+
+    def test_quiz_session_ok(self):
+        """
+            Given a psql instance and a flask app both up and running,
+            When I create a quiz session for a category
+            And I ask for the next question until the session is exhausted,
+            Then every question of the session is returned exactly once.
+        """
+        res = post(f"{BASE_URL}/api/v1/questions/quizzes/sessions",
+                   json={"quiz_category": {"id": 2}})
+        self.assertEqual(res.status_code, 201)
+        token = res.json().get("session")
+        total = res.json().get("total")
+        self.assertIsInstance(token, str)
+
+        asked: List[int] = list()
+        for _ in range(total + 1):
+            res = post(
+                f"{BASE_URL}/api/v1/questions/quizzes/sessions/{token}/next")
+            self.assertEqual(res.status_code, 200)
+            if not res.json():
+                break
+            [self.assertTrue(res.json().keys().__contains__(k))
+             for k in QUESTION_KEYS]
+            asked.append(res.json().get("id"))
+        self.assertEqual(len(asked), len(set(asked)))
+        self.assertTrue(len(asked) <= total)
+
+    def test_quiz_session_not_found(self):
+        """
+            Given a psql instance and a flask app both up and running,
+            When I ask for the next question of an unknown quiz session,
+            Then I get a 404 response in json format.
+        """
+        res = post(
+            f"{BASE_URL}/api/v1/questions/quizzes/sessions/unknown/next")
+        self.assertEqual(res.ok, False)
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(res.json().get("status"), 404)
+
+    def test_get_categories_not_modified(self):
+        """
+            Given a psql instance and a flask app both up and running,
+            When I hit the /api/v1/categories endpoint with the GET method
+            And the If-None-Match header holds the ETag of a previous response,
+            Then I get an empty 304 response.
+        """
+        res = get(f"{BASE_URL}/api/v1/categories")
+        etag = res.headers.get("ETag")
+        self.assertIsNotNone(etag)
+
+        res = get(f"{BASE_URL}/api/v1/categories",
+                  headers={"If-None-Match": etag})
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.content, b"")
+
+    def test_import_questions(self):
+        """
+            Given a psql instance and a flask app both up and running,
+            When I hit the /api/v1/questions/import endpoint
+            with the POST method
+            And a JSON array holding a valid and an invalid question is used,
+            Then I get a 201 response reporting one import and one error.
+        """
+        valid = {
+            "question": "Which country won the 1986 World Cup?",
+            "answer": "Argentina",
+            "category": 6,
+            "difficulty": 2}
+        res = post(f"{BASE_URL}/api/v1/questions/import",
+                   json=[valid, {"question": "Incomplete"}])
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(res.json().get("inserted"), 1)
+        self.assertEqual(res.json().get("failed"), 1)
+        self.assertEqual(res.json().get("errors")[0].get("row"), 2)
+
+    def test_import_questions_bad_content_type(self):
+        """
+            Given a psql instance and a flask app both up and running,
+            When I hit the /api/v1/questions/import endpoint
+            with the POST method,
+            But an unsupported Content-Type is used,
+            Then I get a 400 response in json format.
+        """
+        res = post(f"{BASE_URL}/api/v1/questions/import", data="question",
+                   headers={"Content-Type": "text/plain"})
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(res.json().get("status"), 400)
+
+    def test_export_questions(self):
+        """
+            Given a psql instance and a flask app both up and running,
+            When I hit the /api/v1/questions/export endpoint
+            with the GET method,
+            Then I get a 200 NDJSON response with one question per line.
+        """
+        res = get(f"{BASE_URL}/api/v1/questions/export",
+                  params={"category": 2})
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(
+            res.headers.get("Content-Type").startswith("application/x-ndjson"))
+        for line in res.text.splitlines():
+            el = loads(line)
+            [self.assertTrue(el.keys().__contains__(k)) for k in QUESTION_KEYS]
+
+    def test_export_questions_bad_category(self):
+        """
+            Given a psql instance and a flask app both up and running,
+            When I hit the /api/v1/questions/export endpoint
+            with the GET method,
+            But a category which is not an integer,
+            Then I get a 400 response in json format
+            Instead of an export of the whole catalog.
+        """
+        res = get(f"{BASE_URL}/api/v1/questions/export",
+                  params={"category": "abc"})
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(res.json().get("status"), 400)
+
+    def test_get_metrics(self):
+        """
+            Given a psql instance and a flask app both up and running,
+            When I hit the /api/v1/questions endpoint with the GET method
+            And then the /metrics endpoint,
+            Then the first response carries a Server-Timing header
+            And the metrics count the request in the Prometheus text format.
+        """
+        res = get(f"{BASE_URL}/api/v1/questions")
+        self.assertIn("db;dur=", res.headers.get("Server-Timing"))
+
+        res = get(f"{BASE_URL}/metrics")
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(
+            res.headers.get("Content-Type").startswith("text/plain"))
+        self.assertIn('trivia_http_requests_total{method="GET",'
+                      'route="/api/v1/questions",status="200"}', res.text)
+
+    def test_slow_query_log_redacts_text(self):
+        """
+            Given the slow query log parameters redaction,
+            When bound parameters mix ids and text,
+            Then the ids are kept and the text is hidden.
+        """
+        from flaskr.slow_queries import redact
+        self.assertEqual(redact((3, "secret", None)),
+                         [3, "<redacted 6 chars>", None])
+        self.assertEqual(redact({"id_1": 3}), {"id_1": 3})
+
+    def test_get_questions_envelope(self):
+        """
+            Given a psql instance and a flask app both up and running,
+            When I hit the /api/v1/questions endpoint with the GET method
+            And the envelope query parameter is set,
+            Then I get the questions wrapped with their total, the page,
+            the next cursor, the current category and the categories.
+        """
+        res = get(f"{BASE_URL}/api/v1/questions", params={"envelope": 1})
+        self.assertEqual(res.status_code, 200)
+        body = res.json()
+        self.assertLessEqual(len(body.get("questions")), 10)
+        self.assertGreaterEqual(body.get("total"), len(body.get("questions")))
+        self.assertEqual(body.get("page"), 1)
+        self.assertIsNone(body.get("current_category"))
+        self.assertIsInstance(body.get("categories"), dict)
+        for el in body.get("questions"):
+            [self.assertTrue(el.keys().__contains__(k)) for k in QUESTION_KEYS]
+
+    def test_get_questions_changes(self):
+        """
+            Given a psql instance and a flask app both up and running,
+            When I create then delete a question
+            And hit the /api/v1/questions/changes endpoint since the
+            last change preceding them,
+            Then I get the insert with the question and the delete as a
+            tombstone, in order.
+        """
+        since = get(f"{BASE_URL}/api/v1/questions/changes",
+                    params={"since": 0, "limit": 1}).json().get("last_seq")
+        new_id = post(f"{BASE_URL}/api/v1/questions", json=BODY).json()["id"]
+        delete(f"{BASE_URL}/api/v1/questions/{new_id}")
+
+        res = get(f"{BASE_URL}/api/v1/questions/changes",
+                  params={"since": since})
+        self.assertEqual(res.status_code, 200)
+        changes = [el for el in res.json().get("changes")
+                   if el["id"] == new_id]
+        self.assertEqual([el["action"] for el in changes],
+                         ["insert", "delete"])
+        self.assertEqual(changes[0]["question"]["answer"], BODY["answer"])
+        self.assertIsNone(changes[1]["question"])
+
+        res = get(f"{BASE_URL}/api/v1/questions/changes",
+                  params={"since": -1})
+        self.assertEqual(res.status_code, 400)
+
+    def test_get_questions_compressed(self):
+        """
+            Given a psql instance and a flask app both up and running,
+            When I hit the /api/v1/questions endpoint with the GET method
+            And I accept gzip encoded responses,
+            Then I get the questions, gzip encoded when large enough,
+            And the response varies on Accept-Encoding.
+        """
+        res = get(f"{BASE_URL}/api/v1/questions",
+                  headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(res.status_code, 200)
+        self.assertIn("Accept-Encoding", res.headers.get("Vary"))
+        self.assertIn(res.headers.get("Content-Encoding"), (None, "gzip"))
+        for el in res.json():
+            [self.assertTrue(el.keys().__contains__(k)) for k in QUESTION_KEYS]
+
+    def test_choose_encoding(self):
+        """
+            Given the content coding negotiation,
+            When clients accept gzip with various preferences,
+            Then gzip is chosen unless refused or not offered.
+        """
+        from flaskr.compression import choose_encoding
+        self.assertEqual(choose_encoding("gzip, deflate"), "gzip")
+        self.assertEqual(choose_encoding("deflate;q=1, gzip;q=0.5"), "gzip")
+        self.assertIsNone(choose_encoding("gzip;q=0"))
+        self.assertIsNone(choose_encoding("identity"))
+        self.assertIsNone(choose_encoding(None))
+
+    def test_get_questions_read_primary(self):
+        """
+            Given a psql instance and a flask app both up and running,
+            When I hit the /api/v1/questions endpoint with the GET method
+            And ask to read from the primary database,
+            Then I get the same questions as any other client.
+        """
+        res = get(f"{BASE_URL}/api/v1/questions",
+                  headers={"X-Read-Primary": "1"})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json(),
+                         get(f"{BASE_URL}/api/v1/questions").json())
+
+    def test_get_questions_by_ids(self):
+        """
+            Given a psql instance and a flask app both up and running,
+            When I hit the /api/v1/questions endpoint with the GET method
+            And a list of ids, one of them unknown,
+            Then I get the known questions in the requested order
+            And the unknown id as missing.
+        """
+        ids = [el["id"] for el in get(f"{BASE_URL}/api/v1/questions").json()]
+        requested = ids[:3][::-1] + [10 ** 9]
+        res = get(f"{BASE_URL}/api/v1/questions",
+                  params={"ids": ",".join(map(str, requested))})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([el["id"] for el in res.json().get("questions")],
+                         requested[:-1])
+        self.assertEqual(res.json().get("missing"), [10 ** 9])
+
+        res = post(f"{BASE_URL}/api/v1/questions/batch",
+                   json={"ids": requested})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json().get("missing"), [10 ** 9])
+
+    def test_post_questions_batch_bad_request(self):
+        """
+            Given a psql instance and a flask app both up and running,
+            When I hit the /api/v1/questions/batch endpoint with the POST
+            method and something else than a list of ids,
+            Then I get a 400 response in json format.
+        """
+        res = post(f"{BASE_URL}/api/v1/questions/batch", json={"ids": "1"})
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(res.json().get("success"), False)
+
+    def test_get_questions_fields(self):
+        """
+            Given a psql instance and a flask app both up and running,
+            When I hit the question endpoints with a list of fields,
+            Then I only get those fields and the id
+            And an unknown field is rejected.
+        """
+        res = get(f"{BASE_URL}/api/v1/questions",
+                  params={"fields": "question,category"})
+        self.assertEqual(res.status_code, 200)
+        for question in res.json():
+            self.assertEqual(set(question), {"id", "question", "category"})
+
+        question_id = res.json()[0]["id"]
+        res = get(f"{BASE_URL}/api/v1/questions/{question_id}",
+                  params={"fields": "answer"})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(set(res.json()), {"id", "answer"})
+
+        res = get(f"{BASE_URL}/api/v1/questions",
+                  params={"fields": "question,rating"})
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(res.json().get("success"), False)
+
+    def test_bulk_update_and_delete_questions(self):
+        """
+            Given a psql instance and a flask app both up and running,
+            When I hit the /api/v1/questions endpoint with the PATCH method
+            And then with the DELETE method, for a list of ids,
+            Then I get the number of questions updated and deleted
+            And the questions are gone.
+        """
+        ids = [post(f"{BASE_URL}/api/v1/questions", json=BODY).json()["id"]
+               for _ in range(3)]
+        res = patch(f"{BASE_URL}/api/v1/questions",
+                    json={"ids": ids, "set": {"difficulty": 5}})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json().get("updated"), 3)
+        res = get(f"{BASE_URL}/api/v1/questions/{ids[0]}")
+        self.assertEqual(res.json().get("difficulty"), 5)
+
+        res = delete(f"{BASE_URL}/api/v1/questions", json={"ids": ids})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json().get("deleted"), 3)
+        self.assertEqual(
+            get(f"{BASE_URL}/api/v1/questions/{ids[0]}").status_code, 404)
+
+    def test_bulk_delete_questions_without_filter(self):
+        """
+            Given a psql instance and a flask app both up and running,
+            When I hit the /api/v1/questions endpoint with the DELETE method
+            And neither ids nor a category,
+            Then I get a 400 error and nothing is deleted.
+        """
+        res = delete(f"{BASE_URL}/api/v1/questions", json={})
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(res.json().get("success"), False)
+
+    def test_post_questions_concurrently(self):
+        """
+            Given a psql instance and a flask app both up and running,
+            When I hit the /api/v1/questions endpoint with the POST method
+            From several clients at once,
+            Then every question is created with its own id.
+        """
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            responses = list(executor.map(
+                lambda _: post(f"{BASE_URL}/api/v1/questions", json=BODY),
+                range(16)))
+        self.assertTrue(all(res.status_code == 201 for res in responses))
+        ids = {res.json()["id"] for res in responses}
+        self.assertEqual(len(ids), 16)
+        for question_id in ids:
+            delete(f"{BASE_URL}/api/v1/questions/{question_id}")
+
+    def test_quizzes_invalid_previous_questions(self):
+        """
+            Given a psql instance and a flask app both up and running,
+            When I hit the /api/v1/questions/quizzes endpoint
+            with the POST method
+            And previous_questions holds something else than ids,
+            Then I get a 400 response in json format.
+        """
+        res = post(f"{BASE_URL}/api/v1/questions/quizzes", json={
+            "quiz_category": {"id": 1},
+            "previous_questions": [{"id": 1}, [2]]})
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(res.json().get("success"), False)
+
+    def test_quiz_session_across_workers(self):
+        """
+            Given a psql instance and a flask app served by several workers,
+            When I create a quiz session
+            And I ask for its next questions from several clients at once,
+            Then every worker finds the session
+            And no question is returned twice.
+        """
+        res = post(f"{BASE_URL}/api/v1/questions/quizzes/sessions",
+                   json={"quiz_category": {"id": 0}})
+        self.assertEqual(res.status_code, 201)
+        token = res.json().get("session")
+        total = res.json().get("total")
+
+        url = f"{BASE_URL}/api/v1/questions/quizzes/sessions/{token}/next"
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            responses = list(executor.map(lambda _: post(url), range(total)))
+        self.assertTrue(all(res.status_code == 200 for res in responses))
+        ids = [res.json().get("id") for res in responses]
+        self.assertEqual(len(set(ids)), total)
+        self.assertEqual(post(url).json(), {})
+
+    def test_import_questions_unknown_category(self):
+        """
+            Given a psql instance and a flask app both up and running,
+            When I hit the /api/v1/questions/import endpoint
+            with the POST method
+            And one question of the batch has an unknown category,
+            Then only that question is reported as rejected
+            And the others are imported.
+        """
+        valid = {
+            "question": "Which country hosted the 1998 World Cup?",
+            "answer": "France",
+            "category": 6,
+            "difficulty": 2}
+        res = post(f"{BASE_URL}/api/v1/questions/import",
+                   json=[valid, valid, {**valid, "category": 6 ** 7}, valid])
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(res.json().get("inserted"), 3)
+        self.assertEqual(res.json().get("failed"), 1)
+        self.assertEqual(res.json().get("errors")[0].get("row"), 3)
+
+    def test_post_questions_not_integer(self):
+        """
+            Given a psql instance and a flask app both up and running,
+            When I hit the /api/v1/questions endpoint with the POST method
+            And a boolean or a fractional category or difficulty,
+            Then I get a 422 response and no question is created.
+        """
+        for field, value in (("category", True), ("difficulty", 2.7)):
+            res = post(f"{BASE_URL}/api/v1/questions",
+                       json={**BODY, field: value})
+            self.assertEqual(res.status_code, 422)
+            self.assertEqual(res.json().get("success"), False)
+
+
+def create_sqlite_app(database_path: str):
+    """
+    create_sqlite_app(database_path)
+        the Flask app on a new sqlite database holding 4 categories and
+        8 questions.
+    """
+    app = create_app({"SQLALCHEMY_DATABASE_URI": database_path})
+    with app.app_context():
+        db.create_all()
+        for category in ("Science", "Art", "Geography", "History"):
+            db.session.add(Category(category))
+        for i in range(8):
+            db.session.add(Question(f"Question {i}?", f"Answer {i}",
+                                    i % 4 + 1, i % 5 + 1))
+        db.session.commit()
+    return app
+
+
+@skipIf(asgi is None, "requires the packages of requirements-async.txt")
+class AsgiParityTestCase(TestCase):
+    """
+        Sends the same requests to the Flask and the ASGI applications,
+        both on a temporary sqlite database, and compares the responses.
+    """
+
+    REQUESTS = [
+        ("get", "/api/v1/categories", None),
+        ("get", "/api/v1/categories/99", None),
+        ("get", "/api/v1/categories/99/questions", None),
+        ("get", "/api/v1/questions?page=x", None),
+        ("get", "/api/v1/questions?after_id=x", None),
+        ("get", "/api/v1/questions?page=99999999999999999999", None),
+        ("get", "/api/v1/questions?fields=x", None),
+        ("get", "/api/v1/questions/changes?since=x", None),
+        ("get", "/api/v1/questions/export?category=abc", None),
+        ("get", "/api/v1/questions/9999", None),
+        ("delete", "/api/v1/questions/9999", None),
+        ("put", "/api/v1/questions", {}),
+        ("post", "/api/v1/questions", {}),
+        ("post", "/api/v1/questions", {**BODY, "category": True}),
+        ("post", "/api/v1/questions/search-term", {"search_term": 5}),
+        ("post", "/api/v1/questions/search-term", ["a"]),
+        ("post", "/api/v1/questions/quizzes",
+         {"quiz_category": None, "previous_questions": []}),
+        ("post", "/api/v1/questions/quizzes",
+         {"quiz_category": {"id": 1}, "previous_questions": [[1]]}),
+        ("post", "/api/v1/questions/quizzes",
+         {"quiz_category": {"id": 99}, "previous_questions": []}),
+        ("post", "/api/v1/questions/quizzes/sessions", {}),
+        ("post", "/api/v1/questions/quizzes/sessions",
+         {"quiz_category": "x"}),
+        ("post", "/api/v1/questions/quizzes/sessions",
+         {"quiz_category": {"id": 99}}),
+        ("post", "/api/v1/questions/quizzes/sessions/unknown/next", None),
+        ("delete", "/api/v1/questions/quizzes/sessions/unknown", None)
+    ]
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = TemporaryDirectory()
+        database_path = f"sqlite:///{cls.directory.name}/trivia.db"
+        cls.app = create_sqlite_app(database_path)
+        # the ASGI module opens its engine on DATABASE_URL when imported
+        cls.engine = asgi.engine
+        asgi.engine = create_async_engine(
+            asgi.async_database_url(database_path))
+
+    @classmethod
+    def tearDownClass(cls):
+        asgi.engine = cls.engine
+        cls.directory.cleanup()
+
+    def test_same_responses(self):
+        """
+            Given the Flask and the ASGI applications on the same database,
+            When I send them the same valid and invalid requests,
+            Then I get the same status codes and error payloads.
+        """
+        flask_client = self.app.test_client()
+        asgi_client = TestClient(asgi.app)
+        for method, path, body in self.REQUESTS:
+            kwargs = {} if body is None else {"json": body}
+            expected = getattr(flask_client, method)(path, **kwargs)
+            res = getattr(asgi_client, method)(path, **kwargs)
+            self.assertEqual(res.status_code, expected.status_code, path)
+            self.assertEqual(res.json(), expected.get_json(), path)
+
+    def test_same_quiz_session(self):
+        """
+            Given the Flask and the ASGI applications on the same database,
+            When I create a quiz session with one of them,
+            Then the other one serves its next questions.
+        """
+        flask_client = self.app.test_client()
+        asgi_client = TestClient(asgi.app)
+        res = flask_client.post("/api/v1/questions/quizzes/sessions",
+                                json={"quiz_category": {"id": 2}})
+        self.assertEqual(res.status_code, 201)
+        url = f"/api/v1/questions/quizzes/sessions/{res.get_json()['session']}"
+
+        asked = [asgi_client.post(f"{url}/next").json().get("id"),
+                 flask_client.post(f"{url}/next").get_json().get("id")]
+        self.assertEqual(len(set(asked)), 2)
+        self.assertEqual(asgi_client.post(f"{url}/next").json(), {})
+        self.assertEqual(asgi_client.delete(url).status_code, 204)
+        self.assertEqual(flask_client.delete(url).status_code, 404)
+
+    def test_same_quiz_session_limit(self):
+        """
+            Given the Flask and the ASGI applications on the same database
+            And as many live quiz sessions as QUIZ_MAX_SESSIONS,
+            When I create one more with either of them,
+            Then I get the same 503 response with a Retry-After header.
+        """
+        flask_client = self.app.test_client()
+        asgi_client = TestClient(asgi.app)
+        url = "/api/v1/questions/quizzes/sessions"
+        body = {"quiz_category": {"id": 2}}
+        with self.app.app_context():
+            live = QuizSessionState.query.count()
+        max_sessions, quiz_sessions.max_sessions = \
+            quiz_sessions.max_sessions, live + 1
+        try:
+            self.assertEqual(flask_client.post(url, json=body).status_code,
+                             201)
+            expected = flask_client.post(url, json=body)
+            res = asgi_client.post(url, json=body)
+        finally:
+            quiz_sessions.max_sessions = max_sessions
+        self.assertEqual(expected.status_code, 503)
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(res.json(), expected.get_json())
+        self.assertEqual(res.headers.get("Retry-After"),
+                         expected.headers.get("Retry-After"))
+
+
+class GroupCommitTestCase(TestCase):
+    """
+        Submits questions through init_group_commit() on a temporary sqlite
+        database, whose writes can be blocked by holding its lock.
+    """
+
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.database_file = f"{self.directory.name}/trivia.db"
+        self.app = create_sqlite_app(f"sqlite:///{self.database_file}")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def post_questions(self, bodies: List[dict]) -> List[object]:
+        with ThreadPoolExecutor(max_workers=len(bodies)) as executor:
+            return list(executor.map(
+                lambda body: self.app.test_client().post(
+                    "/api/v1/questions", json=body),
+                bodies))
+
+    def lock_database(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.database_file, isolation_level=None)
+        connection.execute("BEGIN IMMEDIATE")
+        return connection
+
+    def wait_for(self, condition) -> None:
+        deadline = monotonic() + 5
+        while not condition():
+            self.assertLess(monotonic(), deadline)
+            sleep(0.01)
+
+    def test_group_commit_rejected_question(self):
+        """
+            Given a flask app committing question submissions together,
+            When I submit several questions at once
+            And the database rejects one of them,
+            Then I get a 422 response for that question only
+            And a 201 response for each of the others.
+        """
+        init_group_commit(self.app, enabled=True, window=0.1)
+        with self.app.app_context():
+            db.session.execute(text(
+                "CREATE TRIGGER reject_question BEFORE INSERT ON questions "
+                "WHEN NEW.answer = 'rejected' "
+                "BEGIN SELECT RAISE(ABORT, 'rejected'); END"))
+            db.session.commit()
+
+        bodies = [{**BODY, "answer": f"answer {i}"} for i in range(7)]
+        bodies.insert(3, {**BODY, "answer": "rejected"})
+        responses = self.post_questions(bodies)
+        self.assertEqual([res.status_code for res in responses],
+                         [201, 201, 201, 422, 201, 201, 201, 201])
+        ids = {res.get_json()["id"] for res in responses
+               if res.status_code == 201}
+        self.assertEqual(len(ids), 7)
+
+    def test_group_commit_queue_full(self):
+        """
+            Given a flask app committing question submissions together
+            And room for a single submission waiting for the writer,
+            When the writer is blocked on a commit
+            And I submit a third question,
+            Then I get a 503 response with a Retry-After header
+            And the first two questions are created once unblocked.
+        """
+        init_group_commit(self.app, enabled=True, max_batch=1,
+                          max_queue=1, queue_timeout=0.1)
+        committer = self.app.extensions[GROUP_COMMIT_EXTENSION]
+        lock = self.lock_database()
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            first = executor.submit(self.post_questions, [BODY])
+            self.wait_for(lambda: committer._queue is not None
+                          and committer._queue.empty())
+            second = executor.submit(self.post_questions, [BODY])
+            self.wait_for(lambda: committer._queue.full())
+
+            res = self.app.test_client().post("/api/v1/questions", json=BODY)
+            self.assertEqual(res.status_code, 503)
+            self.assertEqual(res.headers.get("Retry-After"), "1")
+            lock.rollback()
+            self.assertEqual(first.result()[0].status_code, 201)
+            self.assertEqual(second.result()[0].status_code, 201)
+
+    def test_group_commit_wait_timeout(self):
+        """
+            Given a flask app committing question submissions together,
+            When the writer is blocked on a commit for longer than
+            GROUP_COMMIT_WAIT_TIMEOUT,
+            Then the submissions get a 503 response
+            And the questions not yet taken by the writer are not created.
+        """
+        init_group_commit(self.app, enabled=True, max_batch=1,
+                          wait_timeout=0.2)
+        lock = self.lock_database()
+        try:
+            responses = self.post_questions([BODY, BODY])
+        finally:
+            lock.rollback()
+        self.assertEqual([res.status_code for res in responses], [503, 503])
+        messages = {res.get_json()["message"] for res in responses}
+        self.assertEqual(messages, {MSG_INSERT_TIMEOUT, MSG_COMMIT_TIMEOUT})
+
+        # the writer commits the question it had taken, skips the withdrawn
+        # one, then commits this one
+        res = self.app.test_client().post("/api/v1/questions", json=BODY)
+        self.assertEqual(res.status_code, 201)
+        with self.app.app_context():
+            self.assertEqual(Question.query.count(), 10)
+
+
+class CatalogSnapshotTestCase(TestCase):
+    """
+        Checks that a catalog snapshot loaded by a worker notices the writes
+        of the other processes sharing its temporary sqlite database.
+    """
+
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.app = create_sqlite_app(
+            f"sqlite:///{self.directory.name}/trivia.db")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_snapshot_reloads_after_cli_import(self):
+        """
+            Given a worker holding a loaded catalog snapshot,
+            When questions are imported with flask import-questions,
+            Then the snapshot reloads and serves the imported questions.
+        """
+        snapshot = QuestionCatalog(check_interval=0)
+        with self.app.app_context():
+            snapshot.load()
+            self.assertEqual(snapshot.count(), 8)
+
+        source = f"{self.directory.name}/questions.json"
+        with open(source, "w") as questions:
+            json.dump([{**BODY, "category": 1}] * 3, questions)
+        result = self.app.test_cli_runner().invoke(
+            import_questions_command, [source])
+        self.assertEqual(result.exit_code, 0, result.output)
+
+        with self.app.app_context():
+            self.assertEqual(snapshot.count(), 11)
+            self.assertEqual(snapshot.count(1), 5)
+
+
+class QuizSessionTestCase(TestCase):
+    """
+        Creates quiz sessions on a temporary sqlite database.
+    """
+
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.app = create_sqlite_app(
+            f"sqlite:///{self.directory.name}/trivia.db")
+        self.max_sessions = quiz_sessions.max_sessions
+        quiz_sessions.max_sessions = 2
+
+    def tearDown(self):
+        quiz_sessions.max_sessions = self.max_sessions
+        self.directory.cleanup()
+
+    def test_quiz_session_limit(self):
+        """
+            Given a flask app with QUIZ_MAX_SESSIONS live quiz sessions,
+            When I create one more,
+            Then I get a 503 response with a Retry-After header
+            Until one of the live sessions ends.
+        """
+        client = self.app.test_client()
+        url = "/api/v1/questions/quizzes/sessions"
+        body = {"quiz_category": {"id": 2}}
+        tokens = [client.post(url, json=body).get_json().get("session")
+                  for _ in range(2)]
+
+        res = client.post(url, json=body)
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(res.headers.get("Retry-After"), "1")
+        self.assertEqual(res.get_json().get("success"), False)
+
+        self.assertEqual(client.delete(f"{url}/{tokens[0]}").status_code, 204)
+        self.assertEqual(client.post(url, json=body).status_code, 201)
+
 
 if __name__ == "__main__":
     main()
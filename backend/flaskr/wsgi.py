@@ -0,0 +1,41 @@
+"""
+Production entry point, e.g. `gunicorn -c gunicorn.conf.py flaskr.wsgi:app`.
+
+The application is created and its caches are warmed up when this module is
+imported. With gunicorn's preload_app this happens once in the master
+process and the forked workers inherit the warm caches.
+"""
+from os import getenv
+import logging
+from flask import Flask
+from . import create_app
+from .cache import category_cache
+from .catalog import CATALOG_SNAPSHOT, question_catalog
+from .models import db
+from .pagination import PageArgs
+from .quiz import quiz_sampler
+from .search import question_search
+
+WARM_UP: bool = getenv("WARM_UP", "1").lower() in ("1", "true", "yes")
+
+
+def warm_up(app: Flask) -> None:
+    """
+    warm_up(app)
+        loads the in-memory structures served on the hot path, then closes
+        the pooled connections so that forked workers never share a socket.
+    """
+    with app.app_context():
+        category_cache.page(PageArgs())
+        quiz_sampler.load()
+        question_search.warm_up()
+        if CATALOG_SNAPSHOT:
+            question_catalog.load()
+        db.session.remove()
+        db.engine.dispose()
+    logging.info("caches warmed up.")
+
+
+app = create_app()
+if WARM_UP:
+    warm_up(app)
@@ -0,0 +1,35 @@
+"""
+Gunicorn settings for `gunicorn -c gunicorn.conf.py flaskr.wsgi:app`.
+
+Every setting can be overridden through the GUNICORN_* environment variables
+(WEB_CONCURRENCY for the number of worker processes). Send SIGHUP to the
+master process for a graceful reload of the workers.
+"""
+import multiprocessing
+from os import getenv
+
+bind = getenv("GUNICORN_BIND", "0.0.0.0:5000")
+workers = int(getenv("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+# sync, gthread or gevent (the latter requires gevent and psycogreen)
+worker_class = getenv("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(getenv("GUNICORN_THREADS", 4))
+worker_connections = int(getenv("GUNICORN_WORKER_CONNECTIONS", 1000))
+
+# The app is loaded (and its caches warmed up) once in the master process,
+# before forking. gevent must patch the standard library before the app is
+# imported, so its workers load the app themselves.
+preload_app = worker_class != "gevent"
+
+timeout = int(getenv("GUNICORN_TIMEOUT", 30))
+graceful_timeout = int(getenv("GUNICORN_GRACEFUL_TIMEOUT", 30))
+keepalive = int(getenv("GUNICORN_KEEPALIVE", 5))
+max_requests = int(getenv("GUNICORN_MAX_REQUESTS", 0))
+max_requests_jitter = int(getenv("GUNICORN_MAX_REQUESTS_JITTER", 0))
+accesslog = getenv("GUNICORN_ACCESSLOG", "-")
+loglevel = getenv("GUNICORN_LOGLEVEL", "info")
+
+
+def post_fork(server, worker):
+    if worker_class == "gevent":
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
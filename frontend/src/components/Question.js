@@ -1,20 +1,40 @@
 import React, { Component } from 'react';
 import '../stylesheets/Question.css';
+import $ from 'jquery';
+import { apiUrl } from './config';
 
 class Question extends Component {
   constructor(){
     super();
     this.state = {
-      visibleAnswer: false
+      visibleAnswer: false,
+      answer: undefined
     }
   }
 
   flipVisibility() {
+    if (this.props.answer === undefined && this.state.answer === undefined) {
+      this.fetchAnswer();
+    }
     this.setState({visibleAnswer: !this.state.visibleAnswer});
   }
 
+  fetchAnswer() {
+    $.ajax({
+      url: `${apiUrl}/api/v1/questions/${this.props.id}?fields=answer`,
+      type: "GET",
+      success: (result) => {
+        this.setState({answer: result.answer});
+      },
+      error: (error) => {
+        alert('Unable to load the answer. Please try your request again');
+      }
+    })
+  }
+
   render() {
-    const { question, answer, category, difficulty } = this.props;
+    const { question, category, difficulty } = this.props;
+    const answer = this.props.answer !== undefined ? this.props.answer : this.state.answer;
     return (
       <div className="Question-holder">
         <div className="Question">{question}</div>
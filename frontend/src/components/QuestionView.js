@@ -6,6 +6,9 @@ import Search from './Search';
 import $ from 'jquery';
 import { apiUrl } from './config';
 
+// the answers are fetched by Question when revealed
+const LIST_FIELDS = 'question,category,difficulty';
+
 class QuestionView extends Component {
   constructor(){
     super();
@@ -19,38 +22,19 @@ class QuestionView extends Component {
   }
 
   componentDidMount() {
-    this.categories = this.getCategories();
     this.getQuestions();
   }
 
-  getCategories = () => {
-    $.ajax({
-      url: `${apiUrl}/api/v1/categories`,
-      type: "GET",
-      success: (result) => {
-        const categories = {};
-        result.forEach( cat => { categories[cat.id] = cat.type})
-        this.setState({categories: categories})
-        return;
-      },
-      error: (error) => {
-          alert('Unable to load questions. Please try your request again')
-          return;  
-      }
-    })
-  }
   getQuestions = () => {
     $.ajax({
-      url: `${apiUrl}/api/v1/questions?page=${this.state.page}`, //TODO: update request URL
+      url: `${apiUrl}/api/v1/questions?page=${this.state.page}&envelope=1&fields=${LIST_FIELDS}`,
       type: "GET",
       success: (result) => {
-        this.setState( (prev) => {
-          return { 
-            questions: result,
-            totalQuestions: result.length,
-            currentCategory: (result[result.length - 1] !== undefined) ? 
-              result[result.length - 1].category : prev.currentCategory 
-          }
+        this.setState({
+          questions: result.questions,
+          totalQuestions: result.total,
+          categories: result.categories,
+          currentCategory: result.current_category
         })
         console.log(this.state.categories)
         return;
@@ -82,15 +66,14 @@ class QuestionView extends Component {
 
   getByCategory= (id) => {
     $.ajax({
-      url: `${apiUrl}/api/v1/categories/${id}/questions`, //TODO: update request URL
+      url: `${apiUrl}/api/v1/categories/${id}/questions?envelope=1&fields=${LIST_FIELDS}`,
       type: "GET",
       success: (result) => {
-        this.setState( (prev) => {
-          return {  
-            questions: result,
-            totalQuestions: result.length,
-            currentCategory: (result.length > 0) ? id : prev.currentCategory
-          }
+        this.setState({
+          questions: result.questions,
+          totalQuestions: result.total,
+          categories: result.categories,
+          currentCategory: result.current_category
         })
         console.log(this.state)
         return;
@@ -104,7 +87,7 @@ class QuestionView extends Component {
 
   submitSearch = (searchTerm) => {
     $.ajax({
-      url: `${apiUrl}/api/v1/questions/search-term`, //TODO: update request URL
+      url: `${apiUrl}/api/v1/questions/search-term?fields=${LIST_FIELDS}`, //TODO: update request URL
       type: "POST",
       dataType: 'json',
       contentType: 'application/json',
@@ -169,6 +152,7 @@ class QuestionView extends Component {
           {this.state.questions.map((q, ind) => (
             <Question
               key={q.id}
+              id={q.id}
               question={q.question}
               answer={q.answer}
               category={this.state.categories[q.category]} 